@@ -0,0 +1,156 @@
+"""Compare single-walk and multi-pass lossy GPML optimization
+
+Runs both over compressed GPML files, checks that their output is
+byte-identical, and reports the time each took.
+
+GPML in data/gpml/ is already lossy-optimized, so there most passes find
+nothing to remove, and the timings understate work on raw upstream GPML.
+For a representative benchmark, point --gpml-dir at raw GPML, gzipped.
+"""
+import argparse
+import glob
+import gzip
+import re
+from time import perf_counter
+
+from lxml import etree
+
+from gpml import lossy_optimize_gpml, condense_colors
+
+def lossy_optimize_gpml_multipass(gpml, pwid):
+    """Reference lossy optimization, as it was before the single-walk rewrite
+
+    Kept to verify and time the current `lossy_optimize_gpml` against.
+    """
+    ns_map = {
+        "gpml": "http://pathvisio.org/GPML/2013a",
+        "bp": "http://www.biopax.org/release/biopax-level3.owl#"
+    }
+
+    gpml = re.sub(pwid.lower(), '', gpml)
+
+    gpml = gpml.replace('<?xml version="1.0" encoding="UTF-8"?>\n', '')
+
+    tree = etree.fromstring(gpml)
+
+    positional_attrs = [
+        "X", "Y", "CenterX", "CenterY", "Valign", "RelX", "RelY", "Rotation",
+        "Position"
+    ]
+    extraneous_attrs = positional_attrs + [
+        "ZOrder", "FontWeight", "FontSize", "LineThickness",
+        "Width", "Height"
+    ]
+    elements = tree.xpath('//*')
+    for el in elements:
+        for attr_name in extraneous_attrs:
+            if attr_name in el.attrib: del el.attrib[attr_name]
+
+    extraneous_elements = [
+        "Attribute", "Xref", "Label", "Comment",
+        "BiopaxRef", "Biopax"
+    ]
+    for el_name in extraneous_elements:
+        selector = f"//gpml:{el_name}"
+        attribute_elements = tree.xpath(selector, namespaces=ns_map)
+        for el in attribute_elements:
+            el.getparent().remove(el)
+
+    condense_colors(tree)
+
+    xml = etree.tostring(tree).decode("utf-8")
+
+    xml = '<?xml version="1.0" encoding="UTF-8"?>\n' + xml
+
+    rdf_datatype = 'rdf:datatype="http://www.w3.org/2001/XMLSchema#string"'
+    xml = re.sub(rdf_datatype, '', xml)
+
+    xml = re.sub('<Xref Database="" ID="" />', '', xml)
+
+    xml = re.sub('<Graphics/>\n', '', xml)
+
+    xml = re.sub('<Point/>\n', '', xml)
+
+    xml = re.sub('Shape="None" ', '', xml)
+
+    return xml
+
+def load_gpml(gpml_dir):
+    """Get list of (pathway ID, GPML string) for compressed GPML files
+    """
+    gpmls = []
+    for gpml_path in sorted(glob.glob(f'{gpml_dir}*.xml.gz')):
+        pwid = re.search(r"WP\d+", gpml_path).group()
+        with gzip.open(gpml_path, 'rt', encoding='utf-8') as f:
+            gpmls.append([pwid, f.read()])
+    return gpmls
+
+def time_optimizer(optimizer, gpmls):
+    """Get seconds taken to optimize all GPML, and the optimized output
+    """
+    start = perf_counter()
+    outputs = [optimizer(gpml, pwid) for pwid, gpml in gpmls]
+    return perf_counter() - start, outputs
+
+def bench(gpml_dir, repeats=3):
+    gpmls = load_gpml(gpml_dir)
+    if len(gpmls) == 0:
+        print(
+            f"No *.xml.gz files in {gpml_dir}; run from the repository "
+            "root, or pass --gpml-dir"
+        )
+        return False
+    print(f"Loaded {len(gpmls)} GPML files from {gpml_dir}")
+
+    optimizers = [
+        ["multi-pass", lossy_optimize_gpml_multipass],
+        ["single-walk", lossy_optimize_gpml]
+    ]
+    best_times = {}
+    outputs = {}
+    for name, optimizer in optimizers:
+        times = []
+        for i in range(repeats):
+            seconds, outputs[name] = time_optimizer(optimizer, gpmls)
+            times.append(seconds)
+        best_times[name] = min(times)
+        print(f"{name}: {best_times[name]:.3f} s (best of {repeats})")
+
+    mismatches = [
+        pwid for (pwid, gpml), old, new
+        in zip(gpmls, outputs["multi-pass"], outputs["single-walk"])
+        if old != new
+    ]
+    if len(mismatches) > 0:
+        print(f"{len(mismatches)} pathways differ:")
+        print(",".join(mismatches))
+    else:
+        print("Output is byte-identical for all pathways")
+
+    speedup = best_times["multi-pass"] / best_times["single-walk"]
+    print(f"Speedup: {speedup:.2f}x")
+    return len(mismatches) == 0
+
+# Command-line handler
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--gpml-dir",
+        help=(
+            "Directory of compressed GPML files.  (default: %(default)s)"
+        ),
+        default="data/gpml/"
+    )
+    parser.add_argument(
+        "--repeats",
+        help="Number of timed runs per optimizer.  (default: %(default)s)",
+        type=int,
+        default=3
+    )
+    args = parser.parse_args()
+
+    if not bench(args.gpml_dir, args.repeats):
+        exit(1)
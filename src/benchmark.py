@@ -0,0 +1,344 @@
+"""Benchmark each pipeline stage over the checked-in data/ corpora
+
+Times label extraction, GPML optimization, color condensing, interaction
+optimization and compression, each in a fresh process so peak memory is
+attributable to one stage.  Each stage runs several times, and its best
+run is kept, so one slow run doesn't read as a regression.  Throughput is
+of uncompressed input for every stage, and stage memory is peak resident
+memory above that after loading the corpus.  Results can be saved as JSON,
+and compared against a saved baseline to fail on regressions.
+
+Example:
+
+  python src/benchmark.py --output bench.json
+  python src/benchmark.py --baseline bench.json
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import glob
+import gzip
+import json
+import multiprocessing
+import os
+import re
+import resource
+from time import perf_counter
+
+from lxml import etree
+
+from labels import extract_labels
+from gpml import lossy_optimize_gpml, condense_colors
+from get_interactions import lossy_optimize_interactions
+
+stage_names = [
+    "get_gpml_labels",
+    "lossy_optimize_gpml",
+    "condense_colors",
+    "lossy_optimize_interactions",
+    "compression"
+]
+
+# Stage memory below this many MB over baseline is noise, not a regression
+rss_slack_mb = 5
+
+def inflate_interactions(json_str):
+    """Re-add fields that lossy_optimize_interactions removes
+
+    Turns a checked-in per-gene record back into the shape that
+    findInteractions returns, so it can be optimized again.
+    """
+    data = json.loads(json_str)
+    for result in data["result"]:
+        result["score"] = {"0": 1.0}
+        result["url"] = (
+            "https://www.wikipathways.org/index.php/Pathway:" + result["id"]
+        )
+        result["revision"] = "0"
+        fields = result["fields"]
+        for field in fields:
+            fields[field]["name"] = field
+        fields["indexerId"] = {"name": "indexerId", "values": ["0"]}
+        fields["source"] = {"name": "source", "values": ["0"]}
+    return json.dumps(data)
+
+def read_gzip(path):
+    with gzip.open(path, 'rb') as f:
+        return f.read()
+
+def get_gzip_size(path):
+    """Get uncompressed size of a gzip file, from its trailer
+    """
+    with open(path, "rb") as f:
+        f.seek(-4, os.SEEK_END)
+        return int.from_bytes(f.read(4), "little")
+
+def load_gpml_paths(gpml_dir, gene_dir, limit):
+    paths = sorted(glob.glob(f"{gpml_dir}*.xml.gz"))[:limit]
+    return [[path, get_gzip_size(path)] for path in paths]
+
+def load_gpml(gpml_dir, gene_dir, limit):
+    items = []
+    for path in sorted(glob.glob(f"{gpml_dir}*.xml.gz"))[:limit]:
+        pwid = re.search(r"WP\d+", path).group()
+        xml = read_gzip(path)
+        items.append([[xml.decode("utf-8"), pwid], len(xml)])
+    return items
+
+def load_gpml_trees(gpml_dir, gene_dir, limit):
+    items = []
+    for path in sorted(glob.glob(f"{gpml_dir}*.xml.gz"))[:limit]:
+        xml = read_gzip(path)
+        items.append([etree.fromstring(xml), len(xml)])
+    return items
+
+def load_raw_interactions(gpml_dir, gene_dir, limit):
+    items = []
+    for path in sorted(glob.glob(f"{gene_dir}*.json.gz"))[:limit]:
+        gene = os.path.basename(path).split(".json.gz")[0]
+        raw = inflate_interactions(read_gzip(path)).encode("utf-8")
+        items.append([[raw, gene], len(raw)])
+    return items
+
+def load_payloads(gpml_dir, gene_dir, limit):
+    paths = (
+        sorted(glob.glob(f"{gpml_dir}*.xml.gz"))[:limit] +
+        sorted(glob.glob(f"{gene_dir}*.json.gz"))[:limit]
+    )
+    items = []
+    for path in paths:
+        payload = read_gzip(path)
+        items.append([payload, len(payload)])
+    return items
+
+def run_lossy_optimize_gpml(args):
+    return lossy_optimize_gpml(*args).encode("utf-8")
+
+def run_lossy_optimize_interactions(args):
+    return lossy_optimize_interactions(*args).encode("utf-8")
+
+def run_compression(payload):
+    return gzip.compress(payload, mtime=0)
+
+# Stage name -> (input loader, per-file function)
+stages = {
+    "get_gpml_labels": [load_gpml_paths, extract_labels],
+    "lossy_optimize_gpml": [load_gpml, run_lossy_optimize_gpml],
+    "condense_colors": [load_gpml_trees, condense_colors],
+    "lossy_optimize_interactions": [
+        load_raw_interactions, run_lossy_optimize_interactions
+    ],
+    "compression": [load_payloads, run_compression]
+}
+
+def get_rss_mb():
+    """Get current resident memory of this process, in MB
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except (OSError, ValueError):
+        # Not Linux; fall back to peak so far
+        return get_peak_rss_mb()
+
+def reset_peak_rss():
+    """Reset peak resident memory to current, where Linux allows it
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+def get_peak_rss_mb():
+    """Get peak resident memory of this process since reset_peak_rss, in MB
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1e3
+    except (OSError, ValueError):
+        pass
+    # Peak over the whole process instead
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS reports bytes
+    return peak / 1e6 if os.uname().sysname == "Darwin" else peak / 1e3
+
+def percentile(sorted_values, fraction):
+    """Get nearest-rank percentile of an already sorted list, or None if empty
+    """
+    if len(sorted_values) == 0:
+        return None
+    index = max(0, int(round(fraction * len(sorted_values))) - 1)
+    return sorted_values[index]
+
+def bench_stage(name, gpml_dir, gene_dir, limit):
+    """Run one stage over its corpus and summarize its performance
+
+    Meant to run in a fresh process, so peak memory reflects one stage.
+    """
+    load, run = stages[name]
+    items = load(gpml_dir, gene_dir, limit)
+    if len(items) == 0:
+        raise ValueError(
+            f"No input files for {name} in {gpml_dir} or {gene_dir}"
+        )
+
+    # Measure memory above the loaded corpus, which dwarfs most stages
+    reset_peak_rss()
+    rss_before = get_rss_mb()
+    latencies = []
+    bytes_in = 0
+    bytes_out = 0
+    start = perf_counter()
+    for item, size in items:
+        item_start = perf_counter()
+        output = run(item)
+        latencies.append(perf_counter() - item_start)
+        bytes_in += size
+        if isinstance(output, bytes):
+            bytes_out += len(output)
+    seconds = perf_counter() - start
+    peak_rss = get_peak_rss_mb()
+
+    latencies.sort()
+    num_files = len(items)
+    return {
+        "files": num_files,
+        "seconds": round(seconds, 4),
+        "files_per_s": round(num_files / seconds, 1),
+        "mb_per_s": round(bytes_in / 1e6 / seconds, 3),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "peak_rss_mb": round(peak_rss, 1),
+        "stage_rss_mb": round(max(0, peak_rss - rss_before), 1),
+        "ratio": round(bytes_out / bytes_in, 4) if bytes_out else None
+    }
+
+def bench(stage_names, gpml_dir, gene_dir, limit=None, repeats=3):
+    """Run each stage `repeats` times; keep its fastest run, and least memory
+    """
+    results = {}
+    context = multiprocessing.get_context("spawn")
+    for name in stage_names:
+        runs = []
+        for i in range(repeats):
+            with ProcessPoolExecutor(1, mp_context=context) as executor:
+                future = executor.submit(
+                    bench_stage, name, gpml_dir, gene_dir, limit
+                )
+                runs.append(future.result())
+        result = min(runs, key=lambda run: run["seconds"])
+        for key in ["peak_rss_mb", "stage_rss_mb"]:
+            result[key] = min(run[key] for run in runs)
+        result["repeats"] = repeats
+        results[name] = result
+        ratio = result["ratio"]
+        print(
+            f"{name}: {result['files']} files in {result['seconds']:.2f} s, "
+            f"{result['files_per_s']} files/s, {result['mb_per_s']} MB/s, "
+            f"p50 {result['p50_ms']} ms, p99 {result['p99_ms']} ms, "
+            f"peak {result['peak_rss_mb']} MB, "
+            f"{result['stage_rss_mb']} MB above corpus" +
+            (f", ratio {ratio}" if ratio is not None else "")
+        )
+    return results
+
+def find_regressions(results, baseline, tolerance):
+    """List stages that are slower or use more memory than baseline allows
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        min_speed = base["files_per_s"] * (1 - tolerance)
+        max_memory = base["stage_rss_mb"] * (1 + tolerance) + rss_slack_mb
+        if result["files_per_s"] < min_speed:
+            regressions.append(
+                f"{name}: {result['files_per_s']} files/s, "
+                f"baseline {base['files_per_s']}"
+            )
+        if result["stage_rss_mb"] > max_memory:
+            regressions.append(
+                f"{name}: {result['stage_rss_mb']} MB above corpus, "
+                f"baseline {base['stage_rss_mb']}"
+            )
+    return regressions
+
+# Command-line handler
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--gpml-dir",
+        help="Directory of compressed GPML.  (default: %(default)s)",
+        default="data/gpml/"
+    )
+    parser.add_argument(
+        "--gene-dir",
+        help="Directory of per-gene interactions.  (default: %(default)s)",
+        default="data/gene/"
+    )
+    parser.add_argument(
+        "--stage",
+        help="Stage to run; repeat to run several.  (default: all)",
+        choices=stage_names,
+        action="append"
+    )
+    parser.add_argument(
+        "--limit",
+        help="Maximum number of files per corpus, for quick runs",
+        type=int
+    )
+    parser.add_argument(
+        "--repeat",
+        help=(
+            "Number of runs per stage, of which the best is kept.  "
+            "(default: %(default)s)"
+        ),
+        type=int,
+        default=3
+    )
+    parser.add_argument(
+        "--output",
+        help="Path to save results as JSON"
+    )
+    parser.add_argument(
+        "--baseline",
+        help="Path to JSON results from an earlier run, to compare against"
+    )
+    parser.add_argument(
+        "--tolerance",
+        help=(
+            "Allowed fractional drop in throughput, or rise in memory above "
+            "the loaded corpus, before a stage counts as regressed.  "
+            "(default: %(default)s)"
+        ),
+        type=float,
+        default=0.2
+    )
+    args = parser.parse_args()
+
+    results = bench(
+        args.stage or stage_names, args.gpml_dir, args.gene_dir, args.limit,
+        args.repeat
+    )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = find_regressions(results, baseline, args.tolerance)
+        if len(regressions) > 0:
+            print(f"{len(regressions)} regressions against {args.baseline}:")
+            print("\n".join(regressions))
+            exit(1)
+        print(f"No regressions against {args.baseline}")
@@ -0,0 +1,112 @@
+"""Precompress served files with Brotli, in a process pool
+
+Browsers accept Brotli, which at high quality is markedly smaller than
+gzip for the same JSON or XML, but much slower to compress.  So records are
+compressed once, when building, e.g. data/gene/A2M.json.br beside
+data/gene/A2M.json.gz, and spread over worker processes.
+
+Each record is also gzipped as the cache does, so the report compares
+size and time against gzip on the same input.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import gzip
+from itertools import repeat
+from time import perf_counter
+
+import brotli
+
+# Highest quality, as output is built once and served many times
+default_quality = 11
+
+# Records sent to workers at a time, to bound memory for large corpora
+batch_size = 256
+
+def get_settings(quality):
+    """Get compression settings, as recorded in build manifests
+    """
+    return {"codec": "brotli", "quality": quality}
+
+def get_path(gz_path):
+    """Get path for the Brotli sibling of a gzip file, e.g. WP4.xml.br
+    """
+    return gz_path[:-len(".gz")] + ".br"
+
+def compress_record(data, quality=default_quality):
+    """Compress bytes with Brotli and, for comparison, gzip
+
+    Module-level so it can run in a worker process.  Returns a tuple of
+    Brotli bytes, seconds for Brotli, gzip size, and seconds for gzip.
+    """
+    start = perf_counter()
+    compressed = brotli.compress(data, quality=quality)
+    brotli_seconds = perf_counter() - start
+
+    start = perf_counter()
+    gzip_size = len(gzip.compress(data, 9, mtime=0))
+    gzip_seconds = perf_counter() - start
+
+    return compressed, brotli_seconds, gzip_size, gzip_seconds
+
+def compress_all(keys, read, quality=default_quality, jobs=1):
+    """Compress records in batches; yield (key, data, result) for each
+
+    `read` gets a record's uncompressed bytes from its key, and runs in this
+    process.  Results, from `compress_record`, come in key order.
+    """
+    executor = None
+    if jobs > 1:
+        executor = ProcessPoolExecutor(max_workers=jobs)
+
+    try:
+        for i in range(0, len(keys), batch_size):
+            batch = keys[i:i + batch_size]
+            records = [read(key) for key in batch]
+            if executor is not None:
+                results = executor.map(
+                    compress_record, records, repeat(quality), chunksize=8
+                )
+            else:
+                results = map(compress_record, records, repeat(quality))
+            yield from zip(batch, records, results)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+def observe(metrics, organism, data, result):
+    """Count sizes and times for one compressed record
+    """
+    compressed, brotli_seconds, gzip_size, gzip_seconds = result
+    metrics.count("brotli_files", organism)
+    metrics.count("brotli_bytes_in", organism, len(data))
+    metrics.count("brotli_bytes_out", organism, len(compressed))
+    metrics.count("brotli_gzip_bytes_out", organism, gzip_size)
+    metrics.observe("brotli_s", brotli_seconds, organism)
+    metrics.observe("brotli_gzip_s", gzip_seconds, organism)
+
+def report(metrics, corpus, quality):
+    """Print and return Brotli size and time against gzip, over organisms
+    """
+    totals = {
+        "files": 0, "bytes_in": 0, "bytes_out": 0, "gzip_bytes_out": 0,
+        "s": 0, "gzip_s": 0
+    }
+    for scope in metrics.summary()["organisms"].values():
+        for name in ["files", "bytes_in", "bytes_out", "gzip_bytes_out"]:
+            totals[name] += scope["counters"].get("brotli_" + name, 0)
+        for name in ["s", "gzip_s"]:
+            histogram = scope["histograms"].get("brotli_" + name)
+            if histogram is not None:
+                totals[name] += histogram["total"]
+
+    if totals["files"] == 0:
+        print(f"Brotli: no {corpus} files needed compressing")
+        return totals
+
+    ratio = totals["bytes_out"] / totals["gzip_bytes_out"]
+    print(
+        f"Brotli {quality} for {totals['files']} {corpus} files: "
+        f"{totals['bytes_in']} bytes raw, gzip {totals['gzip_bytes_out']} "
+        f"bytes in {totals['gzip_s']:.2f} s, Brotli {totals['bytes_out']} "
+        f"bytes ({ratio:.1%} of gzip) in {totals['s']:.2f} s"
+    )
+    return totals
@@ -0,0 +1,208 @@
+"""Pack per-gene interaction records into one indexed bundle file
+
+Layout, all integers little-endian:
+
+  header   magic "IXNB", version (u8), codec (u8), reserved (u16),
+           index offset (u64), index entry count (u32)
+  records  compressed records, concatenated
+  index    per record, sorted by key: key length (u16), UTF-8 key,
+           record offset (u64), record length (u32)
+
+Each record is compressed on its own, so one gene can be read without
+decompressing any other.  Records use gzip, zlib with a preset
+dictionary that is kept beside the bundle, e.g. data/gene.zdict for
+data/gene.bundle, or Brotli.  RAW records are stored as-is, e.g. files
+that are already compressed, as in delta.py patches.
+"""
+import argparse
+import glob
+import gzip
+import mmap
+import os
+import struct
+
+import brotli
+
+import zdict_codec
+
+magic = b"IXNB"
+version = 1
+header_format = "<4sBBHQI"
+header_size = struct.calcsize(header_format)
+entry_format = "<QI"
+entry_size = struct.calcsize(entry_format)
+
+# Record codecs
+GZIP = 0
+ZDICT = 1
+BROTLI = 2
+RAW = 3
+
+def get_dictionary_path(bundle_path):
+    """Get path of preset dictionary for a ZDICT bundle
+    """
+    return os.path.splitext(bundle_path)[0] + ".zdict"
+
+def write_bundle(path, records, codec=GZIP):
+    """Write dict of key -> compressed record bytes to a bundle file
+    """
+    keys = sorted(records)
+    index = []
+    tmp_path = path + ".tmp"
+
+    with open(tmp_path, "wb") as f:
+        f.write(b"\0" * header_size)
+
+        offset = header_size
+        for key in keys:
+            record = records[key]
+            f.write(record)
+            index.append([key, offset, len(record)])
+            offset += len(record)
+
+        index_offset = offset
+        for key, record_offset, length in index:
+            encoded_key = key.encode("utf-8")
+            f.write(struct.pack("<H", len(encoded_key)))
+            f.write(encoded_key)
+            f.write(struct.pack(entry_format, record_offset, length))
+
+        f.seek(0)
+        f.write(struct.pack(
+            header_format, magic, version, codec, 0, index_offset, len(keys)
+        ))
+
+    os.replace(tmp_path, path)
+
+class BundleReader():
+    """Random-access reader for bundle files, backed by mmap
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        header = struct.unpack_from(header_format, self.map, 0)
+        file_magic, file_version, codec, _, index_offset, count = header
+        if file_magic != magic or file_version != version:
+            raise ValueError(f"Not a version {version} bundle: {path}")
+        self.codec = codec
+        if codec == GZIP:
+            self.decode = gzip.decompress
+        elif codec == ZDICT:
+            zdict = zdict_codec.read_dictionary(get_dictionary_path(path))
+            self.decode = lambda record: zdict_codec.decode(record, zdict)
+        elif codec == BROTLI:
+            self.decode = brotli.decompress
+        elif codec == RAW:
+            self.decode = bytes
+        else:
+            raise ValueError(f"Unknown codec {codec} in bundle: {path}")
+
+        self.spans = {}
+        position = index_offset
+        for i in range(count):
+            key_length = struct.unpack_from("<H", self.map, position)[0]
+            position += 2
+            key = self.map[position:position + key_length].decode("utf-8")
+            position += key_length
+            self.spans[key] = struct.unpack_from(
+                entry_format, self.map, position
+            )
+            position += entry_size
+
+    def __contains__(self, key):
+        return key in self.spans
+
+    def __len__(self):
+        return len(self.spans)
+
+    def keys(self):
+        """Get sorted list of keys in this bundle
+        """
+        return list(self.spans)
+
+    def get_raw(self, key):
+        """Get compressed bytes for a record, or None if key is absent
+        """
+        if key not in self.spans:
+            return None
+        offset, length = self.spans[key]
+        return self.map[offset:offset + length]
+
+    def get(self, key):
+        """Get decompressed string for a record, or None if key is absent
+        """
+        record = self.get_raw(key)
+        if record is None:
+            return None
+        return self.decode(record).decode("utf-8")
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def pack_dir(gene_dir, bundle_path, codec=GZIP):
+    """Bundle existing per-gene *.json.gz files
+
+    For GZIP, files are copied without recompressing them.  For ZDICT, a
+    preset dictionary is trained on them and written beside the bundle.
+    """
+    records = {}
+    for json_path in glob.glob(f"{gene_dir}*.json.gz"):
+        gene = os.path.basename(json_path).split(".json.gz")[0]
+        with open(json_path, "rb") as f:
+            records[gene] = f.read()
+
+    if codec == ZDICT:
+        for gene in records:
+            records[gene] = gzip.decompress(records[gene])
+        zdict = zdict_codec.train_dictionary(list(records.values()))
+        zdict_codec.write_dictionary(get_dictionary_path(bundle_path), zdict)
+        for gene in records:
+            records[gene] = zdict_codec.encode(records[gene], zdict)
+
+    write_bundle(bundle_path, records, codec)
+    print(f"Packed {len(records)} genes into {bundle_path}")
+
+# Command-line handler
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    pack_parser = subparsers.add_parser(
+        "pack", help="Bundle a directory of per-gene *.json.gz files"
+    )
+    pack_parser.add_argument("gene_dir", help="E.g. data/gene/")
+    pack_parser.add_argument("bundle_path", help="E.g. data/gene.bundle")
+    pack_parser.add_argument(
+        "--codec",
+        help="Record compression.  (default: %(default)s)",
+        choices=["gzip", "zdict"],
+        default="gzip"
+    )
+
+    get_parser = subparsers.add_parser(
+        "get", help="Print one gene's record from a bundle"
+    )
+    get_parser.add_argument("bundle_path")
+    get_parser.add_argument("gene")
+
+    args = parser.parse_args()
+
+    if args.command == "pack":
+        codec = ZDICT if args.codec == "zdict" else GZIP
+        pack_dir(args.gene_dir, args.bundle_path, codec)
+    else:
+        with BundleReader(args.bundle_path) as reader:
+            print(reader.get(args.gene))
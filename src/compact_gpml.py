@@ -0,0 +1,445 @@
+"""Losslessly encode GPML as compact JSON, and decode it back to GPML
+
+Element and attribute names are coded as small integers, by their place in
+a fixed list of GPML 2013a schema names.  Strings used more than once --
+e.g. whitespace, types, colors and graph IDs -- are stored once in a string
+table, most frequent first, and referred to by 1-based position.  Strings
+used once are stored in place, as that compresses better than a reference.
+
+Each element is a list: [name, text, tail, attributes, children], where
+attributes alternate name and value, and trailing empty lists are left out.
+Text, tail and values are 0 for none, a string, or a table position.  Names
+outside the schema list are negative table positions.  Comments have name
+0.  Elements that declare namespaces, other than the root, also get a sixth
+item with those declarations.
+
+Plain GPML is decoded by writing XML directly, escaped as lxml does; other
+documents, e.g. raw GPML with Biopax, are rebuilt as an lxml tree.  Either
+way, decoding yields the same XML bytes for data/gpml, and the same XML
+infoset in general, e.g. if input quotes attributes with ' rather than ".
+
+Example:
+
+  python src/compact_gpml.py --gpml-dir data/gpml/
+"""
+import argparse
+from collections import Counter
+import glob
+import gzip
+import json
+import re
+from time import perf_counter
+from xml.parsers import expat
+
+from lxml import etree
+
+# Increment when names or layout change; old encodings then fail to decode
+version = 1
+
+gpml_ns = "http://pathvisio.org/GPML/2013a"
+gpml_prefix = f"{{{gpml_ns}}}"
+
+# GPML 2013a element and attribute names, roughly most frequent first, so
+# common names get one-digit codes.  Code 0 is comments.
+names = [
+    "#comment",
+
+    # Elements
+    "Graphics", "Point", "DataNode", "Interaction", "Anchor", "Group",
+    "Shape", "GraphicalLine", "State", "Pathway", "InfoBox", "Legend",
+    "Label", "Xref", "Comment", "Attribute", "BiopaxRef", "Biopax",
+
+    # Attributes
+    "GraphId", "TextLabel", "Type", "GraphRef", "GroupRef", "ArrowHead",
+    "Color", "ConnectorType", "ShapeType", "GroupId", "Style", "FillColor",
+    "LineStyle", "Name", "Organism", "BoardWidth", "BoardHeight",
+    "FontName", "FontStyle", "Version", "Last-Modified", "License",
+    "Align", "Author", "Data-Source", "Maintainer", "Email", "X", "Y",
+    "RelX", "RelY", "CenterX", "CenterY", "Width", "Height", "Rotation",
+    "Position", "ZOrder", "FontSize", "FontWeight", "FontDecoration",
+    "FontStrikethru", "LineThickness", "Valign", "Database", "ID", "Key",
+    "Value", "Href", "StateType", "Padding"
+]
+name_codes = {name: code for code, name in enumerate(names)}
+tags = [gpml_prefix + name for name in names]
+expat_codes = {f"{gpml_ns} {name}": code for code, name in enumerate(names)}
+
+# XML declaration, doctype, comments and whitespace before the root
+prolog_item = re.compile(
+    r"<\?.*?\?>|<!--.*?-->|<!DOCTYPE[^>]*>|\s+", re.DOTALL
+)
+
+# Characters that lxml escapes, in text and in attribute values
+text_escapes = {"&": "&amp;", "<": "&lt;", ">": "&gt;", "\r": "&#13;"}
+attr_escapes = dict(text_escapes, **{
+    '"': "&quot;", "\n": "&#10;", "\t": "&#9;"
+})
+text_special = re.compile("[&<>\r]")
+attr_special = re.compile('[&<>\r"\n\t]')
+
+def get_prolog_end(xml):
+    """Get position of the root element's start tag
+    """
+    position = 0
+    while True:
+        match = prolog_item.match(xml, position)
+        if match is None:
+            return position
+        position = match.end()
+
+def to_clark(name):
+    """Convert e.g. "http://... Biopax", from expat, to "{http://...}Biopax"
+    """
+    uri, space, local = name.rpartition(" ")
+    return f"{{{uri}}}{local}" if space else local
+
+def encode(xml):
+    """Encode a GPML string as a compact, lossless JSON string
+    """
+    prolog_end = get_prolog_end(xml)
+    body = xml[prolog_end:].rstrip()
+    epilog = xml[prolog_end + len(body):]
+
+    # Expat calls back for each node without building a tree, which is
+    # several times faster than reading one from lxml.  Records start out
+    # full length, with names as strings; they are coded further below.
+    records = []
+    other_names = set()
+    declarations = {}
+    parents = [[None, None, None, [], [], None]]
+    last = parents[0]
+    slot = 1
+
+    # Bound once, as these run for every node
+    get_element_code = expat_codes.get
+    get_attr_code = name_codes.get
+    add_record = records.append
+    push = parents.append
+
+    def start_element(name, attrs):
+        nonlocal last, slot, declarations
+        code = get_element_code(name)
+        if code is None:
+            code = to_clark(name)
+            other_names.add(code)
+        attr_codes = list(map(get_attr_code, attrs[::2]))
+        if None in attr_codes:
+            for i, attr in enumerate(attrs[::2]):
+                if attr_codes[i] is None:
+                    attr_codes[i] = to_clark(attr)
+                    other_names.add(attr_codes[i])
+        attrs[::2] = attr_codes
+        if declarations:
+            record = [code, None, None, attrs, [], declarations]
+            declarations = {}
+        else:
+            record = [code, None, None, attrs, [], None]
+        parents[-1][4].append(record)
+        push(record)
+        add_record(record)
+        last = record
+        slot = 1
+
+    def end_element(name):
+        nonlocal last, slot
+        last = parents.pop()
+        slot = 2
+
+    def character_data(data):
+        last[slot] = data if last[slot] is None else last[slot] + data
+
+    def comment(data):
+        nonlocal last, slot
+        record = [0, data, None]
+        parents[-1][4].append(record)
+        records.append(record)
+        last = record
+        slot = 2
+
+    def start_namespace(prefix, uri):
+        declarations[prefix or ""] = uri
+
+    def processing_instruction(target, data):
+        raise ValueError(f"Cannot encode processing instruction: {target}")
+
+    parser = expat.ParserCreate(namespace_separator=" ")
+    parser.ordered_attributes = True
+    parser.buffer_text = True
+    parser.buffer_size = max(len(body), 1)
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    parser.CharacterDataHandler = character_data
+    parser.CommentHandler = comment
+    parser.StartNamespaceDeclHandler = start_namespace
+    parser.ProcessingInstructionHandler = processing_instruction
+    parser.Parse(body, True)
+
+    if len(parents[0][4]) != 1:
+        raise ValueError("Cannot encode comments after the root element")
+    root = records[0]
+    nsmap = root[5] or {}
+    root[5] = None
+    is_plain = nsmap == {"": gpml_ns} and not any(
+        "{" in name for name in other_names
+    ) and not any(
+        len(record) > 3 and record[5] is not None for record in records
+    )
+
+    values = []
+    for record in records:
+        values += [record[1], record[2]]
+        if len(record) > 3:
+            values += record[3][1::2]
+    counts = Counter(values)
+    del counts[None]
+    strings = [value for value, count in counts.most_common() if count > 1]
+    strings += sorted(other_names - set(strings))
+    ids = {value: id for id, value in enumerate(strings, 1)}
+    ids[None] = 0
+    get_id = ids.get
+
+    for record in records:
+        record[1] = get_id(record[1], record[1])
+        record[2] = get_id(record[2], record[2])
+        if len(record) == 3:
+            continue
+        code = record[0]
+        if code.__class__ is str:
+            record[0] = -ids[code]
+        attrs = record[3]
+        if len(attrs) > 0:
+            attrs[1::2] = [get_id(value, value) for value in attrs[1::2]]
+            if other_names:
+                attrs[::2] = [
+                    -ids[code] if code.__class__ is str else code
+                    for code in attrs[::2]
+                ]
+        if record[5] is None:
+            record.pop()
+            if len(record[4]) == 0:
+                record.pop()
+                if len(attrs) == 0:
+                    record.pop()
+
+    compact = {
+        "v": version,
+        "d": xml[:prolog_end],
+        "e": epilog,
+        "s": strings,
+        "r": root
+    }
+    if not is_plain:
+        compact["n"] = nsmap
+    if not body.isascii():
+        compact["u"] = 1
+    return json.dumps(compact, ensure_ascii=False, separators=(",", ":"))
+
+def escape(value, special, escapes, is_unicode):
+    """Escape text or an attribute value as lxml would serialize it
+    """
+    if special.search(value) is not None:
+        value = special.sub(lambda match: escapes[match.group()], value)
+    if not is_unicode and not value.isascii():
+        value = value.encode("ascii", "xmlcharrefreplace").decode("ascii")
+    return value
+
+def write_plain(data, strings):
+    """Write XML for compact GPML in only the GPML namespace
+    """
+    is_unicode = "u" in data
+
+    def escape_text(value):
+        if value.__class__ is int:
+            return text_table[value]
+        return escape(value, text_special, text_escapes, is_unicode)
+
+    def escape_attr(value):
+        if value.__class__ is int:
+            return attr_table[value]
+        return escape(value, attr_special, attr_escapes, is_unicode)
+
+    text_table = [""] + [
+        escape(value, text_special, text_escapes, is_unicode)
+        for value in strings[1:]
+    ]
+    attr_table = [""] + [
+        escape(value, attr_special, attr_escapes, is_unicode)
+        for value in strings[1:]
+    ]
+
+    parts = []
+    append = parts.append
+
+    def write_element(record, declaration=""):
+        code, text, tail = record[0], record[1], record[2]
+        if code == 0:
+            comment = text if text.__class__ is str else strings[text]
+            if not is_unicode:
+                comment = escape(comment, text_special, {}, False)
+            append(f"<!--{comment}-->")
+        else:
+            name = names[code] if code > 0 else strings[-code]
+            append("<" + name + declaration)
+            if len(record) > 3:
+                attrs = record[3]
+                for i in range(0, len(attrs), 2):
+                    code = attrs[i]
+                    attr = names[code] if code > 0 else strings[-code]
+                    append(f' {attr}="{escape_attr(attrs[i + 1])}"')
+            if text == 0 and len(record) < 5:
+                append("/>")
+            else:
+                append(">")
+                if text != 0:
+                    append(escape_text(text))
+                if len(record) > 4:
+                    for child in record[4]:
+                        write_element(child)
+                append("</" + name + ">")
+        if tail != 0:
+            append(escape_text(tail))
+
+    write_element(data["r"], f' xmlns="{gpml_ns}"')
+    return "".join(parts)
+
+def build_tree(data, strings):
+    """Build an lxml tree for compact GPML, with any namespaces
+    """
+    def get_value(value):
+        return value if value.__class__ is str else strings[value]
+
+    def get_name(code, table):
+        return table[code] if code >= 0 else strings[-code]
+
+    def get_nsmap(declarations):
+        return {
+            prefix or None: uri for prefix, uri in declarations.items()
+        }
+
+    def build_element(record, parent):
+        code = record[0]
+        if code == 0:
+            el = etree.Comment(get_value(record[1]))
+            parent.append(el)
+        else:
+            tag = get_name(code, tags)
+            if parent is None:
+                el = etree.Element(tag, nsmap=get_nsmap(data["n"]))
+            elif len(record) > 5:
+                el = etree.SubElement(parent, tag, nsmap=get_nsmap(record[5]))
+            else:
+                el = etree.SubElement(parent, tag)
+            el.text = get_value(record[1])
+        el.tail = get_value(record[2])
+
+        if len(record) > 3:
+            attrs = record[3]
+            for i in range(0, len(attrs), 2):
+                el.set(get_name(attrs[i], names), get_value(attrs[i + 1]))
+        if len(record) > 4:
+            for child in record[4]:
+                build_element(child, el)
+        return el
+
+    return build_element(data["r"], None)
+
+def decode(compact):
+    """Decode a compact JSON string, from `encode`, back to GPML
+    """
+    data = json.loads(compact)
+    if data.get("v") != version:
+        raise ValueError(f"Not version {version} compact GPML")
+    strings = [None] + data["s"]
+
+    if "n" not in data:
+        body = write_plain(data, strings)
+    elif "u" in data:
+        body = etree.tostring(build_tree(data, strings), encoding="unicode")
+    else:
+        body = etree.tostring(build_tree(data, strings)).decode("ascii")
+    return data["d"] + body + data["e"]
+
+def is_equivalent(xml, other):
+    """Whether two GPML strings have the same canonical XML
+    """
+    def canonicalize(xml):
+        body = xml[get_prolog_end(xml):]
+        return etree.tostring(etree.fromstring(body), method="c14n")
+    return canonicalize(xml) == canonicalize(other)
+
+def compare(gpml_dir):
+    """Round-trip all compressed GPML, and compare size and speed with XML
+    """
+    paths = sorted(glob.glob(f"{gpml_dir}*.xml.gz"))
+    print(f"Round-tripping {len(paths)} GPML files from {gpml_dir}")
+
+    sizes = {"xml": 0, "xml_gz": 0, "compact": 0, "compact_gz": 0}
+    seconds = {"parse_xml": 0, "encode": 0, "decode": 0}
+    identical = 0
+    failures = []
+    for path in paths:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            xml = f.read()
+
+        start = perf_counter()
+        etree.fromstring(xml[get_prolog_end(xml):])
+        seconds["parse_xml"] += perf_counter() - start
+
+        start = perf_counter()
+        compact = encode(xml)
+        seconds["encode"] += perf_counter() - start
+
+        start = perf_counter()
+        decoded = decode(compact)
+        seconds["decode"] += perf_counter() - start
+
+        if decoded == xml:
+            identical += 1
+        elif not is_equivalent(decoded, xml):
+            failures.append(path)
+
+        for name, value in [["xml", xml], ["compact", compact]]:
+            data = value.encode("utf-8")
+            sizes[name] += len(data)
+            sizes[name + "_gz"] += len(gzip.compress(data, 9, mtime=0))
+
+    print(
+        f"{identical} byte-identical, "
+        f"{len(paths) - identical - len(failures)} equivalent, "
+        f"{len(failures)} failed"
+    )
+    for path in failures:
+        print(f"  Round trip changed {path}")
+
+    for name in ["", "_gz"]:
+        xml_size = sizes["xml" + name]
+        compact_size = sizes["compact" + name]
+        label = "gzipped" if name else "raw"
+        print(
+            f"Size, {label}: XML {xml_size} bytes, compact {compact_size} "
+            f"bytes ({compact_size / xml_size:.1%} of XML)"
+        )
+    print(
+        f"Time: parse XML {seconds['parse_xml']:.3f} s, "
+        f"encode {seconds['encode']:.3f} s, "
+        f"decode {seconds['decode']:.3f} s"
+    )
+    return len(failures) == 0
+
+# Command-line handler
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--gpml-dir",
+        help=(
+            "Directory of compressed GPML files.  (default: %(default)s)"
+        ),
+        default="data/gpml/"
+    )
+    args = parser.parse_args()
+
+    if not compare(args.gpml_dir):
+        exit(1)
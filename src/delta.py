@@ -0,0 +1,290 @@
+"""Publish only what changed between two versions of the cache
+
+A rebuild of data/ usually changes a few pathways and genes, but
+republishing the tree sends every file again.  Instead, `diff` compares an
+old and new version by content hash, and writes a patch as two files
+beside each other, named by appending an extension to the patch path,
+e.g. tmp/v1-v2.json and tmp/v1-v2.bundle for patch path tmp/v1-v2:
+
+  <patch path>.json    manifest: added, changed and removed paths, with
+                       hashes, and a hash of each whole version
+  <patch path>.bundle  bundle.py file of new bytes for added and changed
+                       paths, stored as-is, keyed by path
+
+`apply` then updates a mirror of the old version in place.  It first checks
+that each path it touches has the content the patch expects, so a mirror
+that drifted is left as it was, and a patch applied twice changes nothing.
+
+The old version can be a directory or an index, i.e. the hashes of each
+file, saved by `index` or `diff --save-index`, so it need not be kept.
+Hidden files, e.g. build manifests, and *.tmp files are ignored.
+
+Examples:
+
+  python src/delta.py index data/ tmp/data-v1.json
+  python src/delta.py diff tmp/data-v1.json data/ tmp/v1-v2
+  python src/delta.py apply mirror/data/ tmp/v1-v2
+"""
+import argparse
+import hashlib
+import json
+import os
+
+from lib import hash_file
+import bundle
+
+# Increment when manifest or index layout changes
+version = 1
+
+def list_files(root):
+    """Get sorted paths, relative to root and "/"-separated, of served files
+    """
+    paths = []
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names[:] = [name for name in dir_names if name[0] != "."]
+        for name in file_names:
+            if name[0] == "." or name.endswith(".tmp"):
+                continue
+            path = os.path.relpath(os.path.join(dir_path, name), root)
+            paths.append(path.replace(os.sep, "/"))
+    return sorted(paths)
+
+def index_dir(root):
+    """Get dict of relative path -> {"hash", "size"} for files under root
+    """
+    return {
+        path: {
+            "hash": hash_file(os.path.join(root, path)),
+            "size": os.path.getsize(os.path.join(root, path))
+        }
+        for path in list_files(root)
+    }
+
+def get_tree_hash(index):
+    """Hash a whole version, from the path and hash of each file
+    """
+    digest = hashlib.sha256()
+    for path in sorted(index):
+        digest.update(f"{path}\0{index[path]['hash']}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+def save_index(index, path):
+    with open(path, "w") as f:
+        json.dump(
+            {"version": version, "files": index}, f, indent=2,
+            sort_keys=True
+        )
+        f.write("\n")
+
+def load_index(source):
+    """Get index of a version, from a directory or a saved index
+    """
+    if os.path.isdir(source):
+        return index_dir(source)
+    with open(source) as f:
+        saved = json.load(f)
+    if saved.get("version") != version:
+        raise ValueError(f"Not a version {version} index: {source}")
+    return saved["files"]
+
+def diff(old_index, new_index):
+    """Get manifest of added, changed and removed paths between versions
+    """
+    added = {}
+    changed = {}
+    removed = {}
+    for path, entry in new_index.items():
+        old_entry = old_index.get(path)
+        if old_entry is None:
+            added[path] = entry
+        elif old_entry["hash"] != entry["hash"]:
+            changed[path] = {
+                "old_hash": old_entry["hash"],
+                "hash": entry["hash"],
+                "size": entry["size"]
+            }
+    for path, old_entry in old_index.items():
+        if path not in new_index:
+            removed[path] = {"old_hash": old_entry["hash"]}
+
+    return {
+        "version": version,
+        "base": get_tree_hash(old_index),
+        "target": get_tree_hash(new_index),
+        "added": dict(sorted(added.items())),
+        "changed": dict(sorted(changed.items())),
+        "removed": dict(sorted(removed.items()))
+    }
+
+def write_patch(manifest, new_root, patch_path):
+    """Write manifest to <patch_path>.json, new payloads to .bundle
+    """
+    records = {}
+    entries = [*manifest["added"].items(), *manifest["changed"].items()]
+    for path, entry in entries:
+        with open(os.path.join(new_root, path), "rb") as f:
+            payload = f.read()
+        if hashlib.sha256(payload).hexdigest() != entry["hash"]:
+            raise ValueError(f"{path} changed while writing patch")
+        records[path] = payload
+
+    bundle.write_bundle(patch_path + ".bundle", records, bundle.RAW)
+    with open(patch_path + ".json", "w") as f:
+        json.dump(manifest, f, indent=2)
+        f.write("\n")
+
+def check_paths(mirror_root, paths):
+    """Raise ValueError if any patch path could write outside the mirror
+    """
+    root = os.path.realpath(mirror_root)
+    for path in paths:
+        parts = path.replace("\\", "/").split("/")
+        resolved = os.path.realpath(os.path.join(root, path))
+        if (
+            os.path.isabs(path) or ".." in parts or
+            os.path.commonpath([root, resolved]) != root or resolved == root
+        ):
+            raise ValueError(f"Unsafe path in patch: {path}; not applied")
+
+def get_current_hash(path):
+    return hash_file(path) if os.path.exists(path) else None
+
+def apply_patch(mirror_root, patch_path):
+    """Update a mirror in place; return counts of paths by outcome
+
+    Raises ValueError, before changing anything, if any path the patch
+    touches is outside the mirror, or has neither its old nor its new
+    content.
+    """
+    with open(patch_path + ".json") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != version:
+        raise ValueError(f"Not a version {version} patch: {patch_path}")
+
+    # Expected content before and after, per path; None means absent
+    updates = {}
+    for path, entry in manifest["added"].items():
+        updates[path] = (None, entry["hash"])
+    for path, entry in manifest["changed"].items():
+        updates[path] = (entry["old_hash"], entry["hash"])
+    for path, entry in manifest["removed"].items():
+        updates[path] = (entry["old_hash"], None)
+    check_paths(mirror_root, updates)
+
+    pending = {}
+    conflicts = []
+    for path, (old_hash, new_hash) in updates.items():
+        current_hash = get_current_hash(os.path.join(mirror_root, path))
+        if current_hash == new_hash:
+            continue
+        if current_hash != old_hash:
+            conflicts.append(path)
+        pending[path] = new_hash
+    if len(conflicts) > 0:
+        raise ValueError(
+            f"{len(conflicts)} paths in {mirror_root} differ from both "
+            f"versions in the patch, e.g. {conflicts[0]}; not applied"
+        )
+
+    counts = {
+        "written": 0, "removed": 0, "unchanged": len(updates) - len(pending)
+    }
+    with bundle.BundleReader(patch_path + ".bundle") as reader:
+        for path, new_hash in pending.items():
+            mirror_path = os.path.join(mirror_root, path)
+            if new_hash is None:
+                os.remove(mirror_path)
+                counts["removed"] += 1
+                continue
+
+            payload = bytes(reader.get_raw(path))
+            if hashlib.sha256(payload).hexdigest() != new_hash:
+                raise ValueError(f"Patch payload for {path} is corrupt")
+            dir_path = os.path.dirname(mirror_path)
+            if dir_path and not os.path.exists(dir_path):
+                os.makedirs(dir_path)
+            tmp_path = mirror_path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(payload)
+            os.replace(tmp_path, mirror_path)
+            counts["written"] += 1
+
+    return counts
+
+def print_summary(manifest, new_index, patch_path):
+    patch_size = sum(
+        os.path.getsize(patch_path + ext) for ext in [".json", ".bundle"]
+    )
+    full_size = sum(entry["size"] for entry in new_index.values())
+    ratio = patch_size / full_size if full_size > 0 else 0
+    print(
+        f"{len(manifest['added'])} added, {len(manifest['changed'])} "
+        f"changed, {len(manifest['removed'])} removed of "
+        f"{len(new_index)} files"
+    )
+    print(
+        f"Patch {patch_path}.json and .bundle: {patch_size} bytes, vs "
+        f"{full_size} bytes for the full version ({ratio:.2%})"
+    )
+
+# Command-line handler
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    index_parser = subparsers.add_parser(
+        "index", help="Save content hashes of a version, to diff against"
+    )
+    index_parser.add_argument("root", help="E.g. data/")
+    index_parser.add_argument("index_path", help="E.g. tmp/data-v1.json")
+
+    diff_parser = subparsers.add_parser(
+        "diff", help="Write a patch from an old version to a new one"
+    )
+    diff_parser.add_argument(
+        "old", help="Old version, as a directory or saved index"
+    )
+    diff_parser.add_argument("new_root", help="New version, e.g. data/")
+    diff_parser.add_argument(
+        "patch_path",
+        help="Path for patch, without extension, e.g. tmp/v1-v2"
+    )
+    diff_parser.add_argument(
+        "--save-index",
+        help="Also save the new version's index here, for the next diff",
+        metavar="PATH"
+    )
+
+    apply_parser = subparsers.add_parser(
+        "apply", help="Update a mirror of the old version in place"
+    )
+    apply_parser.add_argument("mirror_root", help="E.g. mirror/data/")
+    apply_parser.add_argument(
+        "patch_path",
+        help="Path of patch, without extension, e.g. tmp/v1-v2"
+    )
+
+    args = parser.parse_args()
+
+    if args.command == "index":
+        index = index_dir(args.root)
+        save_index(index, args.index_path)
+        print(f"Indexed {len(index)} files in {args.root}")
+    elif args.command == "diff":
+        old_index = load_index(args.old)
+        new_index = index_dir(args.new_root)
+        manifest = diff(old_index, new_index)
+        write_patch(manifest, args.new_root, args.patch_path)
+        if args.save_index is not None:
+            save_index(new_index, args.save_index)
+        print_summary(manifest, new_index, args.patch_path)
+    else:
+        counts = apply_patch(args.mirror_root, args.patch_path)
+        print(
+            f"Wrote {counts['written']}, removed {counts['removed']}, "
+            f"and found {counts['unchanged']} already up to date, in "
+            f"{args.mirror_root}"
+        )
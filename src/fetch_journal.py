@@ -0,0 +1,115 @@
+"""Append-only journal of fetched items, to resume interrupted runs
+
+Each line is JSON for one fetch of one item, e.g. a pathway or gene:
+
+  {"item": "WP4", "state": "ok", "attempts": 1, "time": 1700000000.0}
+
+State is "ok", "empty" (fetched, but nothing in it) or "error", which also
+has an "error" message.  Attempts counts tries since the item last
+succeeded.  The journal is read once, when opened; the last line for an
+item wins, and a line cut short by a crash is ignored.  Each fetch then
+appends one line, so a killed run loses at most the items in flight.
+"""
+import json
+import os
+import threading
+from time import time
+
+# Metric counted when an item is skipped for having a given state
+skip_counters = {
+    "ok": "fetch_cached",
+    "empty": "fetch_skipped_empty",
+    "error": "fetch_skipped_errors"
+}
+
+class FetchJournal():
+    """Thread-safe journal of fetch states, e.g. tmp/gene/fetch_journal.jsonl
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.lock = threading.Lock()
+
+        is_cut_short = False
+        if os.path.exists(path):
+            is_cut_short = self.load()
+        self.file = open(path, "a", encoding="utf-8")
+        if is_cut_short:
+            # End the partial line, so the next entry starts on its own
+            self.file.write("\n")
+
+    def load(self):
+        """Read entries; return whether the last line was cut short
+        """
+        line = "\n"
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                self.entries[entry["item"]] = entry
+        return not line.endswith("\n")
+
+    def get(self, item):
+        """Get latest entry for an item, or None if it was never fetched
+        """
+        return self.entries.get(item)
+
+    def get_skip_state(self, item, max_attempts=1):
+        """Get state of an item that needs no fetch, or None to fetch it
+
+        Items that errored are fetched again until tried `max_attempts`
+        times.
+        """
+        entry = self.entries.get(item)
+        if entry is None:
+            return None
+        if entry["state"] == "error" and entry["attempts"] < max_attempts:
+            return None
+        return entry["state"]
+
+    def get_reuse_state(self, item, path, max_attempts=1):
+        """Get state of an item that needs no fetch, given its output path
+
+        An "ok" item is fetched again if its output was since deleted, and
+        an item fetched before the journal was kept counts as "ok" if its
+        output exists.
+        """
+        state = self.get_skip_state(item, max_attempts)
+        if state == "ok" and not os.path.exists(path):
+            return None
+        if state is None and self.get(item) is None and os.path.exists(path):
+            return "ok"
+        return state
+
+    def record(self, item, state, error=None):
+        """Append the outcome of fetching an item
+        """
+        with self.lock:
+            previous = self.entries.get(item)
+            attempts = 0
+            if previous is not None and previous["state"] == "error":
+                attempts = previous["attempts"]
+            entry = {
+                "item": item,
+                "state": state,
+                "attempts": attempts + 1,
+                "time": round(time(), 3)
+            }
+            if error is not None:
+                entry["error"] = error
+            self.file.write(json.dumps(entry) + "\n")
+            self.file.flush()
+            self.entries[item] = entry
+        return entry
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
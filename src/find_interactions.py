@@ -2,16 +2,18 @@ import argparse
 import glob
 import os
 import re
-from time import sleep
 import json as ljson
 import gzip
 import csv
 from typing import Set
 
-import requests
 from lxml import etree
 
-from lib import repo, module, ctx, organisms
+from lib import repo, module, ctx, organisms, TokenBucket, base_urls, slug
+from lib import get_list_pathways_url, get_find_interactions_url
+import http_client
+from labels import get_gpml_labels
+from fetch_journal import FetchJournal
 
 # # Enable importing local modules when directly calling as script
 # if __name__ == "__main__":
@@ -21,10 +23,8 @@ from lib import repo, module, ctx, organisms
 # from lib import download_gzip
 
 def get_pathway_ids_and_names(organism):
-    base_url = "https://webservice.wikipathways.org/listPathways"
-    params = f"?organism={organism}&format=json"
-    url = base_url + params
-    response = requests.get(url)
+    url = get_list_pathways_url(organism)
+    response = http_client.get(url)
     data = response.json()
     ids_and_names = [[pw['id'], pw['name']] for pw in data['pathways']]
     return ids_and_names
@@ -35,12 +35,8 @@ def fetch_pathway_genes(data_dir, organism):
     pathway_genes = []
 
     genes = []
-    # E.g. https://raw.githubusercontent.com/eweitz/ideogram/master/dist/data/cache/homo-sapiens-genes.tsv
-    genes_url = (
-        "https://raw.githubusercontent.com/eweitz/ideogram/"
-        f"master/dist/data/cache/{slug(organism)}-genes.tsv"
-    )
-    tsv_string = requests.get(genes_url).content.decode('utf-8')
+    genes_url = f"{base_urls['genes']}{slug(organism)}-genes.tsv"
+    tsv_string = http_client.get(genes_url).content.decode('utf-8')
     reader = csv.reader(tsv_string.splitlines(), delimiter="\t")
     for row in reader:
         if len(row) < 4 or row[0][0] == '#': continue
@@ -48,7 +44,7 @@ def fetch_pathway_genes(data_dir, organism):
         gene = row[4] # more formally, gene symbol
         genes.append(gene)
 
-    labels = get_gpml_labels(data_dir)
+    labels = get_gpml_labels(glob.glob(f'{data_dir}/**/*.xml.gz'))
 
     for gene in genes:
         if gene in labels:
@@ -57,29 +53,6 @@ def fetch_pathway_genes(data_dir, organism):
     print(f"Found {len(pathway_genes)} {organism} genes in WikiPathways")
     return pathway_genes
 
-def get_gpml_labels(data_dir):
-    print("Get GPML labels")
-    labels = set()
-    for gpml_path in glob.glob(f'{data_dir}/**/*.xml.gz'):
-        # print('gpml_path')
-        # print(gpml_path)
-        with gzip.open(gpml_path, 'rb') as f:
-            xml = f.read()
-        # xml = gzip.decompress(xml_gz)
-        tree = etree.fromstring(xml)
-        elements = tree.xpath('//*')
-        # print('len(elements)')
-        # print(len(elements))
-        for el in elements:
-            if "TextLabel" in el.attrib:
-                labels.add(el.attrib["TextLabel"])
-
-    print(f"Found {len(labels)} labels in compressed GPML")
-    return labels
-
-def slug(value):
-    return value.lower().replace(" ", "-")
-
 def lossy_optimize_interactions(json_str, gene):
     json = ljson.loads(json_str)
     # print('json')
@@ -102,10 +75,17 @@ def lossy_optimize_interactions(json_str, gene):
 
 class WikiPathwaysCache():
 
-    def __init__(self, output_dir="data/ixns_by_gene/", reuse=False):
+    def __init__(
+        self, output_dir="data/ixns_by_gene/", reuse=False, max_attempts=1
+    ):
         self.output_dir = output_dir
         self.tmp_dir = f"tmp/"
         self.reuse = reuse
+        self.max_attempts = max_attempts
+
+        # At most 2 findInteractions queries per second, as before
+        self.limiter = TokenBucket(2.0)
+        self.client = http_client.HttpClient(self.limiter)
 
         if not os.path.exists(self.output_dir):
             os.makedirs(self.output_dir)
@@ -113,51 +93,48 @@ class WikiPathwaysCache():
             os.makedirs(self.tmp_dir)
 
     def fetch_interactions(self, genes, gene_dir):
+        with FetchJournal(gene_dir + "fetch_journal.jsonl") as journal:
+            for gene in genes:
+                self.fetch_gene(gene, gene_dir, journal)
 
-        prev_error_pwids = []
-        error_pwids = []
-
-        error_path = gene_dir + "error_pwids.csv"
-        if os.path.exists(error_path):
-            with open(error_path) as f:
-                prev_error_pwids = f.read().split(",")
-                error_pwids = prev_error_pwids
-
-        for gene in genes:
-            json_path = gene_dir + gene + ".json"
+    def fetch_gene(self, gene, gene_dir, journal):
+        json_path = gene_dir + gene + ".json"
 
-            if self.reuse:
-                if os.path.exists(json_path):
-                    print(f"Found cache; skip processing {gene}")
-                    continue
-                elif id in prev_error_pwids:
-                    print(f"Found previous error; skip processing {gene}")
-                    continue
-
-            # url = f"https://www.wikipathways.org/index.php/Pathway:{id}?view=widget"
-            # base_url = "https://www.wikipathways.org//wpi/wpi.php"
-            # url = f"{base_url}?action=downloadFile&type=gpml&pwTitle=Pathway:{id}"
-
-            url = (
-                "https://webservice.wikipathways.org/findInteractions"
-                f"?query={gene}&format=json"
+        if self.reuse:
+            state = journal.get_reuse_state(
+                gene, json_path, self.max_attempts
             )
-
-            try:
-                sleep(0.5)
-                interactions = requests.get(url).text
-            except Exception as e:
-                print(f"Encountered error when stringifying JSON for {gene}")
-                error_pwids.append(gene)
-                with open(error_path, "w") as f:
-                    f.write(",".join(error_pwids))
-                sleep(0.5)
-                continue
-
-            print("Preparing and writing " + json_path)
-
-            with open(json_path, "w") as f:
-                f.write(interactions)
+            if state == "ok":
+                print(f"Found cache; skip processing {gene}")
+                return
+            elif state == "empty":
+                print(f"Found no interactions before; skip processing {gene}")
+                return
+            elif state == "error":
+                print(f"Found previous error; skip processing {gene}")
+                return
+
+        # url = f"https://www.wikipathways.org/index.php/Pathway:{id}?view=widget"
+        # base_url = "https://www.wikipathways.org//wpi/wpi.php"
+        # url = f"{base_url}?action=downloadFile&type=gpml&pwTitle=Pathway:{id}"
+
+        url = get_find_interactions_url(gene)
+
+        try:
+            interactions = self.client.get(url).text
+        except Exception as e:
+            print(f"Encountered error when stringifying JSON for {gene}")
+            journal.record(gene, "error", str(e))
+            return
+
+        print("Preparing and writing " + json_path)
+
+        with open(json_path, "w") as f:
+            f.write(interactions)
+        if interactions == '{"result":[]}':
+            journal.record(gene, "empty")
+        else:
+            journal.record(gene, "ok")
 
     def optimize_interactions(self, gene_dir):
 
@@ -266,8 +243,19 @@ if __name__ == "__main__":
         ),
         action="store_true"
     )
+    parser.add_argument(
+        "--max-attempts",
+        help=(
+            "With --reuse, genes whose queries failed in earlier runs are "
+            "queried again until they have failed this many times in a "
+            "row.  (default: %(default)s, i.e. never retry)"
+        ),
+        type=int,
+        default=1
+    )
     args = parser.parse_args()
     output_dir = args.output_dir
     reuse = args.reuse
+    max_attempts = args.max_attempts
 
-    WikiPathwaysCache(output_dir, reuse).populate()
+    WikiPathwaysCache(output_dir, reuse, max_attempts).populate()
@@ -0,0 +1,122 @@
+"""Fetch, cache and parse per-organism gene lists from Ideogram
+
+Lists are cached as e.g. tmp/genes/homo-sapiens-genes.tsv.  Later runs
+send the cached ETag and Last-Modified, so an unchanged list costs one
+304 response rather than a full download.  Offline, a cached or hand-placed
+TSV in the cache directory is used as-is.
+
+Rows are: chromosome, start, length, slim ID, symbol.  Lines starting
+with "#" are comments.
+"""
+import csv
+import json
+import os
+
+import http_client
+from lib import base_urls, slug
+
+# Downloaded bytes written at a time
+chunk_size = 1 << 16
+
+def get_genes_url(organism):
+    return f"{base_urls['genes']}{slug(organism)}-genes.tsv"
+
+def get_genes_path(organism, cache_dir):
+    return f"{cache_dir}{slug(organism)}-genes.tsv"
+
+def read_validators(meta_path):
+    if not os.path.exists(meta_path):
+        return {}
+    with open(meta_path) as f:
+        return json.load(f)
+
+def is_gene_list(path):
+    """Check that a file is a non-empty gene list TSV, e.g. not an error page
+    """
+    with open(path, newline="", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            if line.startswith("#") or line.strip() == "":
+                continue
+            return len(line.split("\t")) > 4
+    return False
+
+def fetch_gene_list(organism, cache_dir, client=http_client.client):
+    """Download a gene list if it changed since last cached; return its path
+
+    A response that isn't a gene list, e.g. an empty body, never replaces
+    the cache.  The cached list is used instead, if there is one; else
+    this raises ValueError.
+    """
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+
+    url = get_genes_url(organism)
+    path = get_genes_path(organism, cache_dir)
+    meta_path = path + ".meta.json"
+
+    headers = {}
+    if os.path.exists(path):
+        validators = read_validators(meta_path)
+        if validators.get("url") == url:
+            if "etag" in validators:
+                headers["If-None-Match"] = validators["etag"]
+            if "last_modified" in validators:
+                headers["If-Modified-Since"] = validators["last_modified"]
+
+    response = client.get(url, headers=headers, stream=True)
+    if response.status_code == 304:
+        response.close()
+        print(f"Gene list for {organism} is unchanged; using {path}")
+        return path
+
+    # Stream to disk, so the whole list is never held as one string
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        for chunk in response.iter_content(chunk_size):
+            f.write(chunk)
+    if not is_gene_list(tmp_path):
+        os.remove(tmp_path)
+        if not os.path.exists(path):
+            raise ValueError(f"Response from {url} is not a gene list")
+        print(
+            f"Response from {url} is not a gene list; using cached {path}"
+        )
+        return path
+    os.replace(tmp_path, path)
+
+    validators = {"url": url}
+    if "ETag" in response.headers:
+        validators["etag"] = response.headers["ETag"]
+    if "Last-Modified" in response.headers:
+        validators["last_modified"] = response.headers["Last-Modified"]
+    with open(meta_path, "w") as f:
+        json.dump(validators, f)
+
+    print(f"Downloaded gene list for {organism} to {path}")
+    return path
+
+def read_gene_symbols(path):
+    """Get frozenset of gene symbols in a gene list TSV, reading it by line
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        return frozenset(
+            row[4] for row in csv.reader(f, delimiter="\t")
+            if len(row) > 4 and not row[0].startswith("#")
+        )
+
+def get_gene_symbols(
+    organism, cache_dir, offline=False, client=http_client.client
+):
+    """Get frozenset of an organism's gene symbols, via the local cache
+
+    Offline, a TSV must already be in `cache_dir`, e.g. as a stand-in.
+    """
+    if offline:
+        path = get_genes_path(organism, cache_dir)
+        if not os.path.exists(path):
+            raise FileNotFoundError(
+                f"No local gene list for {organism}; expected {path}"
+            )
+    else:
+        path = fetch_gene_list(organism, cache_dir, client)
+    return read_gene_symbols(path)
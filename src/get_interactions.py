@@ -1,17 +1,33 @@
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 import glob
 import os
 import re
-from time import sleep
 import json as ljson
 import gzip
-import csv
+import hashlib
+from time import perf_counter
 from typing import Set
 
-import requests
 from lxml import etree
+import requests
 
-from lib import repo, module, ctx, organisms
+from lib import repo, module, ctx, TokenBucket, run_longest_first
+from lib import (
+    get_list_pathways_url, get_find_interactions_url, use_base_url
+)
+from lib import organisms as lib_organisms
+import http_client
+from labels import get_gpml_labels
+import gene_lists
+import brotli_codec
+import bundle
+from interaction_store import InteractionStore
+import zdict_codec
+from fetch_journal import FetchJournal, skip_counters
+from manifest import BuildManifest, gzip_settings
+from metrics import Metrics, all_organisms
+import offline_interactions
 
 # # Enable importing local modules when directly calling as script
 # if __name__ == "__main__":
@@ -20,70 +36,39 @@ from lib import repo, module, ctx, organisms
 
 # from lib import download_gzip
 
-def get_pathway_ids_and_names(organism):
-    base_url = "https://webservice.wikipathways.org/listPathways"
-    params = f"?organism={organism}&format=json"
-    url = base_url + params
-    response = requests.get(url)
+def get_pathway_ids_and_names(organism, client=http_client.client):
+    url = get_list_pathways_url(organism)
+    response = client.get(url)
     data = response.json()
     ids_and_names = [[pw['id'], pw['name']] for pw in data['pathways']]
     return ids_and_names
 
-def fetch_pathway_genes(gpml_dir, organism):
+def fetch_pathway_genes(
+    gpml_dir, organism, jobs=1, index_path=None, pathway_index_path=None,
+    genes_dir="tmp/genes/", offline=False, labels=None
+):
     """List genes symbols that are also TextLabels in WikiPathways
+
+    Gene lists are cached in `genes_dir`, and only used from there if
+    `offline`.  Pass `labels` to reuse TextLabels already collected, e.g.
+    for another organism.
     """
-    pathway_genes = []
+    genes = gene_lists.get_gene_symbols(organism, genes_dir, offline)
+
+    if labels is None:
+        gpml_paths = glob.glob(f'{gpml_dir}*.xml.gz')
+        labels = get_gpml_labels(
+            gpml_paths, jobs, index_path, pathway_index_path
+        )
 
-    genes = []
-    # E.g. https://raw.githubusercontent.com/eweitz/ideogram/master/dist/data/cache/homo-sapiens-genes.tsv
-    genes_url = (
-        "https://raw.githubusercontent.com/eweitz/ideogram/"
-        f"master/dist/data/cache/{slug(organism)}-genes.tsv"
+    # Sorted, so genes are fetched and optimized in a stable order
+    pathway_genes = sorted(
+        gene for gene in genes & labels if "/" not in gene
     )
-    tsv_string = requests.get(genes_url).content.decode('utf-8')
-    reader = csv.reader(tsv_string.splitlines(), delimiter="\t")
-    for row in reader:
-        if len(row) < 4 or row[0][0] == '#': continue
-        # row: [chr, start, length, slim_id, symbol]
-        gene = row[4] # more formally, gene symbol
-        genes.append(gene)
-
-    print('len(genes)')
-    print(len(genes))
-    print('gpml_dir')
-    print(gpml_dir)
-    labels = get_gpml_labels(gpml_dir)
-
-    for gene in genes:
-        if gene in labels and "/" not in gene:
-            pathway_genes.append(gene)
 
     print(f"Found {len(pathway_genes)} {organism} genes in WikiPathways")
     return pathway_genes
 
-def get_gpml_labels(gpml_dir):
-    print("Get GPML labels")
-    labels = set()
-    for gpml_path in glob.glob(f'{gpml_dir}*.xml.gz'):
-        # print('gpml_path')
-        # print(gpml_path)
-        with gzip.open(gpml_path, 'rb') as f:
-            xml = f.read()
-        # xml = gzip.decompress(xml_gz)
-        tree = etree.fromstring(xml)
-        elements = tree.xpath('//*')
-        # print('len(elements)')
-        # print(len(elements))
-        for el in elements:
-            if "TextLabel" in el.attrib:
-                labels.add(el.attrib["TextLabel"])
-
-    print(f"Found {len(labels)} labels in compressed GPML")
-    return labels
-
-def slug(value):
-    return value.lower().replace(" ", "-")
-
 
         # const isRelevant =
         #   isInteractionRelevant(rawIxn, gene, nameId, seenNameIds, ideo);
@@ -149,67 +134,175 @@ def lossy_optimize_interactions(json_str, gene):
     return ljson.dumps(json)
 
 
+def dedupe_queries(genes_by_organism):
+    """Get sorted, distinct uppercased gene symbols across organisms
+
+    Outputs are named by uppercased symbol, so e.g. "MTOR" and "Mtor" need
+    only one findInteractions query between them.
+    """
+    return sorted({
+        gene.upper()
+        for genes in genes_by_organism.values()
+        for gene in genes
+    })
+
+# Increment when lossy_optimize_interactions output changes, to rebuild all
+optimizer_version = 1
+
 class WikiPathwaysCache():
 
-    def __init__(self, output_dir="data/", reuse=False):
+    def __init__(
+        self, output_dir="data/", reuse=False, jobs=1, formats=None,
+        codec="gzip", profile_dir=None, offline=False, genes_dir=None,
+        workers=1, organism_workers=1, max_attempts=1, brotli_quality=None
+    ):
         self.output_dir = output_dir
         self.tmp_dir = f"tmp/"
         self.reuse = reuse
+        self.jobs = jobs
+        self.workers = workers
+        self.organism_workers = organism_workers
+        self.max_attempts = max_attempts
+        self.labels = None
+
+        # Extract interactions from local GPML, instead of findInteractions,
+        # and read gene lists only from genes_dir
+        self.offline = offline
+        self.offline_index = None
+        self.genes_dir = genes_dir or self.tmp_dir + "genes/"
+
+        # "files" writes data/gene/*.json.gz, "bundle" writes data/gene.bundle,
+        # "normalized" writes each interaction once, to interactions.json.gz
+        if formats is None:
+            formats = ["files"]
+        self.formats = formats
+        self.bundle_records = {}
+        self.store = InteractionStore()
+        self.per_gene = "files" in formats or "bundle" in formats
+
+        # "gzip" compresses each record alone; "zdict" compresses against a
+        # preset dictionary trained on all records, written to gene.zdict
+        self.codec = codec
+        self.zdict_records = {}
+
+        # If set, gzip files get a Brotli sibling, e.g. A2M.json.br, and a
+        # bundle gets a Brotli twin, gene.br.bundle
+        self.brotli_quality = brotli_quality
+        self.brotli_inputs = {}
+
+        # At most 2 findInteractions queries per second, as before
+        self.limiter = TokenBucket(2.0)
+        self.client = http_client.HttpClient(
+            self.limiter, per_host=max(4, workers)
+        )
 
         if not os.path.exists(self.output_dir):
             os.makedirs(self.output_dir)
         if not os.path.exists(self.tmp_dir):
             os.makedirs(self.tmp_dir)
 
-    def fetch_interactions(self, genes, gene_dir):
-
-        prev_error_pwids = []
-        error_pwids = []
-
-        error_path = gene_dir + "error_pwids.csv"
-        if os.path.exists(error_path):
-            with open(error_path) as f:
-                prev_error_pwids = f.read().split(",")
-                error_pwids = prev_error_pwids
+        # Skip re-optimizing genes whose raw interactions are unchanged.
+        # Only per-gene gzip files can be reused as-is; a zdict dictionary
+        # is retrained on every record in each run.
+        self.incremental = "files" in formats and codec == "gzip"
+        manifest_path = self.output_dir + "gene/.manifest.json"
+        self.manifest = BuildManifest(manifest_path)
+        self.seen_json_paths = []
+
+        self.metrics = Metrics(profile_dir)
+        self.metrics_path = self.tmp_dir + "interactions_metrics.json"
+
+    def fetch_interactions(self, genes, gene_dir, organism):
+        metrics = self.metrics
+
+        journal_path = gene_dir + "fetch_journal.jsonl"
+        with FetchJournal(journal_path) as journal:
+            to_fetch = []
+            for gene in genes:
+                json_path = gene_dir + gene + ".json"
+
+                if self.reuse:
+                    state = journal.get_reuse_state(
+                        gene, json_path, self.max_attempts
+                    )
+                    if state is not None:
+                        metrics.count(skip_counters[state], organism)
+                        continue
+
+                to_fetch.append(gene)
+
+            def fetch_one(gene):
+                json_path = gene_dir + gene + ".json"
+
+                url = get_find_interactions_url(gene)
+
+                try:
+                    with metrics.timer("fetch_latency_s", organism):
+                        response = self.client.get(url)
+                    interactions = response.text
+                except Exception as e:
+                    print(
+                        f"Encountered error when stringifying JSON for {gene}"
+                    )
+                    metrics.count("fetch_errors", organism)
+                    journal.record(gene, "error", str(e))
+                    return
+
+                metrics.count("fetched", organism)
+                metrics.count(
+                    "fetch_bytes_in", organism, len(response.content)
+                )
+
+                # Written even if empty, as optimize_interactions reads it.
+                # Failed queries raise above, and write nothing.
+                with open(json_path, "w") as f:
+                    f.write(interactions)
+                if interactions == '{"result":[]}':
+                    journal.record(gene, "empty")
+                else:
+                    journal.record(gene, "ok")
 
-        for gene in genes:
-            json_path = gene_dir + gene + ".json"
+            # As in gpml.py, workers overlap slow responses; the shared token
+            # bucket still caps the request rate.
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                list(executor.map(fetch_one, to_fetch))
 
-            if self.reuse:
-                if os.path.exists(json_path):
-                    print(f"Found cache; skip processing {gene}")
-                    continue
-                elif id in prev_error_pwids:
-                    print(f"Found previous error; skip processing {gene}")
-                    continue
+        print(
+            f"Fetched interactions for "
+            f"{metrics.get_count('fetched', organism)} genes, "
+            f"{metrics.get_count('fetch_errors', organism)} errors"
+        )
 
-            # url = f"https://www.wikipathways.org/index.php/Pathway:{id}?view=widget"
-            # base_url = "https://www.wikipathways.org//wpi/wpi.php"
-            # url = f"{base_url}?action=downloadFile&type=gpml&pwTitle=Pathway:{id}"
+    def extract_interactions(self, genes, gene_dir, gpml_dir, organism):
+        """Write findInteractions-style JSON for genes, from local GPML
+        """
+        metrics = self.metrics
 
-            url = (
-                "https://webservice.wikipathways.org/findInteractions"
-                f"?query={gene}&format=json"
+        # GPML for all organisms shares one directory, so index it once
+        if self.offline_index is None:
+            gpml_paths = sorted(glob.glob(f'{gpml_dir}*.xml.gz'))
+            self.offline_index = offline_interactions.index_interactions(
+                gpml_paths, self.jobs
             )
 
-            try:
-                sleep(0.5)
-                interactions = requests.get(url).text
-            except Exception as e:
-                print(f"Encountered error when stringifying JSON for {gene}")
-                error_pwids.append(gene)
-                with open(error_path, "w") as f:
-                    f.write(",".join(error_pwids))
-                sleep(0.5)
-                continue
-
-            print("Preparing and writing " + json_path)
-
+        for gene in genes:
+            json_path = gene_dir + gene + ".json"
+            interactions = offline_interactions.get_raw_interactions(
+                self.offline_index, gene
+            )
             with open(json_path, "w") as f:
                 f.write(interactions)
+            metrics.count("extracted", organism)
+
+        print(
+            f"Extracted interactions for "
+            f"{metrics.get_count('extracted', organism)} genes from {gpml_dir}"
+        )
 
-    def optimize_interactions(self, genes, gene_dir):
+    def optimize_interactions(self, genes, gene_dir, organism):
+        metrics = self.metrics
         optimize_error_pwids = []
+        seen_genes = set()
 
         # for json_path in glob.glob(f'{gene_dir}*.json'):
         for gene in genes:
@@ -218,15 +311,29 @@ class WikiPathwaysCache():
             # Disregard fusion genes
             if "/" in gene: continue
 
-            # original_name = json_path.split("/")[-1]
-            # gene = original_name.split(".json")[0]
-            json_path = gene_dir + gene + '.json'
-
             # The same genes are often capitalized differently in different
             # organisms.  We can leverage this to decrease cache size by
             # ~2x.  E.g. human "MTOR" and orthologous mouse "Mtor".
             gene = gene.upper()
 
+            # Each output has one input, the uppercased query's response, so
+            # case variants can't swap the manifest entry between runs
+            if gene in seen_genes: continue
+            seen_genes.add(gene)
+
+            # original_name = json_path.split("/")[-1]
+            # gene = original_name.split(".json")[0]
+            json_path = gene_dir + gene + '.json'
+
+            # E.g. its findInteractions query failed, in this run or, with
+            # --reuse, in an earlier one that the journal says not to retry
+            if not os.path.exists(json_path):
+                metrics.count("optimize_missing_input", organism)
+                if self.incremental:
+                    # Still a query, so keep any output from earlier runs
+                    self.seen_json_paths.append(json_path)
+                continue
+
             # pwid = re.search(r"WP\d+", name).group() # pathway ID
             optimized_json_path = self.output_dir + "gene/" + gene + ".json.gz"
 
@@ -249,16 +356,53 @@ class WikiPathwaysCache():
 
             if json.decode("utf-8") == '{"result":[]}':
                 # print(f"Gene found, but no interactions for {gene}")
+                metrics.count("optimize_empty", organism)
                 continue
 
-            print(f"Optimizing to create: {optimized_json_path}")
+            if self.incremental:
+                input_hash = hashlib.sha256(json).hexdigest()
+                self.seen_json_paths.append(json_path)
+                if self.manifest.is_fresh(
+                    optimized_json_path, input_hash, optimizer_version,
+                    gzip_settings
+                ):
+                    if "bundle" in self.formats:
+                        with open(optimized_json_path, "rb") as f:
+                            self.bundle_records[gene] = f.read()
+                    if "normalized" in self.formats:
+                        with gzip.open(optimized_json_path, "rb") as f:
+                            self.store.add(gene, f.read())
+                    self.brotli_inputs[gene] = [
+                        optimized_json_path, json_path, input_hash
+                    ]
+                    self.remove_other_variant(gene, ".json.zlib")
+                    metrics.count("optimize_unchanged", organism)
+                    continue
 
+            metrics.count("optimize_bytes_in", organism, len(json))
+            start = perf_counter()
             try:
                 json = lossy_optimize_interactions(json, gene).encode()
                 # json = lossless_optimize_interactions(json, gene)
-                json = gzip.compress(json)
+                if "normalized" in self.formats:
+                    self.store.add(gene, json)
+                if not self.per_gene:
+                    # Nothing to compress per gene; the store is written once
+                    seconds = perf_counter() - start
+                    metrics.observe("optimize_s", seconds, organism)
+                    metrics.count("optimized", organism)
+                    continue
+                if self.codec == "zdict":
+                    # Compressed once all records are in, to train on them
+                    self.zdict_records[gene] = json
+                    seconds = perf_counter() - start
+                    metrics.observe("optimize_s", seconds, organism)
+                    metrics.count("optimized", organism)
+                    continue
+                json = gzip.compress(json, mtime=0)
 
             except Exception as e:
+                metrics.count("optimize_errors", organism)
                 handled = "Encountered error converting XML for pathway"
                 handled2 = "not well-formed"
                 if handled in str(e) or handled2 in str(e):
@@ -272,45 +416,339 @@ class WikiPathwaysCache():
                     # raise Exception(e)
                     continue
 
-            with open(optimized_json_path, "wb") as f:
-                f.write(json)
+            metrics.observe("optimize_s", perf_counter() - start, organism)
+            metrics.count("optimized", organism)
+            metrics.count("optimize_bytes_out", organism, len(json))
+
+            if "files" in self.formats:
+                with open(optimized_json_path, "wb") as f:
+                    f.write(json)
+                self.remove_other_variant(gene, ".json.zlib")
+            if "bundle" in self.formats:
+                self.bundle_records[gene] = json
+
+            if self.incremental:
+                self.manifest.record(
+                    optimized_json_path, json_path, input_hash,
+                    optimizer_version, gzip_settings
+                )
+                self.brotli_inputs[gene] = [
+                    optimized_json_path, json_path, input_hash
+                ]
 
             # with open(optimized_json_path, "w") as f:
             #     f.write(json)
 
+        print(
+            f"Optimized interactions for "
+            f"{metrics.get_count('optimized', organism)} genes, skipped "
+            f"{metrics.get_count('optimize_unchanged', organism)} unchanged "
+            f"and {metrics.get_count('optimize_missing_input', organism)} "
+            "with no fetched interactions"
+        )
+
         num_errors = len(optimize_error_pwids)
         if num_errors > 0:
             print(f"{num_errors} pathways had optimization errors:")
             print(",".join(optimize_error_pwids))
 
+        if self.incremental:
+            self.manifest.save()
+
+    def remove_other_variant(self, gene, suffix):
+        """Delete a gene's file in the other codec's format, if any
+
+        E.g. data/gene/MTOR.json.gz after switching to --codec zdict, so a
+        gene never has both a .json.gz and a .json.zlib file.
+        """
+        path = self.output_dir + "gene/" + gene + suffix
+        self.manifest.discard(path)
+        if suffix == ".json.gz":
+            self.manifest.discard(brotli_codec.get_path(path))
+
+    def make_dirs(self):
+        """Create working and output directories; return them
+        """
+        tmp_gene_dir = self.tmp_dir + "gene/"
+        gene_dir = self.output_dir + "gene/"
+        gpml_dir = self.output_dir + "gpml/"
+        for dir in [tmp_gene_dir, gene_dir, gpml_dir]:
+            if not os.path.exists(dir):
+                os.makedirs(dir)
+        return tmp_gene_dir, gpml_dir
+
+    def get_labels(self):
+        """Get TextLabels across all GPML, which all organisms share
+        """
+        if self.labels is None:
+            tmp_gene_dir, gpml_dir = self.make_dirs()
+            gpml_paths = glob.glob(f'{gpml_dir}*.xml.gz')
+            label_index_path = self.tmp_dir + "gpml_label_index.json"
+            pathway_index_path = self.output_dir + "pathway_genes.json"
+            with self.metrics.stage("get_gpml_labels"):
+                self.labels = get_gpml_labels(
+                    gpml_paths, self.jobs, label_index_path,
+                    pathway_index_path
+                )
+        return self.labels
+
+    def get_pathway_genes(self, organism):
+        """List an organism's gene symbols that are labels in WikiPathways
+        """
+        tmp_gene_dir, gpml_dir = self.make_dirs()
+        metrics = self.metrics
+        labels = self.get_labels()
+        with metrics.stage("fetch_pathway_genes", organism):
+            try:
+                genes = fetch_pathway_genes(
+                    gpml_dir, organism, self.jobs, genes_dir=self.genes_dir,
+                    offline=self.offline, labels=labels
+                )
+            except (
+                requests.HTTPError, FileNotFoundError, ValueError
+            ) as e:
+                genes = []
+                response = getattr(e, "response", None)
+                is_missing = isinstance(e, FileNotFoundError) or (
+                    response is not None and response.status_code == 404
+                )
+                if is_missing:
+                    # E.g. "Unspecified", which has no Ideogram gene list
+                    print(f"No gene list for {organism}, so skipping it: {e}")
+                    metrics.count("gene_list_missing", organism)
+                else:
+                    # Its genes are unknown, so populate keeps their outputs
+                    print(
+                        f"Could not get gene list for {organism}, so "
+                        f"skipping it: {e}"
+                    )
+                    metrics.count("gene_list_errors", organism)
+        metrics.count("pathway_genes", organism, len(genes))
+        return genes
+
+    def populate_genes(self, genes, scope):
+        """Fetch or extract, then optimize, interactions for gene symbols
+        """
+        tmp_gene_dir, gpml_dir = self.make_dirs()
+        metrics = self.metrics
+        if self.offline:
+            with metrics.stage("extract_interactions", scope):
+                self.extract_interactions(
+                    genes, tmp_gene_dir, gpml_dir, scope
+                )
+        else:
+            with metrics.stage("fetch_interactions", scope):
+                self.fetch_interactions(genes, tmp_gene_dir, scope)
+        with metrics.stage("optimize_interactions", scope):
+            self.optimize_interactions(genes, tmp_gene_dir, scope)
+
     def populate_by_org(self, organism):
         """Fill caches for a configured organism
         """
-        tmp_gene_dir = self.tmp_dir + "gene/"
-        if not os.path.exists(tmp_gene_dir):
-            os.makedirs(tmp_gene_dir)
+        genes = self.get_pathway_genes(organism)
+        self.populate_genes(dedupe_queries({organism: genes}), organism)
 
-        gene_dir = self.output_dir + "gene/"
-        if not os.path.exists(gene_dir):
-            os.makedirs(gene_dir)
+    def get_organism_sizes(self, organisms):
+        """Estimate each organism's work by its number of pathways
+        """
+        if self.offline:
+            # No pathway lists offline, so keep the given order
+            return {organism: 0 for organism in organisms}
+
+        def count_pathways(organism):
+            with self.metrics.stage("list_pathways", organism):
+                try:
+                    ids_and_names = get_pathway_ids_and_names(
+                        organism, self.client
+                    )
+                except requests.RequestException as e:
+                    # Only orders organisms, so an unknown size is fine
+                    print(f"Could not list pathways for {organism}: {e}")
+                    return 0
+                return len(ids_and_names)
+
+        no_sizes = {organism: 0 for organism in organisms}
+        return run_longest_first(
+            count_pathways, no_sizes, self.organism_workers
+        )
+
+    def populate(self, organisms=None):
+        """Fill caches for the given organisms, querying each gene once
+
+        Orthologs often share a symbol up to case, e.g. human "MTOR" and
+        mouse "Mtor", and both are cached as MTOR.  So candidate genes are
+        first collected from every organism, then each distinct uppercased
+        symbol is fetched and optimized once, for all of them.
+
+        Organisms' gene lists are gathered on `organism_workers` threads,
+        those with the most pathways first.  Organisms without a gene list
+        are skipped.  Default organisms: Homo sapiens.
+
+        Queries are deduped only across the given organisms.  Genes share
+        outputs across organisms, so outputs no gene queried are only
+        removed by runs over every configured organism, each with a gene
+        list or none upstream.
+        """
+        if organisms is None:
+            organisms = ["Homo sapiens"]
+        if len(organisms) == 1:
+            self.populate_by_org(organisms[0])
+        else:
+            self.get_labels()
+            sizes = self.get_organism_sizes(organisms)
+            genes_by_organism = run_longest_first(
+                self.get_pathway_genes, sizes, self.organism_workers
+            )
+            queries = dedupe_queries(genes_by_organism)
+            num_genes = sum(len(genes) for genes in genes_by_organism.values())
+            print(
+                f"{num_genes} genes across {len(organisms)} organisms need "
+                f"{len(queries)} distinct queries"
+            )
+            self.metrics.count("queries", value=len(queries))
+            self.metrics.count(
+                "queries_deduped", value=num_genes - len(queries)
+            )
+            self.populate_genes(queries, all_organisms)
 
-        gpml_dir = self.output_dir + "gpml/"
-        if not os.path.exists(gpml_dir):
-            os.makedirs(gpml_dir)
+        if self.incremental:
+            has_all_genes = set(organisms) >= set(lib_organisms) and all(
+                self.metrics.get_count("gene_list_errors", organism) == 0
+                for organism in organisms
+            )
+            if has_all_genes:
+                orphans = self.manifest.prune(self.seen_json_paths)
+                if len(orphans) > 0:
+                    print(
+                        f"Removed {len(orphans)} outputs with no interactions"
+                    )
+            self.manifest.save()
+
+        # Normalized output alone has no per-gene records to train on
+        if self.codec == "zdict" and self.per_gene:
+            with self.metrics.stage("write_zdict_records"):
+                self.write_zdict_records()
+
+        if "bundle" in self.formats:
+            bundle_path = self.output_dir + "gene.bundle"
+            codec = bundle.ZDICT if self.codec == "zdict" else bundle.GZIP
+            with self.metrics.stage("write_bundle"):
+                bundle.write_bundle(bundle_path, self.bundle_records, codec)
+            print(f"Wrote {len(self.bundle_records)} genes to {bundle_path}")
+
+        if self.brotli_quality is not None:
+            with self.metrics.stage("brotli"):
+                self.compress_brotli()
+            brotli_codec.report(
+                self.metrics, "interaction", self.brotli_quality
+            )
+
+        if "normalized" in self.formats:
+            store_path = self.output_dir + "interactions.json.gz"
+            with self.metrics.stage("write_normalized"):
+                self.store.save(store_path)
+            print(
+                f"Wrote {len(self.store.interactions)} distinct interactions "
+                f"for {len(self.store)} genes to {store_path}"
+            )
 
-        genes = fetch_pathway_genes(gpml_dir, organism)
-        self.fetch_interactions(genes, tmp_gene_dir)
-        self.optimize_interactions(genes, tmp_gene_dir)
+        self.metrics.save(self.metrics_path)
+        print(f"Wrote metrics to {self.metrics_path}")
 
-    def populate(self):
-        """Fill caches for all configured organisms
+    def compress_brotli(self):
+        """Write Brotli siblings of gzip files, and a Brotli bundle
 
-        Consider parallelizing this.
+        Siblings are only rewritten if stale, as tracked in the manifest.
+        The bundle reuses them where it can.
         """
-        # organisms = ["Homo sapiens", "Mus musculus"] # Comment out to use all
-        organisms = ["Homo sapiens"] # Comment out to use all
-        for organism in organisms:
-            self.populate_by_org(organism)
+        metrics = self.metrics
+        settings = brotli_codec.get_settings(self.brotli_quality)
+
+        stale = [
+            gene for gene, [gz_path, json_path, input_hash]
+            in self.brotli_inputs.items()
+            if not self.manifest.is_fresh(
+                brotli_codec.get_path(gz_path), input_hash,
+                optimizer_version, settings
+            )
+        ]
+
+        def read_gz(gene):
+            with gzip.open(self.brotli_inputs[gene][0], "rb") as f:
+                return f.read()
+
+        results = brotli_codec.compress_all(
+            stale, read_gz, self.brotli_quality, self.jobs
+        )
+        try:
+            for gene, json, result in results:
+                brotli_codec.observe(metrics, all_organisms, json, result)
+                gz_path, json_path, input_hash = self.brotli_inputs[gene]
+                with open(brotli_codec.get_path(gz_path), "wb") as f:
+                    f.write(result[0])
+                self.manifest.record(
+                    brotli_codec.get_path(gz_path), json_path, input_hash,
+                    optimizer_version, settings
+                )
+        finally:
+            self.manifest.save()
+        if len(self.brotli_inputs) > 0:
+            print(
+                f"Brotli-compressed {len(stale)} genes, skipped "
+                f"{len(self.brotli_inputs) - len(stale)} unchanged"
+            )
+
+        if "bundle" not in self.formats:
+            return
+
+        records = {}
+        to_compress = []
+        for gene in self.bundle_records:
+            if gene in self.brotli_inputs:
+                br_path = brotli_codec.get_path(self.brotli_inputs[gene][0])
+                with open(br_path, "rb") as f:
+                    records[gene] = f.read()
+            else:
+                to_compress.append(gene)
+
+        def read_record(gene):
+            if self.codec == "zdict":
+                return self.zdict_records[gene]
+            return gzip.decompress(self.bundle_records[gene])
+
+        results = brotli_codec.compress_all(
+            to_compress, read_record, self.brotli_quality, self.jobs
+        )
+        for gene, json, result in results:
+            brotli_codec.observe(metrics, all_organisms, json, result)
+            records[gene] = result[0]
+
+        bundle_path = self.output_dir + "gene.br.bundle"
+        bundle.write_bundle(bundle_path, records, bundle.BROTLI)
+        print(f"Wrote {len(records)} genes to {bundle_path}")
+
+    def write_zdict_records(self):
+        """Train a preset dictionary on optimized records, then compress them
+
+        Writes the dictionary to data/gene.zdict, and records to
+        data/gene/*.json.zlib and/or the bundle.
+        """
+        records = self.zdict_records
+        zdict = zdict_codec.train_dictionary(list(records.values()))
+        zdict_path = self.output_dir + "gene.zdict"
+        zdict_codec.write_dictionary(zdict_path, zdict)
+        print(f"Wrote {len(zdict)} byte preset dictionary to {zdict_path}")
+
+        for gene, json in records.items():
+            json = zdict_codec.encode(json, zdict)
+            if "files" in self.formats:
+                zlib_path = self.output_dir + "gene/" + gene + ".json.zlib"
+                with open(zlib_path, "wb") as f:
+                    f.write(json)
+                self.remove_other_variant(gene, ".json.gz")
+            if "bundle" in self.formats:
+                self.bundle_records[gene] = json
+        self.manifest.save()
 
 # Command-line handler
 if __name__ == "__main__":
@@ -332,8 +770,143 @@ if __name__ == "__main__":
         ),
         action="store_true"
     )
+    parser.add_argument(
+        "--jobs",
+        help=(
+            "Number of processes for reading GPML labels.  "
+            "(default: %(default)s)"
+        ),
+        type=int,
+        default=1
+    )
+    parser.add_argument(
+        "--format",
+        help=(
+            "Output format for optimized interactions; repeat to write "
+            "several.  \"files\" writes a .json.gz per gene, \"bundle\" "
+            "writes one indexed gene.bundle, \"normalized\" writes each "
+            "interaction and pathway once, to interactions.json.gz.  "
+            "(default: files)"
+        ),
+        choices=["files", "bundle", "normalized"],
+        action="append"
+    )
+    parser.add_argument(
+        "--codec",
+        help=(
+            "Compression for optimized interactions.  \"zdict\" uses zlib "
+            "with a preset dictionary trained on all records, which is "
+            "written to gene.zdict; needs --format files or bundle.  "
+            "(default: %(default)s)"
+        ),
+        choices=["gzip", "zdict"],
+        default="gzip"
+    )
+    parser.add_argument(
+        "--profile",
+        help=(
+            "Directory to save cProfile stats for each stage, per organism"
+        ),
+        metavar="DIR"
+    )
+    parser.add_argument(
+        "--offline",
+        help=(
+            "Extract interactions from GPML in the output directory, "
+            "instead of querying the findInteractions web service, and use "
+            "only gene lists already in --genes-dir"
+        ),
+        action="store_true"
+    )
+    parser.add_argument(
+        "--genes-dir",
+        help=(
+            "Directory to cache organism gene lists in, e.g. "
+            "homo-sapiens-genes.tsv.  A TSV placed here stands in for the "
+            "download when --offline.  (default: tmp/genes/)"
+        )
+    )
+    parser.add_argument(
+        "--organism",
+        help=(
+            "Organism to cache genes for, e.g. \"Mus musculus\"; repeat for "
+            "several, which share queries for the same uppercased symbol.  "
+            "\"all\" uses every configured organism.  (default: Homo sapiens)"
+        ),
+        action="append"
+    )
+    parser.add_argument(
+        "--workers",
+        help=(
+            "Number of concurrent findInteractions queries; all share one "
+            "rate limit.  (default: %(default)s)"
+        ),
+        type=int,
+        default=1
+    )
+    parser.add_argument(
+        "--organism-workers",
+        help=(
+            "Number of organisms to gather gene lists for at once, largest "
+            "first.  (default: %(default)s)"
+        ),
+        type=int,
+        default=1
+    )
+    parser.add_argument(
+        "--max-attempts",
+        help=(
+            "With --reuse, genes whose queries failed in earlier runs are "
+            "queried again until they have failed this many times in a "
+            "row.  (default: %(default)s, i.e. never retry)"
+        ),
+        type=int,
+        default=1
+    )
+    parser.add_argument(
+        "--brotli",
+        help=(
+            "Also write Brotli-compressed records at this quality, from 0 "
+            "to 11: a .br beside each .json.gz, and gene.br.bundle beside "
+            "gene.bundle.  Uses --jobs processes."
+        ),
+        type=int,
+        choices=range(12),
+        metavar="QUALITY"
+    )
+    parser.add_argument(
+        "--base-url",
+        help=(
+            "Send all requests to this server instead of upstream, e.g. "
+            "http://127.0.0.1:8000 from src/stand_in_server.py"
+        ),
+        metavar="URL"
+    )
     args = parser.parse_args()
     output_dir = args.output_dir
     reuse = args.reuse
-
-    WikiPathwaysCache(output_dir, reuse).populate()
+    jobs = args.jobs
+    formats = args.format or ["files"]
+    codec = args.codec
+    if codec == "zdict" and "files" not in formats and "bundle" not in formats:
+        parser.error("--codec zdict needs --format files or bundle")
+    profile_dir = args.profile
+    offline = args.offline
+    genes_dir = args.genes_dir
+    workers = args.workers
+    organism_workers = args.organism_workers
+    max_attempts = args.max_attempts
+    brotli_quality = args.brotli
+    if args.base_url is not None:
+        use_base_url(args.base_url)
+    if args.organism is None:
+        organisms = ["Homo sapiens"]
+    elif "all" in args.organism:
+        organisms = lib_organisms
+    else:
+        organisms = args.organism
+
+    WikiPathwaysCache(
+        output_dir, reuse, jobs, formats, codec, profile_dir, offline,
+        genes_dir, workers, organism_workers, max_attempts, brotli_quality
+    ).populate(organisms)
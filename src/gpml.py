@@ -1,16 +1,28 @@
 import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import glob
+from itertools import repeat
 import os
 import re
-from time import sleep
-import json as ljson
+import threading
+from time import perf_counter
 import gzip
+import zipfile
 
-import requests
 from lxml import etree
-import xmltodict
 
-from lib import repo, module, ctx, organisms
+from lib import (
+    repo, module, ctx, TokenBucket, hash_file, run_longest_first,
+    get_list_pathways_url, get_download_gpml_url, use_base_url, positive_float
+)
+from lib import organisms as lib_organisms
+import brotli_codec
+import compact_gpml
+import gpml_archive
+import http_client
+from fetch_journal import FetchJournal, skip_counters
+from manifest import BuildManifest, gzip_settings
+from metrics import Metrics
 
 
 # # Enable importing local modules when directly calling as script
@@ -20,89 +32,140 @@ from lib import repo, module, ctx, organisms
 
 # from lib import download_gzip
 
-def get_pathway_ids_and_names(organism):
-    base_url = "https://webservice.wikipathways.org/listPathways"
-    params = f"?organism={organism}&format=json"
-    url = base_url + params
-    response = requests.get(url)
+def get_pathway_ids_and_names(organism, client=http_client.client):
+    url = get_list_pathways_url(organism)
+    response = client.get(url)
     data = response.json()
     ids_and_names = [[pw['id'], pw['name']] for pw in data['pathways']]
     return ids_and_names
 
-def condense_colors(xml):
+# GPML attributes that hold hexadecimal colors, e.g. "ff0000"
+color_attrs = ["Color", "FillColor"]
+
+# Colors whose channels each repeat a digit, e.g. "ff0000" or "#cc00cc"
+condensable_color = re.compile(
+    r"(#?)([0-9a-fA-F])\2([0-9a-fA-F])\3([0-9a-fA-F])\4"
+)
+
+# Colors with a CSS name that is shorter than their hexadecimal form
+named_colors = {"808080": "grey"}
+
+def condense_color(color):
+    """Abbreviate one color, e.g. "ff0000" to "f00", if possible
+    """
+    if color in named_colors:
+        return named_colors[color]
+    match = condensable_color.fullmatch(color)
+    if match is None:
+        return color
+    return match.expand(r"\1\2\3\4")
+
+def condense_colors(tree):
     """Condense colors by using hexadecimal abbreviations where possible.
-    Consider using an abstract, general approach instead of hard-coding.
+
+    Operates on color attributes in the parsed tree, so values elsewhere in
+    the document (e.g. digit runs in IDs or labels) are never touched.
+    """
+    for el in tree.iter(etree.Element):
+        for attr_name in color_attrs:
+            color = el.get(attr_name)
+            if color is not None:
+                el.set(attr_name, condense_color(color))
+
+gpml_ns = "http://pathvisio.org/GPML/2013a"
+
+positional_attrs = [
+    "X", "Y", "CenterX", "CenterY", "Valign", "RelX", "RelY", "Rotation",
+    "Position"
+]
+extraneous_attrs = set(positional_attrs + [
+    "ZOrder", "FontWeight", "FontSize", "LineThickness",
+    "Width", "Height" # These two might be useful later, but not now
+])
+
+extraneous_elements = [
+    "Attribute", "Xref", "Label", "Comment",
+    "BiopaxRef", "Biopax"
+]
+extraneous_tags = {f"{{{gpml_ns}}}{name}" for name in extraneous_elements}
+
+# Elements that are dropped if nothing is left in them, e.g. "<Graphics/>"
+prunable_elements = ["Graphics", "Point"]
+
+rdf_datatype = 'rdf:datatype="http://www.w3.org/2001/XMLSchema#string"'
+
+def is_prunable(el):
+    """Whether element would serialize as e.g. "<Graphics/>" then newline
     """
-    xml = re.sub('000000', '000', xml)
-    xml = re.sub('ff0000', 'f00', xml)
-    xml = re.sub('00ff00', '0f0', xml)
-    xml = re.sub('0000ff', '00f', xml)
-    xml = re.sub('00ffff', '0ff', xml)
-    xml = re.sub('ff00ff', 'f0f', xml)
-    xml = re.sub('ffff00', 'ff0', xml)
-    xml = re.sub('ffffff', 'fff', xml)
-    xml = re.sub('cc0000', 'c00', xml)
-    xml = re.sub('00cc00', '0c0', xml)
-    xml = re.sub('0000cc', '00c', xml)
-    xml = re.sub('00cccc', '0cc', xml)
-    xml = re.sub('cc00cc', 'c0c', xml)
-    xml = re.sub('cccc00', 'cc0', xml)
-    xml = re.sub('cccccc', 'ccc', xml)
-    xml = re.sub('999999', '999', xml)
-    xml = re.sub('808080', 'grey', xml)
+    return (
+        el.prefix is None and
+        len(el.attrib) == 0 and
+        len(el) == 0 and
+        el.text is None and
+        el.tail is not None and
+        el.tail.startswith("\n")
+    )
 
-    return xml
+def prune(el):
+    """Remove element and the newline after it, keeping the rest of its tail
+    """
+    rest = el.tail[1:]
+    previous = el.getprevious()
+    parent = el.getparent()
+    if previous is not None:
+        previous.tail = (previous.tail or "") + rest
+    else:
+        parent.text = (parent.text or "") + rest
+    parent.remove(el)
 
 def lossy_optimize_gpml(gpml, pwid):
     """Lossily decrease size of WikiPathways GPML
-    """
-    ns_map = {
-        "gpml": "http://pathvisio.org/GPML/2013a",
-        "bp": "http://www.biopax.org/release/biopax-level3.owl#"
-    }
 
-    gpml = re.sub(pwid.lower(), '', gpml)
+    Strips attributes, condenses colors, and finds extraneous and prunable
+    elements in a single walk over the tree.
+    """
+    gpml = gpml.replace(pwid.lower(), '')
 
     gpml = gpml.replace('<?xml version="1.0" encoding="UTF-8"?>\n', '')
 
-    # print('gpml')
-    # print(gpml)
-
     tree = etree.fromstring(gpml)
 
-    positional_attrs = [
-        "X", "Y", "CenterX", "CenterY", "Valign", "RelX", "RelY", "Rotation",
-        "Position"
-    ]
-    extraneous_attrs = positional_attrs + [
-        "ZOrder", "FontWeight", "FontSize", "LineThickness",
-        "Width", "Height" # These two might be useful later, but not now
-    ]
-    # print('tree')
-    # print(tree)
-    # print('pwid')
-    # print(pwid)
-    elements = tree.xpath('//*')
-    for el in elements:
-        for attr_name in extraneous_attrs:
-            if attr_name in el.attrib: del el.attrib[attr_name]
-
-    extraneous_elements = [
-        "Attribute", "Xref", "Label", "Comment",
-        "BiopaxRef", "Biopax"
-    ]
-    # key = '@Key="org.pathvisio.model.BackpageHead"'
-    # selector = f"//gpml:Attribute[{key}]"
-    for el_name in extraneous_elements:
-        selector = f"//gpml:{el_name}"
-        attribute_elements = tree.xpath(selector, namespaces=ns_map)
-        for el in attribute_elements:
-            el.getparent().remove(el)
-
-    # controls = tree.xpath('//*[@class="gpml-pan-zoom-control"]')[0]
-    # tree.remove(controls)
-    # controls_style = tree.xpath('//*[@id="gpml-pan-zoom-controls-styles"]')[0]
-    # controls_style.getparent().remove(controls_style)
+    extraneous = []
+    prunable = {name: [] for name in prunable_elements}
+
+    for el in tree.iter(etree.Element):
+        attrib = el.attrib
+        for attr_name in attrib.keys():
+            if attr_name in extraneous_attrs:
+                del attrib[attr_name]
+
+        for attr_name in color_attrs:
+            color = attrib.get(attr_name)
+            if color is not None:
+                attrib[attr_name] = condense_color(color)
+
+        # Drop Shape="None", except as the last attribute; this matches
+        # the serialized-string pass this replaced.
+        if attrib.get("Shape") == "None" and attrib.keys()[-1] != "Shape":
+            del attrib["Shape"]
+
+        tag = el.tag
+        if tag in extraneous_tags:
+            extraneous.append(el)
+        else:
+            name = tag.rpartition("}")[2]
+            if name in prunable:
+                prunable[name].append(el)
+
+    for el in extraneous:
+        el.getparent().remove(el)
+
+    # Pruned only once extraneous children are gone, as e.g. a Graphics
+    # element may be left empty by that.
+    for name in prunable_elements:
+        for el in prunable[name]:
+            if is_prunable(el):
+                prune(el)
 
     try:
         xml = etree.tostring(tree).decode("utf-8")
@@ -112,188 +175,525 @@ def lossy_optimize_gpml(gpml, pwid):
 
     xml = '<?xml version="1.0" encoding="UTF-8"?>\n' + xml
 
-    rdf_datatype = 'rdf:datatype="http://www.w3.org/2001/XMLSchema#string"'
-    xml = re.sub(rdf_datatype, '', xml)
+    # Only seen within Biopax, which is removed above, so this rarely runs
+    if rdf_datatype in xml:
+        xml = xml.replace(rdf_datatype, '')
 
-    xml = re.sub('<Xref Database="" ID="" />', '', xml)
+    return xml
 
-    xml = re.sub('<Graphics/>\n', '', xml)
+def lossless_optimize_gpml(xml, pwid):
+    """Losslessly encode GPML as compact JSON; see compact_gpml.py
+    """
+    return compact_gpml.encode(xml)
 
-    xml = re.sub('<Point/>\n', '', xml)
+# Increment when lossy_optimize_gpml output changes, to rebuild all outputs
+optimizer_version = 2
 
-    xml = re.sub('Shape="None" ', '', xml)
+# Archive members read and optimized at a time, to bound memory
+archive_batch_size = 256
 
-    xml = condense_colors(xml)
+# Pathway ID at the end of a GPML file name, e.g. "WP254" in WP254.gpml or
+# archive member Hs_Apoptosis_WP254_116453.gpml, whose title may itself
+# contain "WP" and digits
+gpml_name_pwid = re.compile(r"(?:^|_)(WP\d+)(?:_\d+)?$")
 
-    return xml
+def get_pwid(gpml_path):
+    original_name = gpml_path.split("/")[-1]
+    name = original_name.split(".gpml")[0]
+    match = gpml_name_pwid.search(name)
+    if match is None:
+        raise ValueError(f"No pathway ID in GPML file name: {original_name}")
+    return match.group(1) # pathway ID
 
-def lossless_optimize_gpml(xml, pwid):
-    # json = ljson.dumps(xmltodict.parse(xml), indent=2)
-    json = ljson.dumps(xmltodict.parse(xml))
-
-    json = re.sub('@TextLabel', 'tl', json)
-    json = re.sub('@GraphId', 'g', json)
-    json = re.sub('@GraphRef', 'gr', json)
-    json = re.sub('@GroupRef', 'Gr', json)
-    json = re.sub('@GroupId', 'Gi', json)
-    json = re.sub('@Type', 't', json)
-    json = re.sub('@Color', 'c', json)
-    json = re.sub('@ArrowHead', 'a', json)
-    json = re.sub('Graphics', 'gx', json)
-    json = re.sub('Point', 'p', json)
-    json = re.sub('Interaction', 'i', json)
-    json = re.sub('Comment', 'cm', json)
-    json = re.sub('@ShapeType', 's', json)
-    json = re.sub('Anchor', 'an', json)
-    json = re.sub('"Protein"', '"p"', json)
-    json = re.sub('"GeneProduct"', '"g"', json)
-    json = re.sub('"Arrow"', '"a"', json)
-    json = re.sub('@LineStyle', 'ls')
-
-    return json
+def get_optimized_xml_path(gpml_path, output_dir):
+    return output_dir + get_pwid(gpml_path) + ".xml.gz"
+
+def optimize_gpml_text(gpml, gpml_path, output_dir):
+    """Optimize and compress raw GPML, e.g. as read from a file or zip member
+
+    Module-level so it can run in a worker process.  `gpml_path` names the
+    pathway, e.g. tmp/homo-sapiens/WP4.gpml.  Returns a tuple of pathway ID,
+    output path, compressed XML, handled error (or None), and seconds spent
+    optimizing and compressing.
+    """
+    original_name = gpml_path.split("/")[-1]
+    pwid = get_pwid(gpml_path)
+    optimized_xml_path = get_optimized_xml_path(gpml_path, output_dir)
+    optimized_json_path = optimized_xml_path.replace('.xml', '.json')
+
+    # try:
+    #     gpml_xml = scour.scourString(gpml, options=scour_options)
+    # except Exception as e:
+    #     print(f"Encountered error while optimizing GPML for {pwid}")
+    #     continue
+
+    repo_url = f"https://github.com/{repo}/tree/main/"
+    code_url = f"{repo_url}src/{module}"
+    data_url = f"{repo_url}{optimized_xml_path}"
+    wp_url = f"https://www.wikipathways.org/index.php/Pathway:{pwid}"
+    provenance = "\n".join([
+        "<!--",
+        f"  WikiPathways page: {wp_url}",
+        f"  URL for this compressed file: {data_url}",
+        # f"  Uncompressed GPML file: {original_name}",
+        # f"  From upstream ZIP archive: {url}",
+        f"  Source code for compression: {code_url}",
+        "-->"
+    ])
+
+    start = perf_counter()
+    try:
+        xml = lossy_optimize_gpml(gpml, pwid)
+        # json = lossless_optimize_gpml(xml, pwid)
+        xml = gzip.compress(xml.encode('utf-8'), mtime=0)
+
+    except Exception as e:
+        handled = "Encountered error converting XML for pathway"
+        handled2 = "not well-formed"
+        if handled in str(e) or handled2 in str(e):
+            # print('Handled an error')
+            seconds = perf_counter() - start
+            return pwid, optimized_xml_path, None, str(e), seconds
+        else:
+            print('Encountered fatal error')
+            print(e)
+            raise Exception(e)
+
+    return pwid, optimized_xml_path, xml, None, perf_counter() - start
+
+def optimize_gpml_file(gpml_path, output_dir):
+    """Optimize and compress one raw GPML file; see optimize_gpml_text
+    """
+    with open(gpml_path, 'r') as f:
+        gpml = f.read()
+    return optimize_gpml_text(gpml, gpml_path, output_dir)
 
 class WikiPathwaysCache():
 
-    def __init__(self, output_dir="data/gpml/", reuse=False):
+    def __init__(
+        self, output_dir="data/gpml/", reuse=False, workers=1, rate=1.0,
+        jobs=1, profile_dir=None, organism_workers=1, max_attempts=1,
+        brotli_quality=None, archives=None, tmp_dir="tmp/"
+    ):
         self.output_dir = output_dir
-        self.tmp_dir = f"tmp/"
+        self.tmp_dir = tmp_dir
         self.reuse = reuse
+        self.workers = workers
+        self.jobs = jobs
+        self.organism_workers = organism_workers
+        self.max_attempts = max_attempts
+
+        # If set, optimized GPML also gets a Brotli sibling, e.g. WP4.xml.br
+        self.brotli_quality = brotli_quality
+
+        # If set, raw GPML comes from these zip archives, by path or URL,
+        # rather than one request per pathway
+        self.archives = archives or []
+        self.archive_dir = self.tmp_dir + "archives/"
+
+        # Shared across organisms and workers, to stay polite to WikiPathways
+        self.limiter = TokenBucket(rate)
+        self.client = http_client.HttpClient(
+            self.limiter, per_host=max(4, workers * organism_workers)
+        )
 
         if not os.path.exists(self.output_dir):
             os.makedirs(self.output_dir)
         if not os.path.exists(self.tmp_dir):
             os.makedirs(self.tmp_dir)
 
-    def fetch_gpml(self, ids_and_names, org_dir):
-
-        prev_error_pwids = []
+        self.manifest = BuildManifest(self.output_dir + ".manifest.json")
+        self.seen_gpml_paths = []
+        self.seen_org_dirs = []
+        self.lock = threading.Lock()
+
+        self.metrics = Metrics(profile_dir)
+        self.metrics_path = self.tmp_dir + "gpml_metrics.json"
+
+    def fetch_gpml(self, ids_and_names, org_dir, organism):
+        metrics = self.metrics
+
+        journal_path = org_dir + "fetch_journal.jsonl"
+        with FetchJournal(journal_path) as journal:
+            ids = []
+            for i_n in ids_and_names:
+                id = i_n[0]
+                gpml_path = org_dir + id + ".gpml"
+
+                if self.reuse:
+                    state = journal.get_reuse_state(
+                        id, gpml_path, self.max_attempts
+                    )
+                    if state is not None:
+                        metrics.count(skip_counters[state], organism)
+                        continue
+
+                ids.append(id)
+
+            def fetch_one(id):
+                gpml_path = org_dir + id + ".gpml"
+
+                url = get_download_gpml_url(id)
+
+                try:
+                    with metrics.timer("fetch_latency_s", organism):
+                        response = self.client.get(url)
+                    gpml = response.text
+                except Exception as e:
+                    print(
+                        f"Encountered error when stringifying GPML for {id}"
+                    )
+                    metrics.count("fetch_errors", organism)
+                    journal.record(id, "error", str(e))
+                    return
+
+                metrics.count("fetched", organism)
+                metrics.count(
+                    "fetch_bytes_in", organism, len(response.content)
+                )
+
+                if gpml.strip() == "":
+                    metrics.count("fetched_empty", organism)
+                    journal.record(id, "empty")
+                    return
+
+                with open(gpml_path, "w") as f:
+                    f.write(gpml)
+                journal.record(id, "ok")
+
+            # Worker count bounds concurrency; the shared token bucket bounds
+            # request rate, so more workers only help while responses are
+            # slow.
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                list(executor.map(fetch_one, ids))
+
+        print(
+            f"Fetched {metrics.get_count('fetched', organism)} of "
+            f"{len(ids)} {organism} pathways, "
+            f"{metrics.get_count('fetch_errors', organism)} errors"
+        )
+
+    def optimize_gpml(self, org_dir, organism):
+        """Optimize and compress raw GPML; return dict of path -> hash
+        """
+        metrics = self.metrics
+
+        gpml_paths = glob.glob(f'{org_dir}*.gpml')
+        # gpml_paths = ["tmp/homo-sapiens/WP231.gpml"] # debug
+        with self.lock:
+            self.seen_gpml_paths += gpml_paths
+
+        # Skip pathways whose raw GPML and optimizer are unchanged since
+        # their output was built
+        all_hashes = {}
+        input_hashes = {}
+        for gpml_path in gpml_paths:
+            input_hash = hash_file(gpml_path)
+            all_hashes[gpml_path] = input_hash
+            optimized_xml_path = get_optimized_xml_path(
+                gpml_path, self.output_dir
+            )
+            if not self.manifest.is_fresh(
+                optimized_xml_path, input_hash, optimizer_version,
+                gzip_settings
+            ):
+                input_hashes[gpml_path] = input_hash
+        stale_paths = list(input_hashes)
+
+        num_unchanged = len(gpml_paths) - len(stale_paths)
+        metrics.count("optimize_unchanged", organism, num_unchanged)
+
+        # Workers parse and compress; this process writes, in glob order
+        if self.jobs > 1:
+            executor = ProcessPoolExecutor(max_workers=self.jobs)
+            results = executor.map(
+                optimize_gpml_file, stale_paths, repeat(self.output_dir),
+                chunksize=8
+            )
+        else:
+            executor = None
+            results = map(
+                optimize_gpml_file, stale_paths, repeat(self.output_dir)
+            )
+
+        sizes = [os.path.getsize(gpml_path) for gpml_path in stale_paths]
+        try:
+            error_pwids = self.write_optimized(
+                stale_paths, sizes, results, input_hashes, organism
+            )
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+            self.manifest.save()
+
+        self.print_optimized(organism, num_unchanged, error_pwids)
+        return all_hashes
+
+    def write_optimized(
+        self, gpml_paths, sizes, results, input_hashes, organism
+    ):
+        """Write and record outputs of optimize_gpml_text, in input order
+
+        Returns IDs of pathways that had optimization errors.
+        """
+        metrics = self.metrics
         error_pwids = []
-
-        error_path = org_dir + "error_pwids.csv"
-        if os.path.exists(error_path):
-            with open(error_path) as f:
-                prev_error_pwids = f.read().split(",")
-                error_pwids = prev_error_pwids
-
-        for i_n in ids_and_names:
-            id = i_n[0]
-            gpml_path = org_dir + id + ".gpml"
-
-            if self.reuse:
-                if os.path.exists(gpml_path):
-                    print(f"Found cache; skip processing {id}")
-                    continue
-                elif id in prev_error_pwids:
-                    print(f"Found previous error; skip processing {id}")
-                    continue
-
-            url = f"https://www.wikipathways.org/index.php/Pathway:{id}?view=widget"
-            base_url = "https://www.wikipathways.org/wpi/wpi.php"
-            url = f"{base_url}?action=downloadFile&type=gpml&pwTitle=Pathway:{id}"
-
-            try:
-                sleep(1)
-                gpml = requests.get(url).text
-            except Exception as e:
-                print(f"Encountered error when stringifying GPML for {id}")
-                error_pwids.append(id)
-                with open(error_path, "w") as f:
-                    f.write(",".join(error_pwids))
-                sleep(0.5)
+        for gpml_path, size, result in zip(gpml_paths, sizes, results):
+            pwid, optimized_xml_path, xml, error, seconds = result
+            metrics.observe("optimize_s", seconds, organism)
+            metrics.count("optimize_bytes_in", organism, size)
+            if error is not None:
+                print(error)
+                metrics.count("optimize_errors", organism)
+                error_pwids.append(pwid)
                 continue
 
-            print("Preparing and writing " + gpml_path)
-
-            with open(gpml_path, "w") as f:
-                f.write(gpml)
-            sleep(1)
-
-    def optimize_gpml(self, org_dir):
-
-        optimize_error_pwids = []
-
-        for gpml_path in glob.glob(f'{org_dir}*.gpml'):
-        # for gpml_path in ["tmp/homo-sapiens/WP231.gpml"]: # debug
-
-            # print('gpml')
-            # print(gpml)
-            original_name = gpml_path.split("/")[-1]
-            name = original_name.split(".gpml")[0]
-            pwid = re.search(r"WP\d+", name).group() # pathway ID
-            optimized_xml_path = self.output_dir + pwid + ".xml.gz"
-            optimized_json_path = optimized_xml_path.replace('.xml', '.json')
-            print(f"Optimizing to create: {optimized_xml_path}")
-
-            # try:
-            #     gpml_xml = scour.scourString(gpml, options=scour_options)
-            # except Exception as e:
-            #     print(f"Encountered error while optimizing GPML for {pwid}")
-            #     continue
-
-            repo_url = f"https://github.com/{repo}/tree/main/"
-            code_url = f"{repo_url}src/{module}"
-            data_url = f"{repo_url}{optimized_xml_path}"
-            wp_url = f"https://www.wikipathways.org/index.php/Pathway:{pwid}"
-            provenance = "\n".join([
-                "<!--",
-                f"  WikiPathways page: {wp_url}",
-                f"  URL for this compressed file: {data_url}",
-                # f"  Uncompressed GPML file: {original_name}",
-                # f"  From upstream ZIP archive: {url}",
-                f"  Source code for compression: {code_url}",
-                "-->"
-            ])
-
-            with open(gpml_path, 'r') as f:
-                gpml = f.read()
-
-            try:
-                xml = lossy_optimize_gpml(gpml, pwid)
-                # json = lossless_optimize_gpml(xml, pwid)
-                xml = gzip.compress(xml.encode('utf-8'))
-
-            except Exception as e:
-                handled = "Encountered error converting XML for pathway"
-                handled2 = "not well-formed"
-                if handled in str(e) or handled2 in str(e):
-                    # print('Handled an error')
-                    print(e)
-                    optimize_error_pwids.append(pwid)
-                    continue
-                else:
-                    print('Encountered fatal error')
-                    print(e)
-                    raise Exception(e)
-
+            metrics.count("optimized", organism)
+            metrics.count("optimize_bytes_out", organism, len(xml))
             with open(optimized_xml_path, "wb") as f:
                 f.write(xml)
 
-            # with open(optimized_json_path, "w") as f:
-            #     f.write(json)
+            self.manifest.record(
+                optimized_xml_path, gpml_path, input_hashes[gpml_path],
+                optimizer_version, gzip_settings
+            )
+        return error_pwids
+
+    def print_optimized(self, organism, num_unchanged, error_pwids):
+        metrics = self.metrics
+        print(
+            f"Optimized {metrics.get_count('optimized', organism)} "
+            f"{organism} pathways, skipped {num_unchanged} unchanged"
+        )
 
-        num_errors = len(optimize_error_pwids)
+        num_errors = len(error_pwids)
         if num_errors > 0:
             print(f"{num_errors} pathways had optimization errors:")
-            print(",".join(optimize_error_pwids))
+            print(",".join(error_pwids))
+
+    def optimize_archive(self, archive_path, org_dir, organism):
+        """Optimize GPML streamed from a zip archive; return path -> hash
 
-    def populate_by_org(self, organism):
+        Members are read one batch at a time in this process and optimized
+        by workers, without extracting them.  Each is recorded as if at
+        e.g. tmp/homo-sapiens/Hs_Apoptosis_WP254_116453.gpml, and hashed by
+        its CRC, so unchanged members are skipped unread.
+        """
+        metrics = self.metrics
+
+        with zipfile.ZipFile(archive_path) as archive:
+            # Keyed by base name, so members in different folders of the zip
+            # must not share one
+            members = {}
+            for info in gpml_archive.list_members(archive):
+                gpml_path = org_dir + info.filename.split("/")[-1]
+                if gpml_path in members:
+                    raise ValueError(
+                        f"{archive_path} has more than one member named "
+                        f"like {gpml_path}: {members[gpml_path].filename} "
+                        f"and {info.filename}"
+                    )
+                members[gpml_path] = info
+            with self.lock:
+                self.seen_gpml_paths += list(members)
+                self.seen_org_dirs.append(org_dir)
+
+            all_hashes = {}
+            input_hashes = {}
+            for gpml_path, info in members.items():
+                input_hash = gpml_archive.get_member_hash(info)
+                all_hashes[gpml_path] = input_hash
+                optimized_xml_path = get_optimized_xml_path(
+                    gpml_path, self.output_dir
+                )
+                if not self.manifest.is_fresh(
+                    optimized_xml_path, input_hash, optimizer_version,
+                    gzip_settings
+                ):
+                    input_hashes[gpml_path] = input_hash
+            stale_paths = list(input_hashes)
+
+            num_unchanged = len(members) - len(stale_paths)
+            metrics.count("optimize_unchanged", organism, num_unchanged)
+
+            executor = None
+            if self.jobs > 1:
+                executor = ProcessPoolExecutor(max_workers=self.jobs)
+
+            error_pwids = []
+            try:
+                # Batches bound how much raw GPML is held at once
+                for i in range(0, len(stale_paths), archive_batch_size):
+                    batch = stale_paths[i:i + archive_batch_size]
+                    gpmls = []
+                    for gpml_path in batch:
+                        with metrics.timer("archive_read_s", organism):
+                            gpml = gpml_archive.read_member(
+                                archive, members[gpml_path]
+                            )
+                        gpmls.append(gpml)
+                    if executor is not None:
+                        results = executor.map(
+                            optimize_gpml_text, gpmls, batch,
+                            repeat(self.output_dir), chunksize=8
+                        )
+                    else:
+                        results = map(
+                            optimize_gpml_text, gpmls, batch,
+                            repeat(self.output_dir)
+                        )
+                    sizes = [members[path].file_size for path in batch]
+                    error_pwids += self.write_optimized(
+                        batch, sizes, results, input_hashes, organism
+                    )
+            finally:
+                if executor is not None:
+                    executor.shutdown(cancel_futures=True)
+                self.manifest.save()
+
+        self.print_optimized(organism, num_unchanged, error_pwids)
+        return all_hashes
+
+    def compress_brotli(self, input_hashes, organism):
+        """Write Brotli siblings for optimized GPML that lacks a fresh one
+        """
+        settings = brotli_codec.get_settings(self.brotli_quality)
+        stale = {}
+        for gpml_path, input_hash in input_hashes.items():
+            xml_path = get_optimized_xml_path(gpml_path, self.output_dir)
+            if not os.path.exists(xml_path):
+                # E.g. GPML that failed to optimize
+                continue
+            if not self.manifest.is_fresh(
+                brotli_codec.get_path(xml_path), input_hash,
+                optimizer_version, settings
+            ):
+                stale[xml_path] = gpml_path
+
+        def read(xml_path):
+            with gzip.open(xml_path, "rb") as f:
+                return f.read()
+
+        results = brotli_codec.compress_all(
+            list(stale), read, self.brotli_quality, self.jobs
+        )
+        try:
+            for xml_path, xml, result in results:
+                brotli_codec.observe(self.metrics, organism, xml, result)
+                br_path = brotli_codec.get_path(xml_path)
+                with open(br_path, "wb") as f:
+                    f.write(result[0])
+                gpml_path = stale[xml_path]
+                self.manifest.record(
+                    br_path, gpml_path, input_hashes[gpml_path],
+                    optimizer_version, settings
+                )
+        finally:
+            self.manifest.save()
+
+        num_unchanged = len(input_hashes) - len(stale)
+        print(
+            f"Brotli-compressed {len(stale)} {organism} pathways, "
+            f"skipped {num_unchanged} unchanged or missing"
+        )
+
+    def list_pathways(self, organism):
+        with self.metrics.stage("list_pathways", organism):
+            return get_pathway_ids_and_names(organism, self.client)
+
+    def populate_by_org(self, organism, ids_and_names=None):
         """Fill caches for a configured organism
         """
         org_dir = self.tmp_dir + organism.lower().replace(" ", "-") + "/"
         if not os.path.exists(org_dir):
             os.makedirs(org_dir)
 
-        ids_and_names = get_pathway_ids_and_names(organism)
-        self.fetch_gpml(ids_and_names, org_dir)
-        self.optimize_gpml(org_dir)
-
-    def populate(self):
-        """Fill caches for all configured organisms
+        with self.lock:
+            self.seen_org_dirs.append(org_dir)
+
+        metrics = self.metrics
+        if ids_and_names is None:
+            ids_and_names = self.list_pathways(organism)
+        with metrics.stage("fetch_gpml", organism):
+            self.fetch_gpml(ids_and_names, org_dir, organism)
+        with metrics.stage("optimize_gpml", organism):
+            input_hashes = self.optimize_gpml(org_dir, organism)
+        if self.brotli_quality is not None:
+            with metrics.stage("brotli", organism):
+                self.compress_brotli(input_hashes, organism)
+
+    def populate_by_archive(self, archive):
+        """Fill caches for the organism in a GPML zip archive
+        """
+        organism = gpml_archive.get_organism(archive)
+        org_dir = self.tmp_dir + organism.lower().replace(" ", "-") + "/"
 
-        Consider parallelizing this.
+        metrics = self.metrics
+        with metrics.stage("fetch_archive", organism):
+            archive_path = gpml_archive.fetch_archive(
+                archive, self.archive_dir, self.reuse, self.client
+            )
+        with metrics.stage("optimize_gpml", organism):
+            input_hashes = self.optimize_archive(
+                archive_path, org_dir, organism
+            )
+        if self.brotli_quality is not None:
+            with metrics.stage("brotli", organism):
+                self.compress_brotli(input_hashes, organism)
+
+    def populate_archives(self):
+        """Fill caches from GPML zip archives, largest local archive first
+        """
+        sizes = {
+            archive: (
+                0 if gpml_archive.is_url(archive)
+                else os.path.getsize(archive)
+            )
+            for archive in self.archives
+        }
+        run_longest_first(
+            self.populate_by_archive, sizes, self.organism_workers
+        )
+
+    def populate(self, organisms=lib_organisms):
+        """Fill caches for all configured organisms, or those given
+
+        Organisms run concurrently on `organism_workers` threads, those with
+        the most pathways first, so the largest bounds total time.  All
+        share one request rate limit.
         """
-        for organism in organisms:
-            self.populate_by_org(organism)
+        workers = self.organism_workers
+        if len(self.archives) > 0:
+            self.populate_archives()
+        else:
+            no_sizes = {organism: 0 for organism in organisms}
+            pathways = run_longest_first(
+                self.list_pathways, no_sizes, workers
+            )
+            sizes = {
+                organism: len(ids_and_names)
+                for organism, ids_and_names in pathways.items()
+            }
+
+            def populate_organism(organism):
+                self.populate_by_org(organism, pathways[organism])
+
+            run_longest_first(populate_organism, sizes, workers)
+
+        # Leave outputs of organisms that this run did not cover
+        prefixes = None
+        if len(self.archives) > 0 or set(organisms) != set(lib_organisms):
+            prefixes = self.seen_org_dirs
+        orphans = self.manifest.prune(self.seen_gpml_paths, prefixes)
+        if len(orphans) > 0:
+            print(f"Removed {len(orphans)} outputs whose raw GPML is gone")
+        self.manifest.save()
+
+        if self.brotli_quality is not None:
+            brotli_codec.report(self.metrics, "GPML", self.brotli_quality)
+
+        self.metrics.save(self.metrics_path)
+        print(f"Wrote metrics to {self.metrics_path}")
 
 # Command-line handler
 if __name__ == "__main__":
@@ -315,8 +715,101 @@ if __name__ == "__main__":
         ),
         action="store_true"
     )
+    parser.add_argument(
+        "--workers",
+        help=(
+            "Number of concurrent GPML downloads.  (default: %(default)s)"
+        ),
+        type=int,
+        default=1
+    )
+    parser.add_argument(
+        "--rate",
+        help=(
+            "Maximum requests per second to WikiPathways, shared by all "
+            "workers.  (default: %(default)s)"
+        ),
+        type=positive_float,
+        default=1.0
+    )
+    parser.add_argument(
+        "--jobs",
+        help=(
+            "Number of processes for optimizing GPML.  (default: %(default)s)"
+        ),
+        type=int,
+        default=1
+    )
+    parser.add_argument(
+        "--profile",
+        help=(
+            "Directory to save cProfile stats for each stage, per organism"
+        ),
+        metavar="DIR"
+    )
+    parser.add_argument(
+        "--organism-workers",
+        help=(
+            "Number of organisms to populate at once, largest first.  "
+            "(default: %(default)s)"
+        ),
+        type=int,
+        default=1
+    )
+    parser.add_argument(
+        "--max-attempts",
+        help=(
+            "With --reuse, pathways that failed to download in earlier runs "
+            "are tried again until they have failed this many times in a "
+            "row.  (default: %(default)s, i.e. never retry)"
+        ),
+        type=int,
+        default=1
+    )
+    parser.add_argument(
+        "--brotli",
+        help=(
+            "Also write a Brotli-compressed .br beside each .xml.gz, at this "
+            "quality, from 0 to 11.  Uses --jobs processes."
+        ),
+        type=int,
+        choices=range(12),
+        metavar="QUALITY"
+    )
+    parser.add_argument(
+        "--archive",
+        help=(
+            "Read raw GPML from this per-organism zip archive, a local path "
+            "or URL, instead of requesting each pathway.  A URL is "
+            "downloaded once; a local path needs no network.  Repeat for "
+            "more organisms."
+        ),
+        action="append",
+        metavar="PATH_OR_URL"
+    )
+    parser.add_argument(
+        "--base-url",
+        help=(
+            "Send all requests to this server instead of upstream, e.g. "
+            "http://127.0.0.1:8000 from src/stand_in_server.py"
+        ),
+        metavar="URL"
+    )
     args = parser.parse_args()
     output_dir = args.output_dir
     reuse = args.reuse
-
-    WikiPathwaysCache(output_dir, reuse).populate()
+    workers = args.workers
+    rate = args.rate
+    jobs = args.jobs
+    profile_dir = args.profile
+    organism_workers = args.organism_workers
+    max_attempts = args.max_attempts
+    brotli_quality = args.brotli
+    archives = args.archive
+    if args.base_url is not None:
+        use_base_url(args.base_url)
+
+    WikiPathwaysCache(
+        output_dir, reuse, workers, rate, jobs, profile_dir, organism_workers,
+        max_attempts, brotli_quality, archives
+    ).populate()
@@ -0,0 +1,92 @@
+"""Read raw GPML from per-organism WikiPathways zip archives
+
+WikiPathways publishes each organism's GPML as one zip, e.g.
+wikipathways-20210110-gpml-Homo_sapiens.zip, whose members are named like
+Hs_Apoptosis_WP254_116453.gpml.  One sequential read of such an archive
+replaces a rate-limited request per pathway.
+
+An archive may be a local path, which needs no network, or a URL, which is
+downloaded once to the cache directory.  Members are read from the zip as
+needed, never extracted to disk.
+"""
+import os
+import re
+
+import http_client
+
+# Downloaded bytes written at a time
+chunk_size = 1 << 16
+
+# E.g. "Homo_sapiens" in wikipathways-20210110-gpml-Homo_sapiens.zip
+archive_organism = re.compile(r"gpml-([A-Za-z]+_[a-z]+)\.zip$")
+
+def is_url(archive):
+    return archive.startswith(("http://", "https://"))
+
+def get_organism(archive):
+    """Get organism from an archive path or URL, e.g. "Homo sapiens"
+
+    Falls back to the file name without extension, e.g. "my-pathways".
+    """
+    name = archive.split("/")[-1]
+    match = archive_organism.search(name)
+    if match is None:
+        return os.path.splitext(name)[0]
+    return match.group(1).replace("_", " ")
+
+def fetch_archive(archive, cache_dir, reuse=False, client=http_client.client):
+    """Get a local path for an archive, downloading it if it is a URL
+
+    With `reuse`, an archive downloaded by an earlier run is used as-is.
+    """
+    if not is_url(archive):
+        if not os.path.exists(archive):
+            raise FileNotFoundError(f"No GPML archive at {archive}")
+        return archive
+
+    path = cache_dir + archive.split("/")[-1].split("?")[0]
+    if reuse and os.path.exists(path):
+        print(f"Using previously-downloaded archive {path}")
+        return path
+
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+
+    # Stream to disk, so the whole archive is never held in memory
+    tmp_path = path + ".tmp"
+    try:
+        with client.get(archive, stream=True) as response:
+            with open(tmp_path, "wb") as f:
+                for chunk in response.iter_content(chunk_size):
+                    f.write(chunk)
+        os.replace(tmp_path, path)
+    finally:
+        # Left only if the download failed
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    print(f"Downloaded GPML archive to {path}")
+    return path
+
+def list_members(archive):
+    """Get info for each GPML member of an open zipfile.ZipFile, by name
+    """
+    return sorted(
+        (
+            info for info in archive.infolist()
+            if not info.is_dir() and info.filename.endswith(".gpml")
+        ),
+        key=lambda info: info.filename
+    )
+
+def get_member_hash(info):
+    """Get a content hash for a member, from the zip's own CRC and size
+
+    Unchanged members are then skipped without decompressing them.
+    """
+    return f"crc32:{info.CRC:08x}:{info.file_size}"
+
+def read_member(archive, info):
+    """Read a member's GPML as text, straight from the open zip
+    """
+    return archive.read(info).decode("utf-8")
@@ -0,0 +1,98 @@
+"""Shared HTTP client for WikiPathways and Ideogram fetches
+
+Reuses keep-alive connections across requests, retries transient failures
+with exponential backoff and jitter, and caps concurrent requests per host.
+
+`get` returns only successful responses: once retries are spent, or on any
+other 4xx or 5xx response, it raises `requests.HTTPError`, whose `response`
+is the failed response.  Callers that fetch many items, e.g. pathways or
+genes, catch it per item, journal the error, and write no output for it.
+"""
+import random
+import threading
+from time import sleep
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Statuses that usually mean "try again later", rather than "you erred"
+retry_statuses = {429, 500, 502, 503, 504}
+
+class HttpClient():
+
+    def __init__(
+        self, limiter=None, max_retries=5, backoff=0.5, max_backoff=30,
+        per_host=4, timeout=60
+    ):
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.per_host = per_host
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=per_host)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.host_slots = {}
+        self.lock = threading.Lock()
+
+    def host_slot(self, url):
+        """Get semaphore that caps concurrent requests to this URL's host
+        """
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.host_slots:
+                slot = threading.BoundedSemaphore(self.per_host)
+                self.host_slots[host] = slot
+            return self.host_slots[host]
+
+    def wait(self, attempt, retry_after=None):
+        """Sleep before a retry, using exponential backoff with full jitter
+        """
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        delay = random.uniform(0, delay)
+        if retry_after is not None and retry_after.isdigit():
+            delay = max(delay, min(self.max_backoff, int(retry_after)))
+        sleep(delay)
+
+    def get(self, url, **kwargs):
+        """GET a URL, retrying on connection errors, 429 and 5xx responses
+
+        Raises `requests.HTTPError` if the final response is not successful,
+        and `requests.ConnectionError` or `requests.Timeout` if the last
+        attempt got no response.
+        """
+        slot = self.host_slot(url)
+        kwargs.setdefault("timeout", self.timeout)
+
+        for attempt in range(self.max_retries + 1):
+            if self.limiter is not None:
+                self.limiter.acquire()
+
+            try:
+                with slot:
+                    response = self.session.get(url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.max_retries:
+                    raise
+                self.wait(attempt)
+                continue
+
+            retryable = response.status_code in retry_statuses
+            if retryable and attempt < self.max_retries:
+                response.close()
+                self.wait(attempt, response.headers.get("Retry-After"))
+                continue
+
+            response.raise_for_status()
+            return response
+
+# Default client, for one-off requests that need no rate limit
+client = HttpClient()
+
+def get(url, **kwargs):
+    return client.get(url, **kwargs)
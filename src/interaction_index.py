@@ -0,0 +1,205 @@
+"""Look up optimized interactions by gene, with an LRU of decoded records
+
+Reads any form that get_interactions.py writes: a directory of per-gene
+*.json.gz files, a directory of *.json.zlib files with a preset dictionary
+beside it (e.g. data/gene.zdict for data/gene/), a gene.bundle file, or a
+normalized interactions.json.gz store, from which records are rebuilt.
+
+Symbols are matched case-insensitively, as records are stored under
+uppercased symbols, e.g. both "Mtor" and "MTOR" find MTOR.
+
+Example:
+
+  python src/interaction_index.py data/gene/ A2M Mtor
+"""
+import argparse
+from collections import OrderedDict
+import gzip
+import json
+import os
+import threading
+
+import bundle
+from interaction_store import InteractionStore
+import zdict_codec
+
+# Decoded records kept in memory, by default
+cache_size = 1024
+
+class InteractionIndex():
+    """Serve decoded per-gene interaction records from a cache or bundle
+
+    Returned records are shared with the LRU, so treat them as read-only.
+    """
+
+    def __init__(self, path, cache_size=cache_size):
+        self.path = path
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self.reader = None
+        self.store = None
+        self.paths = None
+        if os.path.isdir(path):
+            self.open_dir(path)
+        elif path.endswith(".json.gz"):
+            self.store = InteractionStore.load(path)
+        else:
+            self.reader = bundle.BundleReader(path)
+
+    def open_dir(self, gene_dir):
+        """List records in a directory once, so lookups never stat files
+
+        Raises ValueError if a gene has both a .json.gz and a .json.zlib
+        file, as then either may be stale.
+        """
+        if not gene_dir.endswith("/"):
+            gene_dir += "/"
+        self.paths = {}
+        zdict_path = bundle.get_dictionary_path(gene_dir.rstrip("/"))
+        self.zdict = None
+
+        for name in os.listdir(gene_dir):
+            if name.endswith(".json.gz"):
+                gene = name[:-len(".json.gz")]
+            elif name.endswith(".json.zlib"):
+                gene = name[:-len(".json.zlib")]
+                if self.zdict is None:
+                    self.zdict = zdict_codec.read_dictionary(zdict_path)
+            else:
+                continue
+            if gene in self.paths:
+                raise ValueError(
+                    f"Both .json.gz and .json.zlib records for {gene} in "
+                    f"{gene_dir}; rebuild with one --codec"
+                )
+            self.paths[gene] = gene_dir + name
+
+    def __contains__(self, gene):
+        gene = gene.upper()
+        if self.reader is not None:
+            return gene in self.reader
+        if self.store is not None:
+            return gene in self.store
+        return gene in self.paths
+
+    def __len__(self):
+        if self.reader is not None:
+            return len(self.reader)
+        if self.store is not None:
+            return len(self.store)
+        return len(self.paths)
+
+    def genes(self):
+        """Get sorted list of genes that have records
+        """
+        if self.reader is not None:
+            return self.reader.keys()
+        if self.store is not None:
+            return sorted(self.store.genes)
+        return sorted(self.paths)
+
+    def read(self, gene):
+        """Read and decode a record, bypassing the LRU; None if absent
+        """
+        if self.reader is not None:
+            json_str = self.reader.get(gene)
+            return None if json_str is None else json.loads(json_str)
+        if self.store is not None:
+            return self.store.get(gene)
+
+        path = self.paths.get(gene)
+        if path is None:
+            return None
+        with open(path, "rb") as f:
+            data = f.read()
+        if path.endswith(".gz"):
+            data = gzip.decompress(data)
+        else:
+            data = zdict_codec.decode(data, self.zdict)
+        return json.loads(data)
+
+    def remember(self, gene, record):
+        # Call with lock held
+        self.cache[gene] = record
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def get(self, gene):
+        """Get decoded record for a gene symbol, or None if it has none
+        """
+        gene = gene.upper()
+        with self.lock:
+            if gene in self.cache:
+                self.cache.move_to_end(gene)
+                self.hits += 1
+                return self.cache[gene]
+            self.misses += 1
+
+        record = self.read(gene)
+
+        with self.lock:
+            self.remember(gene, record)
+        return record
+
+    def get_many(self, genes):
+        """Get dict of gene -> decoded record, for genes that have records
+
+        Keys are the symbols as given.  Uncached records are read in key
+        order, which is also their order in a bundle.
+        """
+        records = {}
+        to_read = {}
+        with self.lock:
+            for gene in genes:
+                key = gene.upper()
+                if key in self.cache:
+                    self.cache.move_to_end(key)
+                    self.hits += 1
+                    records[gene] = self.cache[key]
+                else:
+                    self.misses += 1
+                    to_read.setdefault(key, []).append(gene)
+
+        read = {key: self.read(key) for key in sorted(to_read)}
+
+        with self.lock:
+            for key, record in read.items():
+                self.remember(key, record)
+                for gene in to_read[key]:
+                    records[gene] = record
+
+        return {
+            gene: record for gene, record in records.items()
+            if record is not None
+        }
+
+    def close(self):
+        if self.reader is not None:
+            self.reader.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# Command-line handler
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "path",
+        help="Gene directory, bundle or normalized store, e.g. data/gene/"
+    )
+    parser.add_argument("genes", nargs="+", help="Gene symbols to look up")
+    args = parser.parse_args()
+
+    with InteractionIndex(args.path) as index:
+        records = index.get_many(args.genes)
+    print(json.dumps(records, indent=2))
@@ -0,0 +1,218 @@
+"""Store optimized interactions once, rather than once per gene
+
+An interaction appears in the per-gene record of every gene it names, and
+each copy repeats its pathway's name and species.  Here, each distinct
+interaction is stored once, in an interaction table, and each pathway once,
+in a pathway table.  Genes list the positions of their interactions.
+
+Layout of interactions.json.gz:
+
+  version       format version
+  pathways      [id, name, species] per pathway
+  interactions  [pathway position, fields] per interaction, where fields
+                maps e.g. "left" to its list of values
+  genes         gene -> list of interaction positions, in record order
+
+`get_json` rebuilds a gene's record exactly as lossy_optimize_interactions
+wrote it.
+
+Example:
+
+  python src/interaction_store.py --gene-dir data/gene/
+"""
+import argparse
+import glob
+import gzip
+import json
+import os
+from time import perf_counter
+
+# Increment when layout changes
+version = 1
+
+def get_interaction_key(interaction):
+    pathway, fields = interaction
+    return pathway, tuple(
+        (field, tuple(values)) for field, values in fields.items()
+    )
+
+class InteractionStore():
+
+    def __init__(self, pathways=None, interactions=None, genes=None):
+        self.pathways = pathways or []
+        self.interactions = interactions or []
+        self.genes = genes or {}
+
+        self.pathway_ids = {
+            tuple(pathway): i for i, pathway in enumerate(self.pathways)
+        }
+        self.interaction_ids = None
+
+    @classmethod
+    def load(cls, path):
+        with gzip.open(path, "rb") as f:
+            store = json.loads(f.read())
+        if store.get("version") != version:
+            raise ValueError(
+                f"Not a version {version} interaction store: {path}"
+            )
+        return cls(store["pathways"], store["interactions"], store["genes"])
+
+    def save(self, path):
+        data = json.dumps({
+            "version": version,
+            "pathways": self.pathways,
+            "interactions": self.interactions,
+            "genes": self.genes
+        }, separators=(",", ":")).encode("utf-8")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(gzip.compress(data, mtime=0))
+        os.replace(tmp_path, path)
+
+    def get_pathway_id(self, result):
+        key = (result["id"], result["name"], result["species"])
+        id = self.pathway_ids.get(key)
+        if id is None:
+            id = self.pathway_ids[key] = len(self.pathways)
+            self.pathways.append(list(key))
+        return id
+
+    def add(self, gene, json_str):
+        """Add a gene's optimized interactions, e.g. from a .json.gz file
+        """
+        if self.interaction_ids is None:
+            self.interaction_ids = {
+                get_interaction_key(interaction): i
+                for i, interaction in enumerate(self.interactions)
+            }
+
+        ids = []
+        for result in json.loads(json_str)["result"]:
+            fields = {
+                field: value["values"]
+                for field, value in result["fields"].items()
+            }
+            interaction = [self.get_pathway_id(result), fields]
+            key = get_interaction_key(interaction)
+            id = self.interaction_ids.get(key)
+            if id is None:
+                id = self.interaction_ids[key] = len(self.interactions)
+                self.interactions.append(interaction)
+            ids.append(id)
+        self.genes[gene] = ids
+
+    def __contains__(self, gene):
+        return gene in self.genes
+
+    def __len__(self):
+        return len(self.genes)
+
+    def get(self, gene):
+        """Get a gene's record, as a dict, or None if it has none
+        """
+        ids = self.genes.get(gene)
+        if ids is None:
+            return None
+        results = []
+        for id in ids:
+            pathway, fields = self.interactions[id]
+            pwid, name, species = self.pathways[pathway]
+            results.append({
+                "fields": {
+                    field: {"values": values}
+                    for field, values in fields.items()
+                },
+                "id": pwid,
+                "name": name,
+                "species": species
+            })
+        return {"result": results}
+
+    def get_json(self, gene):
+        """Get a gene's record as lossy_optimize_interactions wrote it
+        """
+        record = self.get(gene)
+        return None if record is None else json.dumps(record)
+
+def compare(gene_dir, output):
+    """Build a store from per-gene files, check it, and compare sizes
+    """
+    paths = sorted(glob.glob(f"{gene_dir}*.json.gz"))
+    records = {}
+    files_size = 0
+    for path in paths:
+        gene = os.path.basename(path)[:-len(".json.gz")]
+        files_size += os.path.getsize(path)
+        with gzip.open(path, "rb") as f:
+            records[gene] = f.read()
+
+    start = perf_counter()
+    store = InteractionStore()
+    for gene, json_str in records.items():
+        store.add(gene, json_str)
+    store.save(output)
+    build_seconds = perf_counter() - start
+
+    start = perf_counter()
+    for json_str in records.values():
+        gzip.compress(json_str, mtime=0)
+    gzip_seconds = perf_counter() - start
+
+    rows = sum(len(ids) for ids in store.genes.values())
+    print(
+        f"{len(records)} genes, {rows} rows, {len(store.interactions)} "
+        f"distinct interactions in {len(store.pathways)} pathways"
+    )
+
+    start = perf_counter()
+    store = InteractionStore.load(output)
+    mismatches = [
+        gene for gene, json_str in records.items()
+        if store.get_json(gene).encode("utf-8") != json_str
+    ]
+    load_seconds = perf_counter() - start
+    if len(mismatches) > 0:
+        print(f"{len(mismatches)} genes differ:")
+        print(",".join(mismatches))
+    else:
+        print("Every gene's record is rebuilt byte-identically")
+
+    store_size = os.path.getsize(output)
+    print(
+        f"Size: {len(paths)} files {files_size} bytes, store {store_size} "
+        f"bytes ({store_size / files_size:.1%})"
+    )
+    print(
+        f"Time: build and write store {build_seconds:.3f} s, gzip each "
+        f"gene {gzip_seconds:.3f} s, load and rebuild all {load_seconds:.3f} s"
+    )
+    return len(mismatches) == 0
+
+# Command-line handler
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--gene-dir",
+        help=(
+            "Directory of optimized per-gene interactions.  "
+            "(default: %(default)s)"
+        ),
+        default="data/gene/"
+    )
+    parser.add_argument(
+        "--output",
+        help="Path to write the store.  (default: %(default)s)",
+        default="tmp/interactions.json.gz"
+    )
+    args = parser.parse_args()
+
+    output_dir = os.path.dirname(args.output)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    if not compare(args.gene_dir, args.output):
+        exit(1)
@@ -0,0 +1,191 @@
+"""Extract TextLabels from compressed GPML files
+"""
+from concurrent.futures import ProcessPoolExecutor
+import gzip
+import json
+import os
+
+from lxml import etree
+
+from lib import hash_file
+from pathway_index import PathwayGeneIndex
+
+# Decompressed bytes fed to the parser at a time
+chunk_size = 1 << 16
+
+datanode_tag = "{http://pathvisio.org/GPML/2013a}DataNode"
+
+class LabelCollector():
+    """lxml parser target that keeps only TextLabel attribute values
+
+    No element tree is built, so parsing memory stays flat regardless of
+    pathway size.  TextLabels of DataNodes are also kept apart, for the
+    pathway-gene index.
+    """
+
+    def __init__(self):
+        self.labels = set()
+        self.datanode_labels = set()
+
+    def start(self, tag, attrib):
+        label = attrib.get("TextLabel")
+        if label is not None:
+            self.labels.add(label)
+            if tag == datanode_tag:
+                self.datanode_labels.add(label)
+
+    def close(self):
+        return self
+
+def parse_labels(gpml_path):
+    """Stream a compressed GPML file into a LabelCollector
+    """
+    parser = etree.XMLParser(target=LabelCollector())
+    with gzip.open(gpml_path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            parser.feed(chunk)
+    return parser.close()
+
+def extract_labels(gpml_path):
+    """Get set of TextLabels in a compressed GPML file, by streaming it
+    """
+    return parse_labels(gpml_path).labels
+
+def extract_label_sets(gpml_path):
+    """Get sets of all TextLabels, and DataNode TextLabels, in a GPML file
+    """
+    collector = parse_labels(gpml_path)
+    return collector.labels, collector.datanode_labels
+
+def extract_all_labels(gpml_paths, jobs=1, extract=extract_labels):
+    """Get list of TextLabel sets, one per compressed GPML file
+
+    With `jobs` > 1, files are spread across a process pool.
+    """
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            return list(executor.map(extract, gpml_paths, chunksize=32))
+    return [extract(gpml_path) for gpml_path in gpml_paths]
+
+class LabelIndex():
+    """Persistent index of TextLabels in each compressed GPML file
+
+    Entries are keyed by file name, and checked against the file's size and
+    mtime, then its content hash.  Only new or changed files are parsed on
+    update, and entries for deleted files are dropped.  With no path, the
+    index is kept in memory only.
+    """
+
+    # Increment when entry format or label extraction changes
+    version = 2
+
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = {}
+
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                index = json.load(f)
+            if index.get("version") == self.version:
+                self.entries = index["files"]
+
+    def update(self, gpml_paths, jobs=1):
+        """Sync index with the given files, and save it if anything changed
+        """
+        entries = {}
+        stale_paths = []
+        changed = False
+
+        for gpml_path in gpml_paths:
+            name = os.path.basename(gpml_path)
+            stat = os.stat(gpml_path)
+            entry = self.entries.get(name)
+
+            if (
+                entry is not None and
+                entry["size"] == stat.st_size and
+                entry["mtime"] == stat.st_mtime_ns
+            ):
+                entries[name] = entry
+                continue
+
+            digest = hash_file(gpml_path)
+            if entry is not None and entry["hash"] == digest:
+                # Touched, but not changed
+                entry = dict(entry, size=stat.st_size, mtime=stat.st_mtime_ns)
+                entries[name] = entry
+            else:
+                entries[name] = {
+                    "size": stat.st_size,
+                    "mtime": stat.st_mtime_ns,
+                    "hash": digest
+                }
+                stale_paths.append(gpml_path)
+            changed = True
+
+        all_labels = extract_all_labels(stale_paths, jobs, extract_label_sets)
+        for gpml_path, label_sets in zip(stale_paths, all_labels):
+            labels, datanode_labels = label_sets
+            name = os.path.basename(gpml_path)
+            entries[name]["labels"] = sorted(labels)
+            entries[name]["datanode_labels"] = sorted(datanode_labels)
+
+        num_removed = len(self.entries.keys() - entries.keys())
+        changed = changed or num_removed > 0
+
+        print(
+            f"Label index: parsed {len(stale_paths)} new or changed files, "
+            f"dropped {num_removed} removed files"
+        )
+
+        self.entries = entries
+        if changed and self.path is not None:
+            self.save()
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": self.version, "files": self.entries}, f)
+        os.replace(tmp_path, self.path)
+
+    def labels(self):
+        """Get set of TextLabels across all indexed files
+        """
+        labels = set()
+        for entry in self.entries.values():
+            labels.update(entry["labels"])
+        return labels
+
+def get_gpml_labels(
+    gpml_paths, jobs=1, index_path=None, pathway_index_path=None
+):
+    """Get set of TextLabels across compressed GPML files
+
+    With `jobs` > 1, files are spread across a process pool.  With
+    `index_path`, only files that changed since the last call are parsed.
+    With `pathway_index_path`, the pathway-gene index is rebuilt there from
+    the same pass.
+    """
+    print("Get GPML labels")
+
+    if index_path is not None or pathway_index_path is not None:
+        index = LabelIndex(index_path)
+        index.update(gpml_paths, jobs)
+        labels = index.labels()
+        if pathway_index_path is not None:
+            pathway_index = PathwayGeneIndex.from_label_index(index)
+            pathway_index.save(pathway_index_path)
+            print(
+                f"Indexed {len(pathway_index.genes)} genes in "
+                f"{len(pathway_index.pathways)} pathways"
+            )
+    else:
+        labels = set()
+        for file_labels in extract_all_labels(gpml_paths, jobs):
+            labels |= file_labels
+
+    print(f"Found {len(labels)} labels in compressed GPML")
+    return labels
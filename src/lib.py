@@ -1,4 +1,9 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import ssl
+import threading
+from time import monotonic, sleep
 
 repo = "cachome/wikipathways-interactions"
 module = "interactions.py"
@@ -7,6 +12,54 @@ ctx = ssl.create_default_context()
 ctx.check_hostname = False
 ctx.verify_mode = ssl.CERT_NONE
 
+# Base URLs of upstream services.  Fetch code builds URLs from these when
+# it runs, so `use_base_url` can point them all at e.g. a local stand-in.
+base_urls = {
+    # E.g. https://webservice.wikipathways.org/listPathways
+    "webservice": "https://webservice.wikipathways.org/",
+    # E.g. https://www.wikipathways.org/wpi/wpi.php
+    "wikipathways": "https://www.wikipathways.org/",
+    # E.g. https://raw.githubusercontent.com/eweitz/ideogram/master/dist/data/cache/homo-sapiens-genes.tsv
+    "genes": (
+        "https://raw.githubusercontent.com/eweitz/ideogram/"
+        "master/dist/data/cache/"
+    )
+}
+
+def slug(value):
+    """Get a file-name form of e.g. an organism, e.g. "homo-sapiens"
+    """
+    return value.lower().replace(" ", "-")
+
+def use_base_url(url):
+    """Point all upstream services at one server, e.g. stand_in_server.py
+
+    Its paths mirror upstream, e.g. /listPathways, /wpi/wpi.php and
+    /genes/homo-sapiens-genes.tsv.
+    """
+    url = url.rstrip("/") + "/"
+    base_urls["webservice"] = url
+    base_urls["wikipathways"] = url
+    base_urls["genes"] = url + "genes/"
+
+def get_list_pathways_url(organism):
+    return (
+        f"{base_urls['webservice']}listPathways"
+        f"?organism={organism}&format=json"
+    )
+
+def get_find_interactions_url(gene):
+    return (
+        f"{base_urls['webservice']}findInteractions"
+        f"?query={gene}&format=json"
+    )
+
+def get_download_gpml_url(pwid):
+    return (
+        f"{base_urls['wikipathways']}wpi/wpi.php"
+        f"?action=downloadFile&type=gpml&pwTitle=Pathway:{pwid}"
+    )
+
 # Organisms configured for WikiPathways caching
 organisms = [
     "Unspecified",
@@ -45,3 +98,78 @@ organisms = [
     "Zea mays",
     "Plasmodium falciparum"
 ]
+
+
+def positive_float(value):
+    """Parse a command-line number that must be above 0, e.g. a rate
+    """
+    number = float(value)
+    if not number > 0:
+        raise argparse.ArgumentTypeError(f"must be above 0: {value}")
+    return number
+
+class TokenBucket():
+    """Thread-safe token bucket, to cap request rate across fetch workers
+
+    Tokens refill continuously at `rate` per second, up to `capacity`.  Each
+    request takes one token, waiting if none are available.
+    """
+
+    def __init__(self, rate=1.0, capacity=1):
+        if rate <= 0:
+            raise ValueError(f"Token bucket rate must be positive: {rate}")
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available, then take it
+        """
+        while True:
+            with self.lock:
+                now = monotonic()
+                elapsed = now - self.updated
+                self.tokens = min(
+                    self.capacity, self.tokens + elapsed * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            sleep(wait)
+
+    def try_acquire(self):
+        """Take a token if one is available now; return whether taken
+        """
+        with self.lock:
+            now = monotonic()
+            elapsed = now - self.updated
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+def hash_file(path):
+    """Get SHA-256 hex digest of a file's content
+    """
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def run_longest_first(run, sizes, workers=1):
+    """Call `run` on each key of `sizes`, largest size first, on threads
+
+    Starting the largest jobs first keeps total time near that of the
+    largest job, instead of leaving it to run alone at the end.  Returns
+    dict of key -> result, in the order jobs were started.
+    """
+    order = sorted(sizes, key=lambda key: sizes[key], reverse=True)
+    if workers <= 1:
+        return {key: run(key) for key in order}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {key: executor.submit(run, key) for key in order}
+        return {key: future.result() for key, future in futures.items()}
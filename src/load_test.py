@@ -0,0 +1,251 @@
+"""Load-test GPML fetching against the local stand-in server
+
+Starts stand_in_server.py on a free port, points all fetches at it, runs
+WikiPathwaysCache.populate from gpml.py in a scratch directory, then reports
+throughput, tail latency, and responses by status.  Latency is as fetch code
+sees it, so it includes retries after 429 and 500 responses.
+
+Example:
+
+  python src/load_test.py --latency 0.05 --jitter 0.1 --error-rate 0.02 \\
+    --throttle 40 --workers 8 --rate 50
+"""
+import argparse
+import json
+import shutil
+import tempfile
+from time import perf_counter
+
+import lib
+from lib import organisms as lib_organisms, positive_float, use_base_url
+from gpml import WikiPathwaysCache
+from metrics import summarize
+from stand_in_server import Fixtures, StandInServer
+
+def run(
+    fixtures, server_options, cache_options, organisms=None, work_dir=None
+):
+    """Populate a GPML cache from a stand-in server; return a report dict
+    """
+    if organisms is None:
+        organisms = [
+            organism for organism in lib_organisms
+            if organism in fixtures.pathways
+        ]
+
+    is_scratch = work_dir is None
+    if is_scratch:
+        work_dir = tempfile.mkdtemp(prefix="load_test_")
+    work_dir = work_dir.rstrip("/") + "/"
+
+    server = StandInServer(fixtures, **server_options)
+    base_urls = dict(lib.base_urls)
+    use_base_url(server.start())
+    try:
+        cache = WikiPathwaysCache(
+            output_dir=work_dir + "gpml/", tmp_dir=work_dir + "tmp/",
+            **cache_options
+        )
+        start = perf_counter()
+        cache.populate(organisms)
+        seconds = perf_counter() - start
+    finally:
+        server.stop()
+        lib.base_urls.update(base_urls)
+        if is_scratch:
+            shutil.rmtree(work_dir)
+
+    metrics = cache.metrics
+    summary = metrics.summary()["organisms"]
+    fetched = sum(
+        scope["counters"].get("fetched", 0) for scope in summary.values()
+    )
+    fetch_errors = sum(
+        scope["counters"].get("fetch_errors", 0) for scope in summary.values()
+    )
+    bytes_in = sum(
+        scope["counters"].get("fetch_bytes_in", 0)
+        for scope in summary.values()
+    )
+    fetch_seconds = sum(
+        scope["stage_seconds"].get("fetch_gpml", 0)
+        for scope in summary.values()
+    )
+    latencies = metrics.get_values("fetch_latency_s")
+
+    stats = server.get_stats()
+    return {
+        "organisms": len(organisms),
+        "seconds": round(seconds, 3),
+        "fetch_seconds": round(fetch_seconds, 3),
+        "fetched": fetched,
+        "fetch_errors": fetch_errors,
+        "bytes_in": bytes_in,
+        "pathways_per_s": round(fetched / fetch_seconds, 2)
+        if fetch_seconds > 0 else None,
+        "requests": stats["requests"],
+        "requests_per_s": round(stats["requests"] / seconds, 2),
+        "by_status": {
+            str(status): count
+            for status, count in sorted(stats["by_status"].items())
+        },
+        "fetch_latency_s": summarize(latencies) if latencies else None
+    }
+
+def print_report(report):
+    print()
+    print(
+        f"Populated {report['organisms']} organisms in "
+        f"{report['seconds']} s; fetch stages took "
+        f"{report['fetch_seconds']} s"
+    )
+    print(
+        f"Fetched {report['fetched']} pathways "
+        f"({report['bytes_in']} bytes), {report['fetch_errors']} errors: "
+        f"{report['pathways_per_s']} pathways/s while fetching"
+    )
+    statuses = ", ".join(
+        f"{status}: {count}" for status, count in report["by_status"].items()
+    )
+    print(
+        f"Served {report['requests']} requests "
+        f"({report['requests_per_s']}/s); by status, {statuses}"
+    )
+    latency = report["fetch_latency_s"]
+    if latency is not None:
+        print(
+            f"Fetch latency, s: p50 {latency['p50']}, p90 {latency['p90']}, "
+            f"p99 {latency['p99']}, max {latency['max']}"
+        )
+
+# Command-line handler
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--data-dir",
+        help="Directory of fixtures to serve.  (default: %(default)s)",
+        default="data/"
+    )
+    parser.add_argument(
+        "--organism",
+        help=(
+            "Organism to populate; repeat for more.  (default: configured "
+            "organisms with fixtures)"
+        ),
+        action="append"
+    )
+    parser.add_argument(
+        "--max-pathways",
+        help="Serve at most this many pathways per organism",
+        type=int
+    )
+    parser.add_argument(
+        "--latency",
+        help="Seconds each response takes.  (default: %(default)s)",
+        type=float,
+        default=0.05
+    )
+    parser.add_argument(
+        "--jitter",
+        help=(
+            "Up to this many more seconds, at random, per response.  "
+            "(default: %(default)s)"
+        ),
+        type=float,
+        default=0.05
+    )
+    parser.add_argument(
+        "--error-rate",
+        help=(
+            "Fraction of requests that get a 500.  (default: %(default)s)"
+        ),
+        type=float,
+        default=0
+    )
+    parser.add_argument(
+        "--throttle",
+        help=(
+            "Requests per second the server allows before responding 429.  "
+            "(default: no limit)"
+        ),
+        type=positive_float
+    )
+    parser.add_argument(
+        "--seed",
+        help="Seed for server latency and errors, for repeatable runs",
+        type=int
+    )
+    parser.add_argument(
+        "--workers",
+        help="Number of concurrent GPML downloads.  (default: %(default)s)",
+        type=int,
+        default=8
+    )
+    parser.add_argument(
+        "--rate",
+        help=(
+            "Maximum requests per second, shared by all workers.  "
+            "(default: %(default)s)"
+        ),
+        type=positive_float,
+        default=50.0
+    )
+    parser.add_argument(
+        "--organism-workers",
+        help=(
+            "Number of organisms to populate at once.  "
+            "(default: %(default)s)"
+        ),
+        type=int,
+        default=1
+    )
+    parser.add_argument(
+        "--jobs",
+        help=(
+            "Number of processes for optimizing GPML.  (default: %(default)s)"
+        ),
+        type=int,
+        default=1
+    )
+    parser.add_argument(
+        "--work-dir",
+        help=(
+            "Directory to keep fetched and optimized GPML in.  "
+            "(default: a scratch directory, removed afterward)"
+        ),
+        metavar="DIR"
+    )
+    parser.add_argument(
+        "--report",
+        help="Path to also write the report, as JSON",
+        metavar="PATH"
+    )
+    args = parser.parse_args()
+
+    fixtures = Fixtures(args.data_dir, args.max_pathways)
+    server_options = {
+        "latency": args.latency,
+        "jitter": args.jitter,
+        "error_rate": args.error_rate,
+        "throttle": args.throttle,
+        "seed": args.seed
+    }
+    cache_options = {
+        "workers": args.workers,
+        "rate": args.rate,
+        "organism_workers": args.organism_workers,
+        "jobs": args.jobs
+    }
+
+    report = run(
+        fixtures, server_options, cache_options, args.organism, args.work_dir
+    )
+    print_report(report)
+    if args.report is not None:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print(f"Wrote report to {args.report}")
@@ -0,0 +1,82 @@
+"""Track how each optimized output was built, to skip unchanged work
+
+For each output, the manifest records its input path, the input's content
+hash, the optimizer version, and the compression settings.  An output is
+rebuilt only if one of those changed, or if the output file is missing.
+Safe to share between threads, e.g. organisms populated concurrently.
+"""
+import json
+import os
+import threading
+
+# Pinned gzip settings, so unchanged content compresses to identical bytes
+gzip_settings = {"codec": "gzip", "level": 9, "mtime": 0}
+
+class BuildManifest():
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def is_fresh(self, output_path, input_hash, optimizer, settings):
+        """Whether output exists and was built from the same input and code
+        """
+        with self.lock:
+            entry = self.entries.get(output_path)
+        return (
+            entry is not None and
+            entry["input_hash"] == input_hash and
+            entry["optimizer"] == optimizer and
+            entry["settings"] == settings and
+            os.path.exists(output_path)
+        )
+
+    def record(self, output_path, input_path, input_hash, optimizer, settings):
+        with self.lock:
+            self.entries[output_path] = {
+                "input": input_path,
+                "input_hash": input_hash,
+                "optimizer": optimizer,
+                "settings": settings
+            }
+
+    def discard(self, output_path):
+        """Delete an output and its entry, e.g. when its input is gone
+        """
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        with self.lock:
+            self.entries.pop(output_path, None)
+
+    def prune(self, input_paths, prefixes=None):
+        """Delete outputs whose input was not among those seen in this run
+
+        If `prefixes` is given, only outputs whose input path starts with one
+        of them are considered, e.g. those of organisms run this time.
+        """
+        input_paths = set(input_paths)
+        prefixes = tuple(prefixes) if prefixes is not None else ("",)
+        with self.lock:
+            orphans = [
+                output_path for output_path, entry in self.entries.items()
+                if entry["input"] not in input_paths and
+                entry["input"].startswith(prefixes)
+            ]
+        for output_path in orphans:
+            self.discard(output_path)
+        return orphans
+
+    def save(self):
+        # Sorted and indented, so diffs between runs stay small.  Locked
+        # throughout, so concurrent saves don't share tmp_path.
+        with self.lock:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.entries, f, indent=2, sort_keys=True)
+                f.write("\n")
+            os.replace(tmp_path, self.path)
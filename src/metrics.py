@@ -0,0 +1,188 @@
+"""Count, time and optionally profile pipeline stages, then save as JSON
+
+Counters (e.g. requests, bytes in and out, errors) and histograms (e.g.
+fetch latency, parse time) are kept per organism.  Histograms are saved as
+summaries: count, total, mean, min, p50, p90, p99 and max.
+
+With a profile directory, each stage also runs under cProfile, and its
+stats are saved as <organism>-<stage>.prof, with a readable .txt beside it.
+Only one profiler runs at a time, on the main thread: stages nested in a
+profiled stage are part of its profile, and stages run in worker threads,
+e.g. organisms populated concurrently, are timed but not profiled.  Work in
+worker processes is likewise not profiled.
+"""
+import cProfile
+from collections import defaultdict
+from contextlib import contextmanager
+import json
+import os
+import pstats
+import threading
+from time import perf_counter, time
+
+from lib import slug
+
+# Scope for work that spans organisms, e.g. writing a bundle
+all_organisms = "all"
+
+# Number of functions listed in each readable profile
+profile_lines = 40
+
+def summarize(values):
+    """Get count, total, mean and percentiles of a list of numbers
+    """
+    values = sorted(values)
+    count = len(values)
+
+    def percentile(fraction):
+        # Nearest rank
+        return values[max(0, int(round(fraction * count)) - 1)]
+
+    total = sum(values)
+    return {
+        "count": count,
+        "total": round(total, 6),
+        "mean": round(total / count, 6),
+        "min": round(values[0], 6),
+        "p50": round(percentile(0.5), 6),
+        "p90": round(percentile(0.9), 6),
+        "p99": round(percentile(0.99), 6),
+        "max": round(values[-1], 6)
+    }
+
+class Metrics():
+    """Thread-safe counters, histograms and stage timers, per organism
+    """
+
+    def __init__(self, profile_dir=None):
+        self.profile_dir = profile_dir
+        self.counters = defaultdict(lambda: defaultdict(int))
+        self.histograms = defaultdict(lambda: defaultdict(list))
+        self.stages = defaultdict(lambda: defaultdict(float))
+        self.lock = threading.Lock()
+        self.is_profiling = False
+        self.warned_threads = False
+        self.started = time()
+        self.start = perf_counter()
+
+        if profile_dir is not None and not os.path.exists(profile_dir):
+            os.makedirs(profile_dir)
+
+    def count(self, name, organism=all_organisms, value=1):
+        with self.lock:
+            self.counters[organism][name] += value
+
+    def observe(self, name, value, organism=all_organisms):
+        """Add a sample, e.g. a latency in seconds, to a histogram
+        """
+        with self.lock:
+            self.histograms[organism][name].append(value)
+
+    def get_count(self, name, organism=all_organisms):
+        with self.lock:
+            return self.counters[organism][name]
+
+    def get_values(self, name):
+        """Get all samples in a histogram, over every organism
+        """
+        with self.lock:
+            return [
+                value for histograms in self.histograms.values()
+                for value in histograms.get(name, [])
+            ]
+
+    @contextmanager
+    def timer(self, name, organism=all_organisms):
+        """Add the seconds spent in a `with` block to a histogram
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, perf_counter() - start, organism)
+
+    @contextmanager
+    def stage(self, name, organism=all_organisms):
+        """Time a stage, and profile it if there is a profile directory
+        """
+        profiler = None
+        if self.profile_dir is not None:
+            profiler = self.start_profiler()
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            seconds = perf_counter() - start
+            with self.lock:
+                self.stages[organism][name] += seconds
+            if profiler is not None:
+                profiler.disable()
+                with self.lock:
+                    self.is_profiling = False
+                self.save_profile(profiler, name, organism)
+
+    def start_profiler(self):
+        """Start a profiler for a stage, or return None if one can't run
+
+        Python allows one active profiler, so stages in worker threads and
+        stages nested in a profiled stage are not profiled themselves.
+        """
+        if threading.current_thread() is not threading.main_thread():
+            with self.lock:
+                warn = not self.warned_threads
+                self.warned_threads = True
+            if warn:
+                print(
+                    "Note: stages in worker threads, e.g. with "
+                    "--organism-workers above 1, are not profiled"
+                )
+            return None
+        with self.lock:
+            if self.is_profiling:
+                return None
+            self.is_profiling = True
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def save_profile(self, profiler, name, organism):
+        path = f"{self.profile_dir}/{slug(organism)}-{name}"
+        profiler.dump_stats(path + ".prof")
+        with open(path + ".txt", "w") as f:
+            stats = pstats.Stats(profiler, stream=f)
+            stats.sort_stats("cumulative").print_stats(profile_lines)
+
+    def summary(self):
+        with self.lock:
+            organisms = (
+                self.counters.keys() | self.histograms.keys() |
+                self.stages.keys()
+            )
+            return {
+                "started": round(self.started, 3),
+                "seconds": round(perf_counter() - self.start, 3),
+                "organisms": {
+                    organism: {
+                        "stage_seconds": {
+                            name: round(seconds, 3) for name, seconds
+                            in self.stages[organism].items()
+                        },
+                        "counters": dict(self.counters[organism]),
+                        "histograms": {
+                            name: summarize(values) for name, values
+                            in self.histograms[organism].items()
+                            if len(values) > 0
+                        }
+                    }
+                    for organism in sorted(organisms)
+                }
+            }
+
+    def save(self, path):
+        summary = self.summary()
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+            f.write("\n")
+        os.replace(tmp_path, path)
+        return summary
@@ -0,0 +1,291 @@
+"""Extract interactions from local GPML, instead of querying findInteractions
+
+Each Interaction's first and last Point GraphRefs resolve to its left and
+right sides: a DataNode's TextLabel, or a Group's members and label.  Lines
+that meet another interaction at an Anchor join it, as in PathVisio:
+
+  - X to anchor, with a mediating arrowhead (e.g. mim-catalysis): X is a
+    mediator
+  - X to anchor, otherwise: X joins the left side
+  - anchor to X: X joins the right side
+
+Results have the shape that findInteractions returns, so they go through
+lossy_optimize_interactions as usual.  A gene's results are those that
+name it, ignoring case, in any field.
+
+The diff report compares genes in data/gene against what this extracts
+from data/gpml.  Expect divergence there: the optimized GPML lacks Label
+elements, which can be group members, and may be of different revisions.
+
+Example:
+
+  python src/offline_interactions.py --gene-dir data/gene/
+"""
+import argparse
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import glob
+import gzip
+import json
+import os
+import re
+
+from lxml import etree
+
+gpml_ns = "http://pathvisio.org/GPML/2013a"
+interaction_tag = f"{{{gpml_ns}}}Interaction"
+group_tag = f"{{{gpml_ns}}}Group"
+point_path = f"{{{gpml_ns}}}Graphics/{{{gpml_ns}}}Point"
+anchor_path = f"{{{gpml_ns}}}Graphics/{{{gpml_ns}}}Anchor"
+
+# Elements whose TextLabel names an interacting entity, or a group member
+labeled_tags = {f"{{{gpml_ns}}}{name}" for name in ["DataNode", "Label"]}
+
+# Arrowheads that make a line into an anchor a mediator, not a participant
+mediator_arrowheads = {
+    "mim-catalysis", "mim-stimulation", "mim-necessary-stimulation",
+    "mim-inhibition", "mim-modification", "TBar"
+}
+
+def read_gpml(gpml_path):
+    """Parse raw .gpml, or compressed .xml.gz, GPML
+    """
+    if gpml_path.endswith(".gz"):
+        with gzip.open(gpml_path, "rb") as f:
+            return etree.fromstring(f.read())
+    return etree.parse(gpml_path).getroot()
+
+def make_result(pwid, name, species, fields):
+    """Get an interaction in the shape findInteractions returns it
+    """
+    result_fields = {
+        field: {"name": field, "values": values}
+        for field, values in fields.items()
+    }
+    result_fields["indexerId"] = {"name": "indexerId", "values": ["offline"]}
+    result_fields["source"] = {"name": "source", "values": [pwid]}
+    return {
+        "id": pwid,
+        "url": f"https://www.wikipathways.org/index.php/Pathway:{pwid}",
+        "name": name,
+        "species": species,
+        "revision": "0",
+        "score": {"0": 1.0},
+        "fields": result_fields
+    }
+
+def extract_interactions(gpml_path):
+    """Get list of findInteractions-shaped results in a GPML file
+    """
+    tree = read_gpml(gpml_path)
+    pwid = re.search(r"WP\d+", os.path.basename(gpml_path)).group()
+
+    by_graph_id = {}
+    group_members = defaultdict(list)
+    anchors = {}
+    interactions = []
+
+    for el in tree.iter(etree.Element):
+        graph_id = el.get("GraphId")
+        if graph_id is not None:
+            by_graph_id[graph_id] = el
+        group_ref = el.get("GroupRef")
+        if group_ref is not None and (
+            el.tag in labeled_tags or el.tag == group_tag
+        ):
+            group_members[group_ref].append(el)
+        if el.tag == interaction_tag:
+            points = el.findall(point_path)
+            # Lines with a loose end name nothing on that side
+            if len(points) >= 2:
+                interactions.append([el, points])
+            for anchor in el.iterfind(anchor_path):
+                anchors[anchor.get("GraphId")] = el
+
+    def get_labels(el):
+        if el.tag in labeled_tags:
+            return [el.get("TextLabel", "")]
+        if el.tag == group_tag:
+            labels = []
+            for member in group_members[el.get("GroupId")]:
+                labels += get_labels(member)
+            return labels + [el.get("TextLabel", "")]
+        return []
+
+    def resolve(graph_ref):
+        el = by_graph_id.get(graph_ref)
+        return [] if el is None else get_labels(el)
+
+    sides = {}
+    for interaction, points in interactions:
+        sides[interaction] = {
+            "left": resolve(points[0].get("GraphRef")),
+            "right": resolve(points[-1].get("GraphRef")),
+            "mediator": []
+        }
+
+    for interaction, points in interactions:
+        start = points[0].get("GraphRef")
+        end = points[-1].get("GraphRef")
+        if anchors.get(end) in sides:
+            target = sides[anchors[end]]
+            if points[-1].get("ArrowHead") in mediator_arrowheads:
+                target["mediator"] += resolve(start)
+            else:
+                target["left"] += resolve(start)
+        if anchors.get(start) in sides:
+            sides[anchors[start]]["right"] += resolve(end)
+
+    name = tree.get("Name")
+    species = tree.get("Organism")
+    results = []
+    for interaction, points in interactions:
+        fields = sides[interaction]
+        if not fields["left"] or not fields["right"]:
+            continue
+        if not fields["mediator"]:
+            del fields["mediator"]
+        # The web service lists each label once per field
+        fields = {
+            field: list(dict.fromkeys(values))
+            for field, values in fields.items()
+        }
+        results.append(make_result(pwid, name, species, fields))
+    return results
+
+def index_interactions(gpml_paths, jobs=1):
+    """Get dict of uppercased label -> results that name it
+
+    With `jobs` > 1, files are spread across a process pool.
+    """
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            all_results = list(executor.map(
+                extract_interactions, gpml_paths, chunksize=32
+            ))
+    else:
+        all_results = [extract_interactions(path) for path in gpml_paths]
+
+    index = defaultdict(list)
+    for results in all_results:
+        for result in results:
+            fields = result["fields"]
+            labels = {
+                value.upper()
+                for field in ["left", "right", "mediator"] if field in fields
+                for value in fields[field]["values"]
+            }
+            for label in labels:
+                index[label].append(result)
+    return index
+
+def get_raw_interactions(index, gene):
+    """Get findInteractions-style JSON string for a gene
+    """
+    results = index.get(gene.upper(), [])
+    return json.dumps({"result": results}, separators=(",", ":"))
+
+def get_result_key(result):
+    """Get an order-insensitive key for an optimized result
+    """
+    fields = result["fields"]
+    return (result["id"],) + tuple(
+        tuple(sorted(fields[field]["values"])) if field in fields else ()
+        for field in ["left", "right", "mediator"]
+    )
+
+def diff_report(gpml_dir, gene_dir, jobs=1, output=None):
+    """Compare per-gene interactions from the web service with offline ones
+    """
+    # Imported here, as get_interactions imports this module
+    from get_interactions import lossy_optimize_interactions
+
+    gpml_paths = sorted(glob.glob(f"{gpml_dir}*.xml.gz"))
+    index = index_interactions(gpml_paths, jobs)
+
+    totals = Counter()
+    missing_by_pathway = Counter()
+    extra_by_pathway = Counter()
+    genes = {}
+    for json_path in sorted(glob.glob(f"{gene_dir}*.json.gz")):
+        gene = os.path.basename(json_path).split(".json.gz")[0]
+        with gzip.open(json_path, "rb") as f:
+            stored = json.loads(f.read())["result"]
+        raw = get_raw_interactions(index, gene)
+        offline = json.loads(lossy_optimize_interactions(raw, gene))["result"]
+
+        stored_keys = Counter(get_result_key(result) for result in stored)
+        offline_keys = Counter(get_result_key(result) for result in offline)
+        missing = stored_keys - offline_keys
+        extra = offline_keys - stored_keys
+
+        totals["genes"] += 1
+        totals["stored_results"] += sum(stored_keys.values())
+        totals["offline_results"] += sum(offline_keys.values())
+        totals["matched_results"] += sum((stored_keys & offline_keys).values())
+        if not missing and not extra:
+            totals["identical_genes"] += 1
+        for key, count in missing.items():
+            missing_by_pathway[key[0]] += count
+        for key, count in extra.items():
+            extra_by_pathway[key[0]] += count
+        genes[gene] = {
+            "missing": sum(missing.values()), "extra": sum(extra.values())
+        }
+
+    print(
+        f"{totals['genes']} genes, {totals['identical_genes']} identical; "
+        f"{totals['matched_results']} of {totals['stored_results']} web "
+        f"service results matched, {totals['offline_results']} offline"
+    )
+    print("Pathways with most missing results:")
+    for pwid, count in missing_by_pathway.most_common(10):
+        print(f"  {pwid}: {count}")
+    print("Pathways with most extra results:")
+    for pwid, count in extra_by_pathway.most_common(10):
+        print(f"  {pwid}: {count}")
+
+    report = {
+        "totals": dict(totals),
+        "missing_by_pathway": dict(missing_by_pathway),
+        "extra_by_pathway": dict(extra_by_pathway),
+        "genes": genes
+    }
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write("\n")
+    return report
+
+# Command-line handler
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--gpml-dir",
+        help="Directory of compressed GPML.  (default: %(default)s)",
+        default="data/gpml/"
+    )
+    parser.add_argument(
+        "--gene-dir",
+        help=(
+            "Directory of per-gene interactions from the web service.  "
+            "(default: %(default)s)"
+        ),
+        default="data/gene/"
+    )
+    parser.add_argument(
+        "--jobs",
+        help="Number of processes for parsing GPML.  (default: %(default)s)",
+        type=int,
+        default=1
+    )
+    parser.add_argument(
+        "--output",
+        help="Path to save the full report, with per-gene counts, as JSON"
+    )
+    args = parser.parse_args()
+
+    diff_report(args.gpml_dir, args.gene_dir, args.jobs, args.output)
@@ -0,0 +1,225 @@
+"""Find which pathways contain a gene, and which genes a pathway contains
+
+Built from DataNode TextLabels in compressed GPML, in the same pass that
+collects labels for get_interactions.py.  Genes and pathways are numbered,
+and each posting list is a sorted array of those numbers, so intersecting
+and uniting lists across genes is a linear merge.
+
+Gene symbols are stripped and uppercased, as in the per-gene cache.  On
+disk, the index stores each pathway's gene numbers; gene-to-pathway lists
+are inverted from those when loaded.
+
+Example:
+
+  python src/pathway_index.py data/pathway_genes.json --gene MET --gene HGF
+  python src/pathway_index.py data/pathway_genes.json --pathway WP4120
+"""
+import argparse
+from array import array
+from bisect import bisect_left
+from heapq import merge
+import json
+import os
+import re
+
+# Increment when file format or label normalization changes
+version = 1
+
+def normalize_gene(label):
+    return label.strip().upper()
+
+def get_pathway_number(pwid):
+    """Get the number in a pathway ID or file name, e.g. 4120 for WP4120
+    """
+    return int(re.search(r"WP(\d+)", pwid).group(1))
+
+def intersect(postings, other):
+    """Intersect two sorted integer arrays
+    """
+    if len(postings) > len(other):
+        postings, other = other, postings
+    result = array("I")
+    start = 0
+    for value in postings:
+        start = bisect_left(other, value, start)
+        if start == len(other):
+            break
+        if other[start] == value:
+            result.append(value)
+    return result
+
+def unite(all_postings):
+    """Unite any number of sorted integer arrays
+    """
+    result = array("I")
+    for value in merge(*all_postings):
+        if len(result) == 0 or result[-1] != value:
+            result.append(value)
+    return result
+
+class PathwayGeneIndex():
+
+    def __init__(self, genes, pathways, pathway_genes):
+        """Genes and pathway numbers are sorted; `pathway_genes` holds one
+        sorted array of gene numbers per pathway
+        """
+        self.genes = genes
+        self.pathways = pathways
+        self.pathway_genes = pathway_genes
+
+        self.gene_numbers = {gene: i for i, gene in enumerate(genes)}
+        self.pathway_numbers = {
+            pathway: i for i, pathway in enumerate(pathways)
+        }
+
+        self.gene_pathways = [array("I") for gene in genes]
+        for pathway, gene_numbers in enumerate(pathway_genes):
+            for gene in gene_numbers:
+                self.gene_pathways[gene].append(pathway)
+
+    @classmethod
+    def from_label_index(cls, label_index):
+        """Build from a LabelIndex, e.g. just after updating it
+        """
+        genes_by_pathway = {}
+        for name, entry in label_index.entries.items():
+            genes = {
+                normalize_gene(label) for label in entry["datanode_labels"]
+            }
+            genes.discard("")
+            genes_by_pathway[get_pathway_number(name)] = genes
+
+        genes = sorted(set().union(*genes_by_pathway.values()))
+        gene_numbers = {gene: i for i, gene in enumerate(genes)}
+        pathways = sorted(genes_by_pathway)
+        pathway_genes = [
+            array("I", sorted(
+                gene_numbers[gene] for gene in genes_by_pathway[pathway]
+            ))
+            for pathway in pathways
+        ]
+        return cls(genes, pathways, pathway_genes)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            index = json.load(f)
+        if index.get("version") != version:
+            raise ValueError(f"Not a version {version} pathway index: {path}")
+        pathway_genes = [array("I", genes) for genes in index["postings"]]
+        return cls(index["genes"], index["pathways"], pathway_genes)
+
+    def save(self, path):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({
+                "version": version,
+                "genes": self.genes,
+                "pathways": self.pathways,
+                "postings": [list(genes) for genes in self.pathway_genes]
+            }, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    def get_gene_postings(self, gene):
+        number = self.gene_numbers.get(normalize_gene(gene))
+        if number is None:
+            return array("I")
+        return self.gene_pathways[number]
+
+    def get_pathway_postings(self, pwid):
+        number = self.pathway_numbers.get(get_pathway_number(pwid))
+        if number is None:
+            return array("I")
+        return self.pathway_genes[number]
+
+    def to_pwids(self, postings):
+        return [f"WP{self.pathways[i]}" for i in postings]
+
+    def to_genes(self, postings):
+        return [self.genes[i] for i in postings]
+
+    def pathways_with(self, gene):
+        """Get IDs of pathways that contain a gene, e.g. ["WP4120", ...]
+        """
+        return self.to_pwids(self.get_gene_postings(gene))
+
+    def genes_in(self, pwid):
+        """Get sorted symbols of genes in a pathway
+        """
+        return self.to_genes(self.get_pathway_postings(pwid))
+
+    def pathways_with_all(self, genes):
+        """Get IDs of pathways that contain every one of the genes
+        """
+        all_postings = sorted(
+            (self.get_gene_postings(gene) for gene in genes), key=len
+        )
+        if len(all_postings) == 0:
+            return []
+        result = all_postings[0]
+        for postings in all_postings[1:]:
+            result = intersect(result, postings)
+        return self.to_pwids(result)
+
+    def pathways_with_any(self, genes):
+        """Get IDs of pathways that contain at least one of the genes
+        """
+        return self.to_pwids(
+            unite([self.get_gene_postings(gene) for gene in genes])
+        )
+
+    def genes_in_all(self, pwids):
+        """Get symbols of genes found in every one of the pathways
+        """
+        all_postings = sorted(
+            (self.get_pathway_postings(pwid) for pwid in pwids), key=len
+        )
+        if len(all_postings) == 0:
+            return []
+        result = all_postings[0]
+        for postings in all_postings[1:]:
+            result = intersect(result, postings)
+        return self.to_genes(result)
+
+    def genes_in_any(self, pwids):
+        """Get symbols of genes found in at least one of the pathways
+        """
+        return self.to_genes(
+            unite([self.get_pathway_postings(pwid) for pwid in pwids])
+        )
+
+# Command-line handler
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("index_path", help="E.g. data/pathway_genes.json")
+    parser.add_argument(
+        "--gene",
+        help="Gene to find pathways for; repeat to intersect",
+        action="append"
+    )
+    parser.add_argument(
+        "--pathway",
+        help="Pathway ID to list genes for; repeat to intersect",
+        action="append"
+    )
+    parser.add_argument(
+        "--any",
+        help="Unite results across genes or pathways, instead of intersecting",
+        action="store_true"
+    )
+    args = parser.parse_args()
+
+    index = PathwayGeneIndex.load(args.index_path)
+    if args.gene:
+        if args.any:
+            print("\n".join(index.pathways_with_any(args.gene)))
+        else:
+            print("\n".join(index.pathways_with_all(args.gene)))
+    if args.pathway:
+        if args.any:
+            print("\n".join(index.genes_in_any(args.pathway)))
+        else:
+            print("\n".join(index.genes_in_all(args.pathway)))
@@ -0,0 +1,384 @@
+"""Local stand-in for WikiPathways and Ideogram, served from data/ fixtures
+
+Serves the endpoints that fetch code uses, so fetching can be tested and
+measured offline:
+
+  /listPathways?organism=...&format=json     pathways in data/gpml/
+  /wpi/wpi.php?action=downloadFile&...       GPML from data/gpml/, gzipped
+  /findInteractions?query=...&format=json    interactions from data/gene/
+  /genes/homo-sapiens-genes.tsv              symbols named in data/gene/
+
+Responses take `latency` seconds, plus up to `jitter` more.  A fraction
+`error_rate` of requests get a 500, and requests beyond `throttle` per
+second get a 429 with Retry-After, as upstream does under load.
+
+Fixtures are optimized, so GPML is already lossy and interactions lack
+fields that upstream has; those fields are filled with placeholders.
+
+Example:
+
+  python src/stand_in_server.py --latency 0.05 --error-rate 0.01
+  python src/gpml.py --base-url http://127.0.0.1:8000 --rate 50 --workers 8
+"""
+import argparse
+from collections import Counter
+import glob
+import gzip
+import hashlib
+import html
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import random
+import re
+import threading
+from time import sleep
+from urllib.parse import urlparse, parse_qs
+
+from lib import TokenBucket, positive_float, slug
+from lib import organisms as lib_organisms
+
+# Attributes of the root Pathway element, e.g. Organism="Homo sapiens"
+pathway_attr = re.compile(r'\s(Name|Organism)="([^"]*)"')
+
+def read_pathway_attrs(gpml_path):
+    """Get name and organism of a pathway, from the start of its GPML
+    """
+    with gzip.open(gpml_path, "rt", encoding="utf-8") as f:
+        head = f.read(4096)
+    start = head.find("<Pathway")
+    tag = head[start:head.find(">", start)]
+    attrs = {
+        key: html.unescape(value) for key, value in pathway_attr.findall(tag)
+    }
+    return attrs.get("Name", ""), attrs.get("Organism", "Unspecified")
+
+def to_upstream_interactions(record):
+    """Add back fields that lossy_optimize_interactions removes
+    """
+    for result in record["result"]:
+        fields = result["fields"]
+        for field, value in fields.items():
+            value["name"] = field
+        fields["indexerId"] = {"name": "indexerId", "values": ["stand-in"]}
+        fields["source"] = {"name": "source", "values": [result["id"]]}
+        result["score"] = {"0": 1.0}
+        result["url"] = (
+            f"https://www.wikipathways.org/index.php/Pathway:{result['id']}"
+        )
+        result["revision"] = "0"
+    return record
+
+class Fixtures():
+    """Index of data/ fixtures, read lazily where reading is slow
+    """
+
+    def __init__(self, data_dir="data/", max_pathways=None):
+        self.gpml_dir = data_dir + "gpml/"
+        self.gene_dir = data_dir + "gene/"
+        self.lock = threading.Lock()
+
+        self.pathways = {}
+        paths = sorted(glob.glob(self.gpml_dir + "*.xml.gz"))
+        for path in paths:
+            pwid = os.path.basename(path).split(".")[0]
+            name, organism = read_pathway_attrs(path)
+            pathways = self.pathways.setdefault(organism, [])
+            if max_pathways is None or len(pathways) < max_pathways:
+                pathways.append({"id": pwid, "name": name})
+
+        self.gene_tsvs = None
+
+    def list_pathways(self, organism):
+        return {
+            "pathways": [
+                {
+                    "id": pathway["id"],
+                    "url": (
+                        "https://www.wikipathways.org/index.php/"
+                        f"Pathway:{pathway['id']}"
+                    ),
+                    "name": pathway["name"],
+                    "species": organism,
+                    "revision": "0"
+                }
+                for pathway in self.pathways.get(organism, [])
+            ]
+        }
+
+    def get_gpml_gz(self, pwid):
+        """Get gzipped GPML for a pathway ID, or None if there is none
+        """
+        if not re.fullmatch(r"WP\d+", pwid):
+            return None
+        path = self.gpml_dir + pwid + ".xml.gz"
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    def find_interactions(self, gene):
+        path = self.gene_dir + os.path.basename(gene) + ".json.gz"
+        if not os.path.exists(path):
+            return {"result": []}
+        with gzip.open(path, "rb") as f:
+            return to_upstream_interactions(json.loads(f.read()))
+
+    def get_gene_tsv(self, organism_slug):
+        """Get a gene list TSV for an organism, e.g. "homo-sapiens"
+
+        Lists each gene with a record in data/gene/ whose interactions
+        include a pathway of that organism.  Built for all organisms on
+        first request.
+        """
+        with self.lock:
+            if self.gene_tsvs is None:
+                self.gene_tsvs = self.build_gene_tsvs()
+        return self.gene_tsvs.get(organism_slug)
+
+    def build_gene_tsvs(self):
+        genes_by_organism = {}
+        for path in sorted(glob.glob(self.gene_dir + "*.json.gz")):
+            gene = os.path.basename(path)[:-len(".json.gz")]
+            with gzip.open(path, "rb") as f:
+                results = json.loads(f.read())["result"]
+            for organism in {result["species"] for result in results}:
+                genes_by_organism.setdefault(slug(organism), []).append(gene)
+
+        # Rows are: chromosome, start, length, slim ID, symbol
+        return {
+            organism_slug: "".join(
+                ["# Stand-in gene list, from data/gene/\n"] +
+                [f"1\t0\t0\t\t{gene}\n" for gene in genes]
+            ).encode("utf-8")
+            for organism_slug, genes in genes_by_organism.items()
+        }
+
+class StandInHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send(
+        self, status, body=b"", content_type="text/plain", headers=None
+    ):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.record(self.endpoint, status)
+
+    def send_json(self, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send(200, body, "application/json")
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        params = {
+            key: values[0] for key, values in parse_qs(url.query).items()
+        }
+        self.endpoint = url.path
+
+        server.delay()
+        if not server.limiter_allows():
+            retry_after = str(server.retry_after)
+            self.send(429, b"Too many requests", headers={
+                "Retry-After": retry_after
+            })
+            return
+        if server.should_fail():
+            self.send(500, b"Stand-in error")
+            return
+
+        fixtures = server.fixtures
+        if url.path == "/listPathways":
+            self.send_json(fixtures.list_pathways(params.get("organism")))
+        elif url.path == "/findInteractions":
+            if "query" not in params:
+                self.send(400, b"Missing query")
+                return
+            self.send_json(fixtures.find_interactions(params["query"]))
+        elif url.path == "/wpi/wpi.php":
+            pwid = params.get("pwTitle", "").replace("Pathway:", "")
+            gpml_gz = fixtures.get_gpml_gz(pwid)
+            if gpml_gz is None:
+                self.send(404, b"No such pathway")
+            elif "gzip" in self.headers.get("Accept-Encoding", ""):
+                self.send(200, gpml_gz, "text/xml", {
+                    "Content-Encoding": "gzip"
+                })
+            else:
+                self.send(200, gzip.decompress(gpml_gz), "text/xml")
+        elif url.path.startswith("/genes/"):
+            name = url.path[len("/genes/"):]
+            tsv = None
+            if name.endswith("-genes.tsv"):
+                tsv = fixtures.get_gene_tsv(name[:-len("-genes.tsv")])
+            if tsv is None:
+                self.send(404, b"No such gene list")
+                return
+            etag = '"' + hashlib.sha256(tsv).hexdigest()[:16] + '"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send(304, headers={"ETag": etag})
+            else:
+                self.send(200, tsv, "text/tab-separated-values", {
+                    "ETag": etag
+                })
+        else:
+            self.send(404, b"Not found")
+
+class StandInServer(ThreadingHTTPServer):
+    """Threaded stand-in server; see module docstring
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self, fixtures, host="127.0.0.1", port=0, latency=0, jitter=0,
+        error_rate=0, throttle=None, retry_after=1, seed=None, verbose=False
+    ):
+        super().__init__((host, port), StandInHandler)
+        self.fixtures = fixtures
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.limiter = None
+        if throttle is not None:
+            self.limiter = TokenBucket(throttle, capacity=max(1, throttle))
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.verbose = verbose
+
+        self.statuses = Counter()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def delay(self):
+        seconds = self.latency + self.random.uniform(0, self.jitter)
+        if seconds > 0:
+            sleep(seconds)
+
+    def limiter_allows(self):
+        return self.limiter is None or self.limiter.try_acquire()
+
+    def should_fail(self):
+        return self.random.random() < self.error_rate
+
+    def record(self, endpoint, status):
+        with self.lock:
+            self.statuses[(endpoint, status)] += 1
+
+    def get_stats(self):
+        """Get counts of responses, by endpoint and status
+        """
+        with self.lock:
+            statuses = dict(self.statuses)
+        stats = {"requests": sum(statuses.values()), "by_status": Counter()}
+        for (endpoint, status), count in statuses.items():
+            stats["by_status"][status] += count
+            by_endpoint = stats.setdefault(endpoint, Counter())
+            by_endpoint[status] += count
+        return stats
+
+    def start(self):
+        """Serve on a background thread; return base URL
+        """
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+# Command-line handler
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--data-dir",
+        help="Directory of fixtures.  (default: %(default)s)",
+        default="data/"
+    )
+    parser.add_argument(
+        "--port",
+        help="Port to listen on.  (default: %(default)s)",
+        type=int,
+        default=8000
+    )
+    parser.add_argument(
+        "--latency",
+        help="Seconds each response takes.  (default: %(default)s)",
+        type=float,
+        default=0
+    )
+    parser.add_argument(
+        "--jitter",
+        help=(
+            "Up to this many more seconds, at random, per response.  "
+            "(default: %(default)s)"
+        ),
+        type=float,
+        default=0
+    )
+    parser.add_argument(
+        "--error-rate",
+        help=(
+            "Fraction of requests that get a 500.  (default: %(default)s)"
+        ),
+        type=float,
+        default=0
+    )
+    parser.add_argument(
+        "--throttle",
+        help=(
+            "Requests per second to serve; beyond this, respond 429 with "
+            "Retry-After.  (default: no limit)"
+        ),
+        type=positive_float
+    )
+    parser.add_argument(
+        "--max-pathways",
+        help="List at most this many pathways per organism",
+        type=int
+    )
+    parser.add_argument(
+        "--verbose",
+        help="Log each request",
+        action="store_true"
+    )
+    args = parser.parse_args()
+
+    fixtures = Fixtures(args.data_dir, args.max_pathways)
+    server = StandInServer(
+        fixtures, port=args.port, latency=args.latency, jitter=args.jitter,
+        error_rate=args.error_rate, throttle=args.throttle,
+        verbose=args.verbose
+    )
+    num_pathways = sum(len(pws) for pws in fixtures.pathways.values())
+    print(
+        f"Serving {num_pathways} pathways in {len(fixtures.pathways)} "
+        f"organisms at {server.url}"
+    )
+    unconfigured = set(fixtures.pathways) - set(lib_organisms)
+    if len(unconfigured) > 0:
+        print(f"Not configured in lib.py: {', '.join(sorted(unconfigured))}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
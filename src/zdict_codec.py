@@ -0,0 +1,124 @@
+"""Compress small, similar JSON records against a shared preset dictionary
+
+Per-gene interaction records repeat the same keys, pathway names and species
+strings, but each is too small for gzip to learn from.  A preset dictionary
+trained on the whole corpus primes zlib with those strings, so each record
+only stores what is unique to it.
+"""
+import argparse
+from collections import Counter
+import glob
+import gzip
+import re
+from time import perf_counter
+import zlib
+
+# zlib caps preset dictionaries at its 32 KiB window
+max_dictionary_size = 32768
+
+level = 9
+
+# Quoted JSON strings, and the punctuation and keys between them
+token_pattern = re.compile(rb'"(?:[^"\\]|\\.)*"|[^"]+')
+
+def train_dictionary(samples, size=max_dictionary_size):
+    """Build a preset dictionary from a list of uncompressed records
+
+    Tokens are ranked by how many records they appear in, times their
+    length.  Top tokens go last, as zlib codes nearer matches more cheaply.
+    """
+    document_frequency = Counter()
+    for sample in samples:
+        document_frequency.update(set(token_pattern.findall(sample)))
+
+    ranked = sorted(
+        (
+            (count * len(token), token)
+            for token, count in document_frequency.items()
+            if count > 1 and len(token) >= 3
+        ),
+        reverse=True
+    )
+
+    chosen = []
+    total = 0
+    for score, token in ranked:
+        if total + len(token) > size:
+            continue
+        chosen.append(token)
+        total += len(token)
+
+    return b"".join(reversed(chosen))
+
+def encode(data, zdict):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 15, 9, zdict=zdict)
+    return compressor.compress(data) + compressor.flush()
+
+def decode(data, zdict):
+    decompressor = zlib.decompressobj(15, zdict=zdict)
+    return decompressor.decompress(data) + decompressor.flush()
+
+def read_dictionary(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def write_dictionary(path, zdict):
+    with open(path, "wb") as f:
+        f.write(zdict)
+
+def report(gene_dir, repeats=3):
+    """Compare size and decode speed of gzip and preset-dictionary zlib
+    """
+    gz_records = []
+    for json_path in sorted(glob.glob(f"{gene_dir}*.json.gz")):
+        with open(json_path, "rb") as f:
+            gz_records.append(f.read())
+    samples = [gzip.decompress(record) for record in gz_records]
+
+    start = perf_counter()
+    zdict = train_dictionary(samples)
+    train_seconds = perf_counter() - start
+
+    zd_records = [encode(sample, zdict) for sample in samples]
+
+    codecs = [
+        ["gzip", gz_records, gzip.decompress],
+        ["zdict", zd_records, lambda record: decode(record, zdict)]
+    ]
+    raw_size = sum(len(sample) for sample in samples)
+    print(
+        f"{len(samples)} records, {raw_size} bytes uncompressed; "
+        f"trained {len(zdict)} byte dictionary in {train_seconds:.2f} s"
+    )
+    for name, records, decoder in codecs:
+        size = sum(len(record) for record in records)
+        times = []
+        for i in range(repeats):
+            start = perf_counter()
+            for record in records:
+                decoder(record)
+            times.append(perf_counter() - start)
+        seconds = min(times)
+        print(
+            f"{name}: {size} bytes ({size / raw_size:.1%} of raw), "
+            f"decoded all in {seconds * 1000:.0f} ms "
+            f"({seconds / len(records) * 1e6:.1f} us per record)"
+        )
+
+# Command-line handler
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--gene-dir",
+        help=(
+            "Directory of per-gene *.json.gz files to compare against.  "
+            "(default: %(default)s)"
+        ),
+        default="data/gene/"
+    )
+    args = parser.parse_args()
+
+    report(args.gene_dir)
@@ -0,0 +1,37 @@
+"""Round-trip every file in data/gpml through compact_gpml
+"""
+import glob
+import gzip
+import os
+
+import pytest
+
+import compact_gpml
+
+gpml_dir = os.path.join(os.path.dirname(__file__), "..", "data", "gpml")
+gpml_paths = sorted(glob.glob(os.path.join(gpml_dir, "*.xml.gz")))
+
+def test_corpus_is_present():
+    assert len(gpml_paths) > 0
+
+@pytest.mark.parametrize(
+    "gpml_path", gpml_paths, ids=[os.path.basename(p) for p in gpml_paths]
+)
+def test_round_trip_is_byte_identical(gpml_path):
+    with gzip.open(gpml_path, "rt", encoding="utf-8") as f:
+        xml = f.read()
+    assert compact_gpml.decode(compact_gpml.encode(xml)) == xml
+
+def test_round_trip_with_other_namespaces():
+    xml = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<Pathway xmlns="http://pathvisio.org/GPML/2013a" Name="T">\n'
+        '  <Biopax>\n'
+        '    <bp:PublicationXref xmlns:bp="http://www.biopax.org/release/'
+        'biopax-level3.owl#" rdf:id="a" xmlns:rdf="http://www.w3.org/1999/'
+        '02/22-rdf-syntax-ns#"><bp:ID>1</bp:ID></bp:PublicationXref>\n'
+        '  </Biopax>\n'
+        '</Pathway>\n'
+    )
+    decoded = compact_gpml.decode(compact_gpml.encode(xml))
+    assert compact_gpml.is_equivalent(decoded, xml)
@@ -0,0 +1,56 @@
+"""Resume behavior of find_interactions.WikiPathwaysCache.fetch_gene
+"""
+import pytest
+import requests
+
+from fetch_journal import FetchJournal
+from find_interactions import WikiPathwaysCache
+
+class FakeResponse():
+
+    def __init__(self, text):
+        self.text = text
+
+class FakeClient():
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.queries = []
+
+    def get(self, url):
+        gene = url.split("query=")[1].split("&")[0]
+        self.queries.append(gene)
+        response = self.responses[gene]
+        if isinstance(response, Exception):
+            raise response
+        return FakeResponse(response)
+
+@pytest.fixture(autouse=True)
+def work_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+def fetch(genes, responses, **kwargs):
+    """Fetch genes with a fresh cache; return genes that were queried
+    """
+    cache = WikiPathwaysCache(output_dir="out/", reuse=True, **kwargs)
+    cache.client = FakeClient(responses)
+    with FetchJournal("tmp/fetch_journal.jsonl") as journal:
+        for gene in genes:
+            cache.fetch_gene(gene, "tmp/", journal)
+    return cache.client.queries
+
+def test_empty_gene_is_journaled_and_not_refetched():
+    assert fetch(["A2M"], {"A2M": '{"result":[]}'}) == ["A2M"]
+    with FetchJournal("tmp/fetch_journal.jsonl") as journal:
+        assert journal.get("A2M")["state"] == "empty"
+
+    assert fetch(["A2M"], {}) == []
+
+def test_error_is_retried_up_to_max_attempts():
+    error = requests.HTTPError("500 Server Error")
+    assert fetch(["TP53"], {"TP53": error}, max_attempts=2) == ["TP53"]
+    assert fetch(["TP53"], {"TP53": error}, max_attempts=2) == ["TP53"]
+
+    # Failed twice in a row, so no more attempts
+    assert fetch(["TP53"], {"TP53": error}, max_attempts=2) == []
@@ -0,0 +1,225 @@
+"""Resume and pruning behavior of get_interactions.WikiPathwaysCache
+"""
+import gzip
+import json
+import os
+
+import pytest
+import requests
+
+import get_interactions
+from get_interactions import WikiPathwaysCache
+from interaction_index import InteractionIndex
+from stand_in_server import to_upstream_interactions
+
+gene_dir = os.path.join(os.path.dirname(__file__), "..", "data", "gene")
+
+def read_upstream(gene):
+    with gzip.open(os.path.join(gene_dir, gene + ".json.gz"), "rb") as f:
+        return json.dumps(to_upstream_interactions(json.loads(f.read())))
+
+class FakeResponse():
+
+    def __init__(self, text):
+        self.text = text
+        self.content = text.encode("utf-8")
+
+class FakeClient():
+    """Answers findInteractions queries from data/gene/, failing some genes
+    """
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.queries = []
+
+    def get(self, url):
+        gene = url.split("query=")[1].split("&")[0]
+        self.queries.append(gene)
+        if gene in self.failing:
+            raise requests.HTTPError(f"500 Server Error for {gene}")
+        return FakeResponse(read_upstream(gene))
+
+def make_cache(client, **kwargs):
+    """Get a cache that queries `client`, and reads no GPML
+    """
+    cache = WikiPathwaysCache(output_dir="data/", **kwargs)
+    cache.client = client
+    cache.get_labels = lambda: set()
+    cache.get_organism_sizes = lambda organisms: {
+        organism: 0 for organism in organisms
+    }
+    return cache
+
+@pytest.fixture(autouse=True)
+def gene_lists(tmp_path, monkeypatch):
+    """Get stand-in gene lists by organism, or an error to raise instead
+    """
+    # Scratch files go to tmp/, relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(
+        get_interactions, "lib_organisms", ["Homo sapiens", "Mus musculus"]
+    )
+
+    genes_by_organism = {}
+    def fetch_pathway_genes(gpml_dir, organism, *args, **kwargs):
+        genes = genes_by_organism.get(organism, [])
+        if isinstance(genes, Exception):
+            raise genes
+        return genes
+    monkeypatch.setattr(
+        get_interactions, "fetch_pathway_genes", fetch_pathway_genes
+    )
+    return genes_by_organism
+
+all_organisms = ["Homo sapiens", "Mus musculus"]
+
+def test_failed_fetch_is_skipped_not_fatal():
+    cache = make_cache(FakeClient(failing=["TP53"]), reuse=True)
+    cache.populate_genes(["MTOR", "TP53"], "Homo sapiens")
+
+    assert os.path.exists("data/gene/MTOR.json.gz")
+    assert not os.path.exists("data/gene/TP53.json.gz")
+    metrics = cache.metrics
+    assert metrics.get_count("fetch_errors", "Homo sapiens") == 1
+    assert metrics.get_count("optimize_missing_input", "Homo sapiens") == 1
+
+def test_resume_skips_journaled_error_without_crashing():
+    make_cache(FakeClient(failing=["TP53"]), reuse=True).populate_genes(
+        ["MTOR", "TP53"], "Homo sapiens"
+    )
+
+    # TP53 failed once, and by default is not retried
+    client = FakeClient()
+    cache = make_cache(client, reuse=True)
+    cache.populate_genes(["MTOR", "TP53"], "Homo sapiens")
+
+    assert client.queries == []
+    metrics = cache.metrics
+    assert metrics.get_count("fetch_cached", "Homo sapiens") == 1
+    assert metrics.get_count("fetch_skipped_errors", "Homo sapiens") == 1
+    assert metrics.get_count("optimize_unchanged", "Homo sapiens") == 1
+    assert metrics.get_count("optimize_missing_input", "Homo sapiens") == 1
+
+def test_resume_retries_error_up_to_max_attempts():
+    make_cache(FakeClient(failing=["TP53"]), reuse=True).populate_genes(
+        ["TP53"], "Homo sapiens"
+    )
+
+    client = FakeClient()
+    cache = make_cache(client, reuse=True, max_attempts=2)
+    cache.populate_genes(["TP53"], "Homo sapiens")
+
+    assert client.queries == ["TP53"]
+    assert os.path.exists("data/gene/TP53.json.gz")
+
+def test_resume_refetches_ok_gene_whose_raw_file_is_gone():
+    make_cache(FakeClient(), reuse=True).populate_genes(
+        ["MTOR"], "Homo sapiens"
+    )
+    os.remove("tmp/gene/MTOR.json")
+
+    client = FakeClient()
+    make_cache(client, reuse=True).populate_genes(["MTOR"], "Homo sapiens")
+
+    assert client.queries == ["MTOR"]
+    assert os.path.exists("data/gene/MTOR.json.gz")
+
+def test_subset_run_keeps_other_organisms_outputs(gene_lists):
+    gene_lists["Homo sapiens"] = ["A2M", "MTOR"]
+    gene_lists["Mus musculus"] = ["Mtor"]
+    make_cache(FakeClient()).populate(all_organisms)
+    assert os.path.exists("data/gene/A2M.json.gz")
+
+    make_cache(FakeClient()).populate(["Mus musculus"])
+
+    assert os.path.exists("data/gene/A2M.json.gz")
+    assert os.path.exists("data/gene/MTOR.json.gz")
+
+def test_full_run_prunes_genes_no_longer_queried(gene_lists):
+    gene_lists["Homo sapiens"] = ["A2M", "MTOR"]
+    make_cache(FakeClient()).populate(all_organisms)
+
+    gene_lists["Homo sapiens"] = ["MTOR"]
+    make_cache(FakeClient()).populate(all_organisms)
+
+    assert not os.path.exists("data/gene/A2M.json.gz")
+    assert os.path.exists("data/gene/MTOR.json.gz")
+
+def test_full_run_keeps_output_of_failed_fetch(gene_lists):
+    gene_lists["Homo sapiens"] = ["A2M", "MTOR"]
+    make_cache(FakeClient()).populate(all_organisms)
+    os.remove("tmp/gene/A2M.json")
+
+    make_cache(FakeClient(failing=["A2M"])).populate(all_organisms)
+
+    assert os.path.exists("data/gene/A2M.json.gz")
+
+def test_full_run_keeps_outputs_of_organism_whose_gene_list_failed(
+    gene_lists
+):
+    gene_lists["Homo sapiens"] = ["MTOR"]
+    gene_lists["Mus musculus"] = ["A2m"]
+    make_cache(FakeClient()).populate(all_organisms)
+
+    gene_lists["Mus musculus"] = ValueError("Not a gene list")
+    cache = make_cache(FakeClient())
+    cache.populate(all_organisms)
+
+    assert cache.metrics.get_count("gene_list_errors", "Mus musculus") == 1
+    assert os.path.exists("data/gene/A2M.json.gz")
+
+def test_full_run_prunes_when_organism_has_no_gene_list(gene_lists):
+    gene_lists["Homo sapiens"] = ["MTOR"]
+    gene_lists["Mus musculus"] = ["A2m"]
+    make_cache(FakeClient()).populate(all_organisms)
+
+    gene_lists["Mus musculus"] = FileNotFoundError("No local gene list")
+    cache = make_cache(FakeClient())
+    cache.populate(all_organisms)
+
+    assert cache.metrics.get_count("gene_list_missing", "Mus musculus") == 1
+    assert not os.path.exists("data/gene/A2M.json.gz")
+
+def test_queries_are_deduped_across_organisms_in_run(gene_lists):
+    gene_lists["Homo sapiens"] = ["MTOR"]
+    gene_lists["Mus musculus"] = ["Mtor"]
+    client = FakeClient()
+    make_cache(client).populate(all_organisms)
+
+    assert client.queries == ["MTOR"]
+
+def list_records(gene):
+    return sorted(
+        name for name in os.listdir("data/gene")
+        if name.startswith(gene + ".json.")
+    )
+
+def test_switching_codec_keeps_one_record_variant_per_gene():
+    genes = ["A2M", "MTOR"]
+    make_cache(FakeClient()).populate_genes(genes, "Homo sapiens")
+    assert list_records("MTOR") == ["MTOR.json.gz"]
+
+    cache = make_cache(FakeClient(), codec="zdict")
+    cache.populate_genes(genes, "Homo sapiens")
+    cache.write_zdict_records()
+    assert list_records("MTOR") == ["MTOR.json.zlib"]
+
+    make_cache(FakeClient()).populate_genes(genes, "Homo sapiens")
+    assert list_records("MTOR") == ["MTOR.json.gz"]
+
+    index = InteractionIndex("data/gene/")
+    assert len(index) == 2
+    assert index.get("Mtor") is not None
+
+def test_index_rejects_gene_with_both_record_variants():
+    make_cache(FakeClient()).populate_genes(["MTOR"], "Homo sapiens")
+    cache = make_cache(FakeClient(), codec="zdict")
+    cache.populate_genes(["MTOR"], "Homo sapiens")
+    cache.write_zdict_records()
+    make_cache(FakeClient()).populate_genes(["MTOR"], "Homo sapiens")
+    # E.g. a stale file copied back in by hand
+    with open("data/gene/MTOR.json.zlib", "wb") as f:
+        f.write(b"")
+
+    with pytest.raises(ValueError, match="MTOR"):
+        InteractionIndex("data/gene/")
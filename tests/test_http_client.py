@@ -0,0 +1,51 @@
+"""Retry and error contract of http_client.HttpClient
+"""
+import io
+
+import pytest
+import requests
+
+from http_client import HttpClient
+
+def make_response(status):
+    response = requests.Response()
+    response.status_code = status
+    response.url = "http://stand-in/"
+    response.raw = io.BytesIO(b"")
+    return response
+
+class FakeSession():
+    """Returns responses with the given statuses, in order
+    """
+
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+        self.calls = 0
+
+    def get(self, url, **kwargs):
+        self.calls += 1
+        return make_response(self.statuses.pop(0))
+
+def make_client(statuses, max_retries=2):
+    client = HttpClient(max_retries=max_retries, backoff=0)
+    client.session = FakeSession(statuses)
+    return client
+
+def test_retries_transient_errors_then_returns_response():
+    client = make_client([503, 429, 200])
+    assert client.get("http://stand-in/").status_code == 200
+    assert client.session.calls == 3
+
+def test_raises_on_final_error_with_response():
+    client = make_client([503, 503, 503])
+    with pytest.raises(requests.HTTPError) as error:
+        client.get("http://stand-in/")
+    assert error.value.response.status_code == 503
+    assert client.session.calls == 3
+
+def test_raises_on_client_error_without_retrying():
+    client = make_client([404])
+    with pytest.raises(requests.HTTPError) as error:
+        client.get("http://stand-in/")
+    assert error.value.response.status_code == 404
+    assert client.session.calls == 1
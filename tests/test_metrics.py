@@ -0,0 +1,48 @@
+"""Stage timing and profiling in metrics.Metrics
+"""
+import os
+import threading
+
+from metrics import Metrics
+
+def run_stage(metrics, name, organism):
+    with metrics.stage(name, organism):
+        sum(range(1000))
+
+def test_nested_stages_share_one_profile(tmp_path):
+    metrics = Metrics(str(tmp_path))
+    with metrics.stage("outer"):
+        run_stage(metrics, "inner", "all")
+
+    assert sorted(os.listdir(tmp_path)) == ["all-outer.prof", "all-outer.txt"]
+    stages = metrics.summary()["organisms"]["all"]["stage_seconds"]
+    assert set(stages) == {"outer", "inner"}
+
+def test_stages_in_threads_are_timed_not_profiled(tmp_path, capsys):
+    metrics = Metrics(str(tmp_path))
+    threads = [
+        threading.Thread(
+            target=run_stage, args=[metrics, "fetch", organism]
+        )
+        for organism in ["Homo sapiens", "Mus musculus", "Danio rerio"]
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert os.listdir(tmp_path) == []
+    organisms = metrics.summary()["organisms"]
+    assert "fetch" in organisms["Mus musculus"]["stage_seconds"]
+    # Noted once, not per stage
+    assert capsys.readouterr().out.count("not profiled") == 1
+
+def test_main_thread_profiles_again_after_stage_ends(tmp_path):
+    metrics = Metrics(str(tmp_path))
+    run_stage(metrics, "first", "Homo sapiens")
+    run_stage(metrics, "second", "Homo sapiens")
+
+    assert sorted(os.listdir(tmp_path)) == [
+        "homo-sapiens-first.prof", "homo-sapiens-first.txt",
+        "homo-sapiens-second.prof", "homo-sapiens-second.txt"
+    ]